@@ -4,6 +4,8 @@
 #include "async_queue/AsyncQueue.h"
 #include "async_queue/EDC.h"
 #include "async_queue/TVC.h"
+#include "async_queue/DraftingPolicy.h"
+#include <algorithm>
 #include <memory>
 #include <fstream>
 
@@ -20,11 +22,21 @@ struct AHASDConfig {
     float npu_freq_mhz;
     uint32_t max_draft_length;
     uint32_t min_preverify_length;
+    bool enable_tree_drafting;  // Token-tree drafts verified in one NPU pass
+    uint32_t tree_top_k;        // Branching factor per draft position
+    std::string drafting_policy;        // edc, threshold, learned or external
+    float policy_entropy_threshold;     // threshold policy / external fallback
+    std::string policy_model_path;      // Weights for the learned policy
+    std::string policy_shm_name;        // Shared-memory ring of the external policy
+    uint64_t policy_timeout_us;         // External policy response timeout
     
     AHASDConfig() 
         : enable_edc(true), enable_tvc(true), enable_aau(true),
           pim_freq_mhz(800.0f), npu_freq_mhz(1000.0f),
-          max_draft_length(16), min_preverify_length(2) {}
+          max_draft_length(16), min_preverify_length(2),
+          enable_tree_drafting(false), tree_top_k(2),
+          drafting_policy("edc"), policy_entropy_threshold(2.5f),
+          policy_shm_name("/ahasd_policy"), policy_timeout_us(1000000) {}
 };
 
 class AHASDIntegration {
@@ -33,12 +45,13 @@ private:
     
     // Core components
     std::unique_ptr<AsyncQueueManager> queue_manager_;
-    std::unique_ptr<EDC> edc_;
+    std::unique_ptr<DraftingPolicy> drafting_policy_;
     std::unique_ptr<TVC> tvc_;
     
     // State tracking
     uint32_t current_kv_length_;
     uint32_t current_batch_id_;
+    uint32_t last_tree_nodes_;  // Query tokens of the last tree verification
     bool npu_busy_;
     bool pim_busy_;
     
@@ -48,6 +61,9 @@ private:
     uint64_t total_preverifications_;
     uint64_t total_npu_idle_cycles_;
     uint64_t total_pim_idle_cycles_;
+    uint64_t total_npu_passes_;
+    uint64_t total_tree_drafts_;
+    uint64_t total_tree_nodes_;
     double total_draft_entropy_;
     
     // Timing
@@ -57,21 +73,127 @@ private:
     // Logging
     std::ofstream trace_file_;
     bool enable_tracing_;
+    
+    bool push_draft_batch(DraftBatch& batch, const std::vector<float>& entropies,
+                          uint64_t cycle) {
+        batch.batch_id = current_batch_id_++;
+        batch.entropy_values = entropies;
+        batch.timestamp = cycle;
+        batch.verified = false;
+        batch.accepted = false;
+        
+        // Calculate average entropy
+        float avg_entropy = 0.0f;
+        for (float e : entropies) {
+            avg_entropy += e;
+        }
+        if (!entropies.empty()) {
+            avg_entropy /= entropies.size();
+        }
+        total_draft_entropy_ += avg_entropy;
+        
+        bool success = queue_manager_->push_draft(batch);
+        if (success) {
+            total_drafts_generated_++;
+            
+            if (enable_tracing_) {
+                trace_file_ << cycle << (batch.is_tree() ? ",tree_generated," : ",draft_generated,")
+                           << batch.batch_id << "," << batch.draft_length << "," << avg_entropy 
+                           << ",NA\n";
+            }
+        }
+        
+        return success;
+    }
+    
+    void apply_verification_feedback(const FeedbackData& feedback, uint32_t npu_length) {
+        queue_manager_->push_feedback(feedback);
+        total_npu_passes_++;
+        
+        if (feedback.fully_accepted || feedback.accepted_length > 0) {
+            total_drafts_accepted_ += feedback.accepted_length;
+        }
+        
+        current_kv_length_ = feedback.kv_cache_length;
+        
+        // Update drafting policy (EDC PHT training)
+        if (drafting_policy_ != nullptr) {
+            drafting_policy_->on_verification(feedback.fully_accepted, feedback.accepted_length);
+        }
+        
+        // Update TVC
+        if (config_.enable_tvc && tvc_ != nullptr) {
+            tvc_->record_npu_verification(feedback.verification_cycles, npu_length);
+        }
+        
+        if (enable_tracing_) {
+            trace_file_ << queue_manager_->get_npu_cycles() 
+                       << ",verification_result," << feedback.batch_id << "," 
+                       << feedback.accepted_length << ",0.0," 
+                       << (feedback.fully_accepted ? "full" : "partial") << "\n";
+        }
+    }
+    
+    void request_preverification(uint32_t length, const char* source) {
+        PreVerifyRequest req;
+        req.verify_length = length;
+        req.timestamp = queue_manager_->get_pim_cycles();
+        req.urgent = false;
+        queue_manager_->push_preverify_request(req);
+        total_preverifications_++;
+        
+        if (enable_tracing_) {
+            trace_file_ << queue_manager_->get_pim_cycles() 
+                       << ",preverify_inserted,0," << length 
+                       << ",0.0," << source << "\n";
+        }
+    }
+    
+    // Act on the pre-verification part of a policy decision
+    void apply_preverify_decision(const DraftingDecision& decision) {
+        uint32_t pending = queue_manager_->get_unverified_count();
+        
+        if (decision.preverify_length > 0) {
+            uint32_t length = std::min<uint32_t>(decision.preverify_length, pending);
+            if (length > 0) {
+                request_preverification(length, drafting_policy_->name());
+            }
+            return;
+        }
+        
+        // Check TVC for pre-verification opportunity
+        if (decision.preverify_length == PREVERIFY_DEFER_TO_TVC && !decision.continue_drafting &&
+            config_.enable_tvc && tvc_ != nullptr && pending >= config_.min_preverify_length) {
+            // Tree verification also attends over the previous tree's nodes
+            auto [should_preverify, length] = tvc_->should_insert_preverification(
+                current_kv_length_ + last_tree_nodes_, pending);
+            
+            if (should_preverify) {
+                request_preverification(length, "tvc");
+            }
+        }
+    }
 
 public:
     AHASDIntegration(const AHASDConfig& config = AHASDConfig())
         : config_(config), current_kv_length_(0), current_batch_id_(0),
+          last_tree_nodes_(0),
           npu_busy_(false), pim_busy_(false),
           total_drafts_generated_(0), total_drafts_accepted_(0),
           total_preverifications_(0), total_npu_idle_cycles_(0),
-          total_pim_idle_cycles_(0), total_draft_entropy_(0.0),
+          total_pim_idle_cycles_(0), total_npu_passes_(0),
+          total_tree_drafts_(0), total_tree_nodes_(0), total_draft_entropy_(0.0),
           last_verification_start_(0), last_drafting_start_(0),
           enable_tracing_(false) {
         
         queue_manager_ = std::make_unique<AsyncQueueManager>();
         
-        if (config_.enable_edc) {
-            edc_ = std::make_unique<EDC>();
+        // EDC is gated by enable_edc; other policies replace it when selected
+        if (config_.drafting_policy != "edc" || config_.enable_edc) {
+            drafting_policy_ = create_drafting_policy(
+                config_.drafting_policy, config_.policy_entropy_threshold,
+                config_.policy_model_path, config_.policy_shm_name,
+                config_.policy_timeout_us);
         }
         
         if (config_.enable_tvc) {
@@ -99,75 +221,86 @@ public:
                            const std::vector<float>& entropies,
                            uint64_t cycle) {
         DraftBatch batch;
-        batch.batch_id = current_batch_id_++;
         batch.draft_length = tokens.size();
         batch.token_ids = tokens;
-        batch.entropy_values = entropies;
-        batch.timestamp = cycle;
-        batch.verified = false;
-        batch.accepted = false;
         
-        // Calculate average entropy
-        float avg_entropy = 0.0f;
-        for (float e : entropies) {
-            avg_entropy += e;
+        return push_draft_batch(batch, entropies, cycle);
+    }
+    
+    // PIM-side: Generate token-tree draft (top-k candidates per position)
+    // parents[i] is the index of node i's parent (-1 for the root's children)
+    // and must be smaller than i; entropies are per node
+    bool submit_draft_tree(const std::vector<int32_t>& tokens,
+                           const std::vector<int32_t>& parents,
+                           const std::vector<float>& entropies,
+                           uint64_t cycle) {
+        if (tokens.empty() || parents.size() != tokens.size()) {
+            return false;
         }
-        if (!entropies.empty()) {
-            avg_entropy /= entropies.size();
+        
+        uint32_t depth = DraftBatch::tree_depth(parents);
+        if (depth == 0) {
+            return false;  // Malformed tree
         }
-        total_draft_entropy_ += avg_entropy;
         
-        bool success = queue_manager_->push_draft(batch);
+        DraftBatch batch;
+        batch.draft_length = depth;
+        batch.token_ids = tokens;
+        batch.parent_ids = parents;
+        batch.tree_width = config_.tree_top_k;
+        
+        bool success = push_draft_batch(batch, entropies, cycle);
         if (success) {
-            total_drafts_generated_++;
-            
-            if (enable_tracing_) {
-                trace_file_ << cycle << ",draft_generated," << batch.batch_id 
-                           << "," << batch.draft_length << "," << avg_entropy 
-                           << ",NA\n";
-            }
+            total_tree_drafts_++;
+            total_tree_nodes_ += tokens.size();
         }
         
         return success;
     }
     
+    // Policy inputs for the current queue state
+    DraftingState make_drafting_state(float avg_entropy) const {
+        DraftingState state;
+        state.avg_entropy = avg_entropy;
+        state.pending_drafts = queue_manager_->get_unverified_count();
+        state.kv_length = current_kv_length_;
+        state.max_draft_length = config_.max_draft_length;
+        return state;
+    }
+    
     // PIM-side: Check if should continue drafting
     bool should_continue_drafting(float avg_entropy) {
-        if (!config_.enable_edc || edc_ == nullptr) {
-            // Without EDC, always continue up to max length
+        if (drafting_policy_ == nullptr) {
+            // Without drafting control, always continue up to max length
             return queue_manager_->get_unverified_count() < config_.max_draft_length;
         }
         
-        bool edc_decision = edc_->should_continue_drafting(avg_entropy);
+        DraftingDecision decision = drafting_policy_->decide(make_drafting_state(avg_entropy));
+        apply_preverify_decision(decision);
         
-        // Check TVC for pre-verification opportunity
-        if (!edc_decision && config_.enable_tvc && tvc_ != nullptr) {
-            uint32_t pending = queue_manager_->get_unverified_count();
-            if (pending >= config_.min_preverify_length) {
-                auto [should_preverify, length] = tvc_->should_insert_preverification(
-                    current_kv_length_, pending);
-                
-                if (should_preverify) {
-                    // Submit pre-verification request
-                    PreVerifyRequest req;
-                    req.verify_length = length;
-                    req.timestamp = queue_manager_->get_pim_cycles();
-                    req.urgent = false;
-                    queue_manager_->push_preverify_request(req);
-                    total_preverifications_++;
-                    
-                    if (enable_tracing_) {
-                        trace_file_ << queue_manager_->get_pim_cycles() 
-                                   << ",preverify_inserted,0," << length 
-                                   << ",0.0,tvc\n";
-                    }
-                }
+        return decision.continue_drafting;
+    }
+    
+    // PIM-side: Decide for several drafting streams (e.g. drafting groups) in one call
+    void decide_drafting_batch(const std::vector<DraftingState>& states,
+                               std::vector<DraftingDecision>& decisions) {
+        decisions.assign(states.size(), DraftingDecision());
+        if (drafting_policy_ == nullptr) {
+            for (size_t i = 0; i < states.size(); i++) {
+                decisions[i].continue_drafting =
+                    states[i].pending_drafts < states[i].max_draft_length;
             }
+            return;
         }
         
-        return edc_decision;
+        drafting_policy_->decide(states.data(), decisions.data(), states.size());
+        for (const auto& decision : decisions) {
+            apply_preverify_decision(decision);
+        }
     }
     
+    DraftingPolicy* get_drafting_policy() const { return drafting_policy_.get(); }
+    
     // NPU-side: Pop draft for verification
     bool get_next_draft(DraftBatch& batch) {
         return queue_manager_->pop_draft(batch);
@@ -184,30 +317,25 @@ public:
         feedback.verification_cycles = verification_cycles;
         feedback.kv_cache_length = kv_length;
         
-        queue_manager_->push_feedback(feedback);
-        
-        if (fully_accepted || accepted_length > 0) {
-            total_drafts_accepted_ += accepted_length;
-        }
-        
-        current_kv_length_ = kv_length;
-        
-        // Update EDC
-        if (config_.enable_edc && edc_ != nullptr) {
-            edc_->update_on_verification(fully_accepted, accepted_length);
-        }
-        
-        // Update TVC
-        if (config_.enable_tvc && tvc_ != nullptr) {
-            tvc_->record_npu_verification(verification_cycles, kv_length);
-        }
+        last_tree_nodes_ = 0;
+        apply_verification_feedback(feedback, kv_length);
+    }
+    
+    // NPU-side: Submit feedback for a token tree verified in one pass
+    // accepted_length is the length of the longest accepted root-to-leaf path;
+    // the draft counts as fully accepted when that path spans the whole tree depth
+    void submit_tree_verification_result(const DraftBatch& tree, uint32_t accepted_length,
+                                         uint64_t verification_cycles, uint32_t kv_length) {
+        FeedbackData feedback;
+        feedback.batch_id = tree.batch_id;
+        feedback.accepted_length = std::min(accepted_length, tree.draft_length);
+        feedback.fully_accepted = (feedback.accepted_length == tree.draft_length);
+        feedback.verification_cycles = verification_cycles;
+        feedback.kv_cache_length = kv_length;
         
-        if (enable_tracing_) {
-            trace_file_ << queue_manager_->get_npu_cycles() 
-                       << ",verification_result," << batch_id << "," 
-                       << accepted_length << ",0.0," 
-                       << (fully_accepted ? "full" : "partial") << "\n";
-        }
+        // The NPU pass processes every tree node on top of the KV cache
+        last_tree_nodes_ = tree.num_nodes();
+        apply_verification_feedback(feedback, kv_length + tree.num_nodes());
     }
     
     // PIM-side: Check for feedback
@@ -220,7 +348,7 @@ public:
         return queue_manager_->pop_preverify_request(request);
     }
     
-    // Record PIM drafting time
+    // Record PIM drafting time (draft_length = number of tree nodes for token trees)
     void record_pim_drafting(uint64_t cycles, uint32_t draft_length) {
         if (config_.enable_tvc && tvc_ != nullptr) {
             tvc_->record_pim_drafting(cycles, draft_length);
@@ -297,6 +425,16 @@ public:
         return total_draft_entropy_ / total_drafts_generated_;
     }
     
+    double get_accepted_tokens_per_npu_pass() const {
+        if (total_npu_passes_ == 0) return 0.0;
+        return static_cast<double>(total_drafts_accepted_) / total_npu_passes_;
+    }
+    
+    double get_average_tree_nodes() const {
+        if (total_tree_drafts_ == 0) return 0.0;
+        return static_cast<double>(total_tree_nodes_) / total_tree_drafts_;
+    }
+    
     void print_statistics() const {
         spdlog::info("=== AHASD Integration Statistics ===");
         spdlog::info("Total Drafts Generated: {}", total_drafts_generated_);
@@ -304,13 +442,20 @@ public:
                     total_drafts_accepted_, get_acceptance_rate() * 100.0);
         spdlog::info("Total Pre-verifications: {}", total_preverifications_);
         spdlog::info("Average Draft Entropy: {:.3f}", get_average_entropy());
+        spdlog::info("NPU Verification Passes: {}", total_npu_passes_);
+        spdlog::info("Accepted Tokens per NPU Pass: {:.3f}", get_accepted_tokens_per_npu_pass());
+        if (config_.enable_tree_drafting) {
+            spdlog::info("Tree Drafts: {} (top-k {}), Tree Nodes: {}, Average Nodes per Tree: {:.2f}",
+                        total_tree_drafts_, config_.tree_top_k, total_tree_nodes_,
+                        get_average_tree_nodes());
+        }
         spdlog::info("NPU Idle Cycles: {}", total_npu_idle_cycles_);
         spdlog::info("PIM Idle Cycles: {}", total_pim_idle_cycles_);
         
         queue_manager_->print_statistics();
         
-        if (config_.enable_edc && edc_ != nullptr) {
-            edc_->print_statistics();
+        if (drafting_policy_ != nullptr) {
+            drafting_policy_->print_statistics();
         }
         
         if (config_.enable_tvc && tvc_ != nullptr) {
@@ -346,11 +491,12 @@ public:
     void reset() {
         current_kv_length_ = 0;
         current_batch_id_ = 0;
+        last_tree_nodes_ = 0;
         npu_busy_ = false;
         pim_busy_ = false;
         
-        if (edc_ != nullptr) {
-            edc_->reset();
+        if (drafting_policy_ != nullptr) {
+            drafting_policy_->reset();
         }
         
         if (tvc_ != nullptr) {
@@ -133,6 +133,42 @@ SimulationConfig initialize_config(json config) {
   parsed_config.precision = get_config_value<uint32_t>(config, "precision");
   parsed_config.layout = get_config_value<std::string>(config, "layout");
 
+  /* AHASD config (written by scripts/run_single_config.py) */
+  if (config.contains("ahasd")) {
+    auto ahasd_config = config["ahasd"];
+    if (ahasd_config.contains("enable_edc"))
+      parsed_config.enable_edc = ahasd_config["enable_edc"];
+    if (ahasd_config.contains("enable_tvc"))
+      parsed_config.enable_tvc = ahasd_config["enable_tvc"];
+    if (ahasd_config.contains("enable_aau"))
+      parsed_config.enable_aau = ahasd_config["enable_aau"];
+    if (ahasd_config.contains("max_draft_length"))
+      parsed_config.max_draft_length = ahasd_config["max_draft_length"];
+    if (ahasd_config.contains("draft_tree")) {
+      auto tree_config = ahasd_config["draft_tree"];
+      parsed_config.enable_tree_drafting =
+          tree_config.value("enabled", parsed_config.enable_tree_drafting);
+      parsed_config.tree_top_k = tree_config.value("top_k", parsed_config.tree_top_k);
+    }
+    if (ahasd_config.contains("drafting_policy")) {
+      auto policy_config = ahasd_config["drafting_policy"];
+      parsed_config.drafting_policy = policy_config["type"];
+      if (policy_config.contains("entropy_threshold"))
+        parsed_config.policy_entropy_threshold = policy_config["entropy_threshold"];
+      if (policy_config.contains("model_path") && !policy_config["model_path"].is_null())
+        parsed_config.policy_model_path = policy_config["model_path"];
+      if (policy_config.contains("shm_name"))
+        parsed_config.policy_shm_name = policy_config["shm_name"];
+      if (policy_config.contains("timeout_us"))
+        parsed_config.policy_timeout_us = policy_config["timeout_us"];
+    }
+    /* The integration layer only ticks when asked to or when a feature needs it */
+    parsed_config.enable_ahasd = ahasd_config.value(
+        "enable_ahasd", parsed_config.enable_edc || parsed_config.enable_tvc ||
+                            parsed_config.enable_aau || parsed_config.enable_tree_drafting ||
+                            parsed_config.drafting_policy != "edc");
+  }
+
   if (config.contains("partition")) {
     for (int i=0; i<parsed_config.num_cores; i++) {
       std::string core_partition = "core_" + std::to_string(i);
@@ -76,6 +76,13 @@ struct SimulationConfig {
   bool enable_tvc = true;
   bool enable_aau = true;
   uint32_t max_draft_length = 16;
+  bool enable_tree_drafting = false;
+  uint32_t tree_top_k = 2;
+  std::string drafting_policy = "edc";
+  float policy_entropy_threshold = 2.5f;
+  std::string policy_model_path;
+  std::string policy_shm_name = "/ahasd_policy";
+  uint64_t policy_timeout_us = 1000000;
 
   /*
    * This map stores the partition information: <partition_id, core_id>
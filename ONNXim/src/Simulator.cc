@@ -84,6 +84,13 @@ Simulator::Simulator(SimulationConfig config, bool language_mode)
     ahasd_config.pim_freq_mhz = _config.dram_freq;  // PIM freq = DRAM freq
     ahasd_config.npu_freq_mhz = _config.core_freq;  // NPU freq = Core freq
     ahasd_config.max_draft_length = _config.max_draft_length;
+    ahasd_config.enable_tree_drafting = _config.enable_tree_drafting;
+    ahasd_config.tree_top_k = _config.tree_top_k;
+    ahasd_config.drafting_policy = _config.drafting_policy;
+    ahasd_config.policy_entropy_threshold = _config.policy_entropy_threshold;
+    ahasd_config.policy_model_path = _config.policy_model_path;
+    ahasd_config.policy_shm_name = _config.policy_shm_name;
+    ahasd_config.policy_timeout_us = _config.policy_timeout_us;
     _ahasd = std::make_unique<AHASD::AHASDIntegration>(ahasd_config);
     spdlog::info("[AHASD] Enabled - EDC:{} TVC:{} AAU:{}", 
                  ahasd_config.enable_edc, ahasd_config.enable_tvc, ahasd_config.enable_aau);
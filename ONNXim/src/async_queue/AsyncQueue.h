@@ -1,5 +1,6 @@
 #pragma once
 
+#include <algorithm>
 #include <queue>
 #include <mutex>
 #include <condition_variable>
@@ -19,15 +20,37 @@ enum class QueueType {
 
 struct DraftBatch {
     uint32_t batch_id;
-    uint32_t draft_length;
-    std::vector<int32_t> token_ids;
+    uint32_t draft_length;              // Tokens on the longest path (tree depth for trees)
+    std::vector<int32_t> token_ids;     // Flat sequence, or tree nodes with parents first
+    std::vector<int32_t> parent_ids;    // Token trees only: parent node index, -1 for root
     std::vector<float> entropy_values;  // For EDC calculation
+    uint32_t tree_width;                // Top-k branching per position (1 = flat sequence)
     uint64_t timestamp;
     bool verified;
     bool accepted;
     
-    DraftBatch() : batch_id(0), draft_length(0), timestamp(0), 
+    DraftBatch() : batch_id(0), draft_length(0), tree_width(1), timestamp(0), 
                    verified(false), accepted(false) {}
+    
+    bool is_tree() const { return !parent_ids.empty(); }
+    
+    uint32_t num_nodes() const { return token_ids.size(); }
+    
+    // Depth of the token tree, 0 if parent_ids is malformed
+    // (every parent must precede its children)
+    static uint32_t tree_depth(const std::vector<int32_t>& parent_ids) {
+        std::vector<uint32_t> depth(parent_ids.size(), 0);
+        uint32_t max_depth = 0;
+        for (size_t i = 0; i < parent_ids.size(); i++) {
+            int32_t parent = parent_ids[i];
+            if (parent >= static_cast<int32_t>(i)) {
+                return 0;
+            }
+            depth[i] = (parent < 0) ? 1 : depth[parent] + 1;
+            max_depth = std::max(max_depth, depth[i]);
+        }
+        return max_depth;
+    }
 };
 
 struct FeedbackData {
@@ -0,0 +1,461 @@
+#pragma once
+
+#include <algorithm>
+#include <vector>
+#include <string>
+#include <memory>
+#include <chrono>
+#include <cmath>
+#include <cstdint>
+#include <cstring>
+#include <fstream>
+#include <thread>
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+#include "../Common.h"
+#include "EDC.h"
+
+// Drafting-Control Policies
+// Serve the PIM-side continue/stop and pre-verification decisions. EDC is the
+// hardware policy; the threshold rule, the learned model and the external
+// (shared-memory) policy let new controllers be evaluated without rebuilding
+
+namespace AHASD {
+
+// Inputs of one drafting decision
+struct DraftingState {
+    float avg_entropy;          // Average entropy of the latest draft batch
+    uint32_t pending_drafts;    // Unverified drafts in the queue
+    uint32_t kv_length;         // Committed KV cache length
+    uint32_t max_draft_length;  // Configured draft length limit
+};
+
+// Preverify length meaning "let TVC decide"
+constexpr int32_t PREVERIFY_DEFER_TO_TVC = -1;
+
+struct DraftingDecision {
+    bool continue_drafting;
+    int32_t preverify_length;   // >0: request pre-verification, 0: none, -1: defer to TVC
+
+    DraftingDecision() : continue_drafting(true),
+                         preverify_length(PREVERIFY_DEFER_TO_TVC) {}
+};
+
+class DraftingPolicy {
+protected:
+    uint64_t total_decisions_;
+    uint64_t stop_decisions_;
+    uint64_t decision_ns_;  // Wall-clock time spent deciding
+
+    void record_decision(const DraftingDecision& decision) {
+        total_decisions_++;
+        if (!decision.continue_drafting) {
+            stop_decisions_++;
+        }
+    }
+
+public:
+    DraftingPolicy() : total_decisions_(0), stop_decisions_(0), decision_ns_(0) {}
+    virtual ~DraftingPolicy() = default;
+
+    virtual const char* name() const = 0;
+
+    // Decide for each state in order; batching amortizes per-call overhead
+    void decide(const DraftingState* states, DraftingDecision* decisions, size_t count) {
+        auto start = std::chrono::steady_clock::now();
+        decide_batch(states, decisions, count);
+        decision_ns_ += std::chrono::duration_cast<std::chrono::nanoseconds>(
+            std::chrono::steady_clock::now() - start).count();
+        for (size_t i = 0; i < count; i++) {
+            record_decision(decisions[i]);
+        }
+    }
+
+    DraftingDecision decide(const DraftingState& state) {
+        DraftingDecision decision;
+        decide(&state, &decision, 1);
+        return decision;
+    }
+
+    // Called after each NPU verification
+    virtual void on_verification(bool fully_accepted, uint32_t accepted_length) {}
+
+    // Reset state (for new inference sequence)
+    virtual void reset() {}
+
+    double get_stop_rate() const {
+        if (total_decisions_ == 0) return 0.0;
+        return static_cast<double>(stop_decisions_) / total_decisions_;
+    }
+
+    double get_average_decision_ns() const {
+        if (total_decisions_ == 0) return 0.0;
+        return static_cast<double>(decision_ns_) / total_decisions_;
+    }
+
+    virtual void print_statistics() const {
+        spdlog::info("=== Drafting Policy Statistics ===");
+        spdlog::info("Policy: {}", name());
+        spdlog::info("Decisions: {}, Stop: {} ({:.2f}%)",
+                    total_decisions_, stop_decisions_, get_stop_rate() * 100.0);
+        spdlog::info("Average Decision Latency: {:.1f} ns", get_average_decision_ns());
+    }
+
+protected:
+    virtual void decide_batch(const DraftingState* states, DraftingDecision* decisions,
+                              size_t count) = 0;
+};
+
+// Hardware EDC predictor (PHT indexed by entropy history)
+class EDCPolicy : public DraftingPolicy {
+private:
+    EDC edc_;
+
+public:
+    const char* name() const override { return "edc"; }
+
+    void on_verification(bool fully_accepted, uint32_t accepted_length) override {
+        edc_.update_on_verification(fully_accepted, accepted_length);
+    }
+
+    void reset() override { edc_.reset(); }
+
+    const EDC& get_edc() const { return edc_; }
+
+    void print_statistics() const override {
+        DraftingPolicy::print_statistics();
+        edc_.print_statistics();
+    }
+
+protected:
+    void decide_batch(const DraftingState* states, DraftingDecision* decisions,
+                      size_t count) override {
+        for (size_t i = 0; i < count; i++) {
+            decisions[i].continue_drafting = edc_.should_continue_drafting(states[i].avg_entropy);
+        }
+    }
+};
+
+// Stop drafting once entropy exceeds a fixed threshold or the queue is full
+class ThresholdPolicy : public DraftingPolicy {
+private:
+    float entropy_threshold_;
+
+public:
+    explicit ThresholdPolicy(float entropy_threshold = 2.5f)
+        : entropy_threshold_(entropy_threshold) {}
+
+    const char* name() const override { return "threshold"; }
+
+protected:
+    void decide_batch(const DraftingState* states, DraftingDecision* decisions,
+                      size_t count) override {
+        for (size_t i = 0; i < count; i++) {
+            decisions[i].continue_drafting =
+                states[i].avg_entropy < entropy_threshold_ &&
+                states[i].pending_drafts < states[i].max_draft_length;
+        }
+    }
+};
+
+// Logistic model over {1, entropy, queue fill, kv length / 1K, acceptance EMA}
+// Weights are trained offline and loaded from a whitespace-separated file
+class LearnedPolicy : public DraftingPolicy {
+public:
+    static constexpr size_t NUM_FEATURES = 5;
+
+private:
+    float weights_[NUM_FEATURES];
+    float acceptance_ema_;  // Running estimate of full-acceptance probability
+
+    static constexpr float EMA_ALPHA = 0.125f;
+
+public:
+    LearnedPolicy() : weights_{2.0f, -0.8f, -1.5f, 0.0f, 1.0f}, acceptance_ema_(0.5f) {}
+
+    // Returns false (keeping the default weights) if the file is missing or short
+    bool load_weights(const std::string& path) {
+        std::ifstream file(path);
+        float loaded[NUM_FEATURES];
+        for (size_t i = 0; i < NUM_FEATURES; i++) {
+            if (!(file >> loaded[i])) {
+                return false;
+            }
+        }
+        std::copy(loaded, loaded + NUM_FEATURES, weights_);
+        return true;
+    }
+
+    const char* name() const override { return "learned"; }
+
+    void on_verification(bool fully_accepted, uint32_t accepted_length) override {
+        acceptance_ema_ += EMA_ALPHA * ((fully_accepted ? 1.0f : 0.0f) - acceptance_ema_);
+    }
+
+    void reset() override { acceptance_ema_ = 0.5f; }
+
+protected:
+    void decide_batch(const DraftingState* states, DraftingDecision* decisions,
+                      size_t count) override {
+        for (size_t i = 0; i < count; i++) {
+            const DraftingState& s = states[i];
+            float fill = s.max_draft_length == 0 ? 1.0f :
+                static_cast<float>(s.pending_drafts) / s.max_draft_length;
+            float logit = weights_[0] + weights_[1] * s.avg_entropy + weights_[2] * fill +
+                          weights_[3] * (s.kv_length / 1024.0f) + weights_[4] * acceptance_ema_;
+            // sigmoid(logit) >= 0.5  <=>  logit >= 0
+            decisions[i].continue_drafting =
+                logit >= 0.0f && s.pending_drafts < s.max_draft_length;
+        }
+    }
+};
+
+// Out-of-process policy served by scripts/drafting_policy_host.py over a
+// POSIX shared-memory ring. Layout (little-endian):
+//   header (64 B): magic u32, version u32, capacity u32, slot_size u32,
+//                  request_head u64 (written here), response_head u64
+//                  (written by the host), host_ready u32, shutdown u32
+//   slots (32 B): kind u32, entropy f32, pending u32, kv_length u32,
+//                 max_length/accepted u32, fully_accepted u32,
+//                 response continue i32, response preverify i32
+// The host answers slots in order; a batch of decisions is published with
+// one request_head store and awaited with one response_head poll
+class ExternalPolicy : public DraftingPolicy {
+public:
+    static constexpr uint32_t MAGIC = 0x50444841;  // "AHDP"
+    static constexpr uint32_t VERSION = 1;
+    static constexpr uint32_t HEADER_SIZE = 64;
+    static constexpr uint32_t SLOT_SIZE = 32;
+
+    enum SlotKind : uint32_t { DECIDE = 0, FEEDBACK = 1, RESET = 2 };
+
+private:
+    struct Header {
+        uint32_t magic;
+        uint32_t version;
+        uint32_t capacity;
+        uint32_t slot_size;
+        uint64_t request_head;
+        uint64_t response_head;
+        uint32_t host_ready;
+        uint32_t shutdown;
+        uint8_t reserved[24];
+    };
+
+    struct Slot {
+        uint32_t kind;
+        float avg_entropy;
+        uint32_t pending_drafts;
+        uint32_t kv_length;
+        uint32_t length;          // max_draft_length (DECIDE) / accepted (FEEDBACK)
+        uint32_t fully_accepted;
+        int32_t continue_drafting;
+        int32_t preverify_length;
+    };
+
+    static_assert(sizeof(Header) == HEADER_SIZE, "unexpected policy ring header size");
+    static_assert(sizeof(Slot) == SLOT_SIZE, "unexpected policy ring slot size");
+
+    std::string shm_name_;
+    uint32_t capacity_;
+    uint64_t timeout_us_;
+    size_t region_size_;
+    uint8_t* region_;
+    Header* header_;
+    Slot* slots_;
+    uint64_t next_request_;
+
+    ThresholdPolicy fallback_;  // Used when the host does not answer in time
+    uint64_t timeouts_;
+
+    uint64_t load(const uint64_t* field) const {
+        return __atomic_load_n(field, __ATOMIC_ACQUIRE);
+    }
+
+    void store(uint64_t* field, uint64_t value) {
+        __atomic_store_n(field, value, __ATOMIC_RELEASE);
+    }
+
+    // Spin until the host has answered every slot below seq, yielding the
+    // CPU after a short spin so a host sharing the core can make progress
+    bool wait_for_responses(uint64_t seq) {
+        if (load(&header_->response_head) >= seq) return true;
+        auto deadline = std::chrono::steady_clock::now() +
+                        std::chrono::microseconds(timeout_us_);
+        uint32_t spins = 0;
+        while (load(&header_->response_head) < seq) {
+            if (++spins < 1024) continue;
+            std::this_thread::yield();
+            if ((spins & 0x3F) == 0 && std::chrono::steady_clock::now() > deadline) {
+                return false;
+            }
+        }
+        return true;
+    }
+
+    // Reserve a slot, waiting for the host if the ring is full
+    Slot* acquire_slot() {
+        if (next_request_ - load(&header_->response_head) >= capacity_ &&
+            !wait_for_responses(next_request_ - capacity_ + 1)) {
+            return nullptr;
+        }
+        return &slots_[next_request_ % capacity_];
+    }
+
+    void publish() { store(&header_->request_head, next_request_); }
+
+public:
+    ExternalPolicy(const std::string& shm_name, uint32_t capacity = 1024,
+                   uint64_t timeout_us = 1000000, float fallback_threshold = 2.5f)
+        : shm_name_(shm_name), capacity_(capacity), timeout_us_(timeout_us),
+          region_size_(HEADER_SIZE + static_cast<size_t>(capacity) * SLOT_SIZE),
+          region_(nullptr), header_(nullptr), slots_(nullptr), next_request_(0),
+          fallback_(fallback_threshold), timeouts_(0) {
+        int fd = shm_open(shm_name_.c_str(), O_CREAT | O_RDWR, 0600);
+        if (fd < 0) {
+            spdlog::error("[AHASD] Cannot create policy ring {}: {}", shm_name_, strerror(errno));
+            return;
+        }
+        if (ftruncate(fd, region_size_) != 0) {
+            spdlog::error("[AHASD] Cannot size policy ring {}: {}", shm_name_, strerror(errno));
+            close(fd);
+            return;
+        }
+        void* addr = mmap(nullptr, region_size_, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+        close(fd);
+        if (addr == MAP_FAILED) {
+            spdlog::error("[AHASD] Cannot map policy ring {}: {}", shm_name_, strerror(errno));
+            return;
+        }
+
+        region_ = static_cast<uint8_t*>(addr);
+        std::memset(region_, 0, region_size_);
+        header_ = reinterpret_cast<Header*>(region_);
+        slots_ = reinterpret_cast<Slot*>(region_ + HEADER_SIZE);
+        header_->version = VERSION;
+        header_->capacity = capacity_;
+        header_->slot_size = SLOT_SIZE;
+        __atomic_store_n(&header_->magic, MAGIC, __ATOMIC_RELEASE);
+    }
+
+    ~ExternalPolicy() override {
+        if (region_ != nullptr) {
+            __atomic_store_n(&header_->shutdown, 1u, __ATOMIC_RELEASE);
+            munmap(region_, region_size_);
+            shm_unlink(shm_name_.c_str());
+        }
+    }
+
+    const char* name() const override { return "external"; }
+
+    bool is_connected() const {
+        return region_ != nullptr &&
+               __atomic_load_n(&header_->host_ready, __ATOMIC_ACQUIRE) != 0;
+    }
+
+    // Feedback is queued without waiting; the host sees it before later decisions
+    void on_verification(bool fully_accepted, uint32_t accepted_length) override {
+        if (!is_connected()) return;
+        Slot* slot = acquire_slot();
+        if (slot == nullptr) {
+            timeouts_++;
+            return;
+        }
+        slot->kind = FEEDBACK;
+        slot->length = accepted_length;
+        slot->fully_accepted = fully_accepted ? 1 : 0;
+        next_request_++;
+        publish();
+    }
+
+    void reset() override {
+        if (!is_connected()) return;
+        Slot* slot = acquire_slot();
+        if (slot == nullptr) {
+            timeouts_++;
+            return;
+        }
+        slot->kind = RESET;
+        next_request_++;
+        publish();
+    }
+
+    uint64_t get_timeouts() const { return timeouts_; }
+
+    void print_statistics() const override {
+        DraftingPolicy::print_statistics();
+        spdlog::info("External Policy Ring: {} ({} slots), Host Timeouts: {}",
+                    shm_name_, capacity_, timeouts_);
+    }
+
+protected:
+    void decide_batch(const DraftingState* states, DraftingDecision* decisions,
+                      size_t count) override {
+        size_t done = 0;
+        while (done < count && is_connected()) {
+            // Publish as many decisions as fit in the ring, then wait once
+            uint64_t first = next_request_;
+            size_t chunk = 0;
+            while (done + chunk < count && chunk < capacity_) {
+                Slot* slot = acquire_slot();
+                if (slot == nullptr) break;
+                const DraftingState& s = states[done + chunk];
+                slot->kind = DECIDE;
+                slot->avg_entropy = s.avg_entropy;
+                slot->pending_drafts = s.pending_drafts;
+                slot->kv_length = s.kv_length;
+                slot->length = s.max_draft_length;
+                next_request_++;
+                chunk++;
+            }
+            publish();
+
+            if (chunk == 0 || !wait_for_responses(next_request_)) {
+                if (timeouts_++ == 0) {
+                    spdlog::warn("[AHASD] Drafting policy host on {} did not answer within {} us, "
+                                 "using threshold fallback", shm_name_, timeout_us_);
+                }
+                break;
+            }
+            for (size_t i = 0; i < chunk; i++) {
+                const Slot& slot = slots_[(first + i) % capacity_];
+                decisions[done + i].continue_drafting = slot.continue_drafting != 0;
+                decisions[done + i].preverify_length = slot.preverify_length;
+            }
+            done += chunk;
+        }
+
+        if (done < count) {
+            fallback_.decide(states + done, decisions + done, count - done);
+        }
+    }
+};
+
+// Build the policy selected by name; nullptr disables drafting control
+inline std::unique_ptr<DraftingPolicy> create_drafting_policy(
+        const std::string& type, float entropy_threshold = 2.5f,
+        const std::string& model_path = "", const std::string& shm_name = "/ahasd_policy",
+        uint64_t timeout_us = 1000000) {
+    if (type == "edc") {
+        return std::make_unique<EDCPolicy>();
+    }
+    if (type == "threshold") {
+        return std::make_unique<ThresholdPolicy>(entropy_threshold);
+    }
+    if (type == "learned") {
+        auto policy = std::make_unique<LearnedPolicy>();
+        if (!model_path.empty() && !policy->load_weights(model_path)) {
+            spdlog::warn("[AHASD] Cannot load policy weights from {}, using defaults", model_path);
+        }
+        return policy;
+    }
+    if (type == "external") {
+        return std::make_unique<ExternalPolicy>(shm_name, 1024, timeout_us, entropy_threshold);
+    }
+    spdlog::error("[AHASD] Unknown drafting policy '{}'", type);
+    return nullptr;
+}
+
+} // namespace AHASD
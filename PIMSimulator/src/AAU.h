@@ -8,8 +8,10 @@
 #define AAU_H
 
 #include <vector>
+#include <deque>
 #include <cmath>
 #include <cstdint>
+#include <iostream>
 #include "FP16.h"
 
 namespace DRAMSim {
@@ -20,17 +22,27 @@ enum class AAUOperation {
     LAYERNORM,
     ATTENTION_SCORE,
     REDUCTION_SUM,
-    REDUCTION_MAX
+    REDUCTION_MAX,
+    ATTENTION_SOFTMAX   // Fused attention score -> softmax (scores stay in AAU)
 };
 
 struct AAUConfig {
     uint32_t vector_width;      // Processing width (e.g., 16 elements)
-    uint32_t pipeline_stages;   // Pipeline depth
+    uint32_t pipeline_stages;   // Pipeline depth (max operations in flight)
     float throughput_gops;      // Peak throughput in GOPS
-    uint32_t latency_cycles;    // Base latency
+    uint32_t latency_cycles;    // Base latency (pipeline fill/drain)
+    uint32_t queue_depth;       // Max operations waiting for a pipeline slot
     
     AAUConfig() : vector_width(16), pipeline_stages(4), 
-                  throughput_gops(2.5), latency_cycles(8) {}
+                  throughput_gops(2.5), latency_cycles(8), queue_depth(64) {}
+};
+
+// An operation submitted to the AAU queue
+struct AAURequest {
+    AAUOperation op;
+    uint32_t num_elements;
+    
+    AAURequest(AAUOperation o, uint32_t n) : op(o), num_elements(n) {}
 };
 
 class AAU {
@@ -44,16 +56,86 @@ private:
     uint64_t layernorm_ops_;
     uint64_t attention_ops_;
     uint64_t reduction_ops_;
-    uint64_t total_cycles_;
+    uint64_t fused_ops_;
+    uint64_t batches_;
+    uint64_t completed_operations_;
+    uint64_t total_cycles_;           // Cycles with at least one op in flight
+    uint64_t issue_cycles_;           // Cycles the vector issue port was active
+    uint64_t occupied_stage_cycles_;  // Sum of in-flight ops over busy cycles
+    uint64_t sequential_cycles_;      // Cycles the ops would take one at a time
     
-    // Hardware state
-    bool busy_;
-    uint32_t remaining_cycles_;
-    AAUOperation current_op_;
+    // Hardware state: operations occupying a pipeline slot issue their vector
+    // passes in order through one port, then drain for latency_cycles while
+    // the next operation issues, so the fill latency is paid once per burst
+    // instead of once per operation
+    struct InFlightOp {
+        AAUOperation op;
+        uint32_t issue_cycles;
+        uint32_t drain_cycles;
+    };
+    std::deque<AAURequest> pending_ops_;
+    std::deque<InFlightOp> in_flight_;
     
     // Power tracking
     double total_energy_nj_;
     
+    // Vector passes needed by an operation (excluding base latency)
+    uint32_t issue_cycles_for(AAUOperation op, uint32_t num_elements) const {
+        uint32_t vector_cycles = (num_elements + config_.vector_width - 1) 
+                                / config_.vector_width;
+        switch (op) {
+            case AAUOperation::GELU:
+                return vector_cycles * 2;  // More complex
+            case AAUOperation::SOFTMAX:
+                return vector_cycles * 3;  // Max + exp + norm
+            case AAUOperation::LAYERNORM:
+                return vector_cycles * 3;  // Mean + var + norm
+            case AAUOperation::ATTENTION_SCORE:
+                return vector_cycles * 4;  // QK^T + scale + softmax
+            case AAUOperation::ATTENTION_SOFTMAX:
+                // Running max is tracked while scores are produced, so the
+                // separate max pass and score write-back/read-back disappear
+                return vector_cycles * 5;
+            case AAUOperation::REDUCTION_SUM:
+            case AAUOperation::REDUCTION_MAX:
+                return num_elements == 0 ? 1 :
+                    static_cast<uint32_t>(log2(num_elements)) + 1;
+        }
+        return vector_cycles;
+    }
+    
+    void record_operation(AAUOperation op, uint32_t num_elements) {
+        total_operations_++;
+        switch (op) {
+            case AAUOperation::GELU:
+                gelu_ops_++;
+                total_energy_nj_ += num_elements * 0.8;  // pJ per element
+                break;
+            case AAUOperation::SOFTMAX:
+                softmax_ops_++;
+                total_energy_nj_ += num_elements * 1.2;
+                break;
+            case AAUOperation::LAYERNORM:
+                layernorm_ops_++;
+                total_energy_nj_ += num_elements * 1.0;
+                break;
+            case AAUOperation::ATTENTION_SCORE:
+                attention_ops_++;
+                total_energy_nj_ += num_elements * 1.5;
+                break;
+            case AAUOperation::ATTENTION_SOFTMAX:
+                fused_ops_++;
+                total_energy_nj_ += num_elements * 2.2;  // No score write-back
+                break;
+            case AAUOperation::REDUCTION_SUM:
+            case AAUOperation::REDUCTION_MAX:
+                reduction_ops_++;
+                total_energy_nj_ += num_elements * 0.3;
+                break;
+        }
+        sequential_cycles_ += config_.latency_cycles + issue_cycles_for(op, num_elements);
+    }
+    
     // Helper functions for actual operations
     float compute_gelu(float x) {
         // GELU(x) = x * Φ(x) where Φ is CDF of standard normal
@@ -109,84 +191,98 @@ private:
     }
     
 public:
-    AAU() : total_operations_(0), gelu_ops_(0), softmax_ops_(0),
-            layernorm_ops_(0), attention_ops_(0), reduction_ops_(0),
-            total_cycles_(0), busy_(false), remaining_cycles_(0),
-            total_energy_nj_(0.0) {
-        config_ = AAUConfig();
-    }
+    AAU() : AAU(AAUConfig()) {}
     
     explicit AAU(const AAUConfig& config) 
         : config_(config), total_operations_(0), gelu_ops_(0), 
           softmax_ops_(0), layernorm_ops_(0), attention_ops_(0),
-          reduction_ops_(0), total_cycles_(0), busy_(false), 
-          remaining_cycles_(0), total_energy_nj_(0.0) {}
+          reduction_ops_(0), fused_ops_(0), batches_(0),
+          completed_operations_(0), total_cycles_(0), issue_cycles_(0),
+          occupied_stage_cycles_(0), sequential_cycles_(0),
+          total_energy_nj_(0.0) {}
     
-    // Start an AAU operation
+    // Queue an AAU operation; returns its standalone latency, 0 if queue full
     uint32_t start_operation(AAUOperation op, uint32_t num_elements) {
-        if (busy_) {
-            return 0;  // Busy, cannot start
+        if (!is_available()) {
+            return 0;  // Queue full, cannot accept
         }
         
-        busy_ = true;
-        current_op_ = op;
-        total_operations_++;
-        
-        // Calculate latency based on operation type and size
-        uint32_t base_cycles = config_.latency_cycles;
-        uint32_t vector_cycles = (num_elements + config_.vector_width - 1) 
-                                / config_.vector_width;
-        
-        switch (op) {
-            case AAUOperation::GELU:
-                gelu_ops_++;
-                remaining_cycles_ = base_cycles + vector_cycles * 2;  // More complex
-                total_energy_nj_ += num_elements * 0.8;  // pJ per element
-                break;
-            case AAUOperation::SOFTMAX:
-                softmax_ops_++;
-                remaining_cycles_ = base_cycles + vector_cycles * 3;  // Max + exp + norm
-                total_energy_nj_ += num_elements * 1.2;
-                break;
-            case AAUOperation::LAYERNORM:
-                layernorm_ops_++;
-                remaining_cycles_ = base_cycles + vector_cycles * 3;  // Mean + var + norm
-                total_energy_nj_ += num_elements * 1.0;
-                break;
-            case AAUOperation::ATTENTION_SCORE:
-                attention_ops_++;
-                remaining_cycles_ = base_cycles + vector_cycles * 4;  // QK^T + scale + softmax
-                total_energy_nj_ += num_elements * 1.5;
-                break;
-            case AAUOperation::REDUCTION_SUM:
-            case AAUOperation::REDUCTION_MAX:
-                reduction_ops_++;
-                remaining_cycles_ = base_cycles + 
-                    static_cast<uint32_t>(log2(num_elements)) + 1;
-                total_energy_nj_ += num_elements * 0.3;
-                break;
+        pending_ops_.emplace_back(op, num_elements);
+        record_operation(op, num_elements);
+        return config_.latency_cycles + issue_cycles_for(op, num_elements);
+    }
+    
+    // Queue a batch of operations that overlap in the pipeline
+    // Returns the number of operations accepted (stops at the first rejected)
+    uint32_t submit_batch(const std::vector<AAURequest>& ops) {
+        uint32_t accepted = 0;
+        for (const auto& req : ops) {
+            if (start_operation(req.op, req.num_elements) == 0) break;
+            accepted++;
         }
-        
-        return remaining_cycles_;
+        if (accepted > 0) batches_++;
+        return accepted;
+    }
+    
+    // Queue attention score computation with its softmax fused in one pass
+    uint32_t start_fused_attention_softmax(uint32_t num_elements) {
+        return start_operation(AAUOperation::ATTENTION_SOFTMAX, num_elements);
     }
     
     // Cycle update
     void update() {
-        if (busy_ && remaining_cycles_ > 0) {
-            remaining_cycles_--;
-            total_cycles_++;
-            
-            if (remaining_cycles_ == 0) {
-                busy_ = false;
+        // Admit queued operations into free pipeline slots
+        while (!pending_ops_.empty() && in_flight_.size() < config_.pipeline_stages) {
+            const AAURequest& req = pending_ops_.front();
+            in_flight_.push_back({req.op, issue_cycles_for(req.op, req.num_elements),
+                                  config_.latency_cycles});
+            pending_ops_.pop_front();
+        }
+        
+        if (in_flight_.empty()) {
+            return;
+        }
+        
+        total_cycles_++;
+        occupied_stage_cycles_ += in_flight_.size();
+        
+        // One operation issues per cycle (in order), the rest drain
+        bool issued = false;
+        for (auto& op : in_flight_) {
+            if (op.issue_cycles > 0) {
+                if (!issued) {
+                    op.issue_cycles--;
+                    issued = true;
+                }
+            } else if (op.drain_cycles > 0) {
+                op.drain_cycles--;
             }
         }
+        if (issued) issue_cycles_++;
+        
+        // Retire completed operations (issue order == completion order)
+        while (!in_flight_.empty() && in_flight_.front().issue_cycles == 0 &&
+               in_flight_.front().drain_cycles == 0) {
+            in_flight_.pop_front();
+            completed_operations_++;
+        }
     }
     
-    bool is_busy() const { return busy_; }
+    bool is_busy() const { return !in_flight_.empty() || !pending_ops_.empty(); }
     
-    bool is_available() const { return !busy_; }
+    bool is_available() const { return pending_ops_.size() < config_.queue_depth; }
     
-    uint32_t get_remaining_cycles() const { return remaining_cycles_; }
+    // Cycles until the currently queued work drains (if nothing else arrives)
+    uint32_t get_remaining_cycles() const {
+        if (!is_busy()) return 0;
+        uint32_t issue = 0;
+        for (const auto& op : in_flight_) issue += op.issue_cycles;
+        for (const auto& req : pending_ops_) issue += issue_cycles_for(req.op, req.num_elements);
+        return issue + config_.latency_cycles;
+    }
+    
+    size_t get_queue_length() const { return pending_ops_.size(); }
+    size_t get_in_flight() const { return in_flight_.size(); }
     
     // Functional interface for testing/verification
     void execute_gelu(std::vector<float>& data) {
@@ -203,6 +299,23 @@ public:
         compute_layernorm(data);
     }
     
+    // Fused attention: scores[i] = scale * dot(q, keys[i]), then softmax
+    std::vector<float> execute_attention_softmax(const std::vector<float>& query,
+                                                 const std::vector<std::vector<float>>& keys,
+                                                 float scale) {
+        std::vector<float> scores(keys.size(), 0.0f);
+        for (size_t i = 0; i < keys.size(); i++) {
+            for (size_t d = 0; d < query.size() && d < keys[i].size(); d++) {
+                scores[i] += query[d] * keys[i][d];
+            }
+            scores[i] *= scale;
+        }
+        if (!scores.empty()) {
+            compute_softmax(scores);
+        }
+        return scores;
+    }
+    
     float execute_reduction_sum(const std::vector<float>& data) {
         float sum = 0.0f;
         for (float v : data) {
@@ -222,13 +335,28 @@ public:
     
     // Statistics
     uint64_t get_total_operations() const { return total_operations_; }
+    uint64_t get_completed_operations() const { return completed_operations_; }
     uint64_t get_total_cycles() const { return total_cycles_; }
+    uint64_t get_sequential_cycles() const { return sequential_cycles_; }
     double get_total_energy_nj() const { return total_energy_nj_; }
     double get_utilization(uint64_t total_sim_cycles) const {
         if (total_sim_cycles == 0) return 0.0;
         return static_cast<double>(total_cycles_) / total_sim_cycles;
     }
     
+    // Average fraction of pipeline slots occupied while the AAU is busy
+    double get_pipeline_occupancy() const {
+        if (total_cycles_ == 0 || config_.pipeline_stages == 0) return 0.0;
+        return static_cast<double>(occupied_stage_cycles_) / 
+               (total_cycles_ * config_.pipeline_stages);
+    }
+    
+    // Fraction of busy cycles in which the vector issue port was active
+    double get_issue_utilization() const {
+        if (total_cycles_ == 0) return 0.0;
+        return static_cast<double>(issue_cycles_) / total_cycles_;
+    }
+    
     void print_stats() const {
         std::cout << "=== AAU Statistics ===" << std::endl;
         std::cout << "Total Operations: " << total_operations_ << std::endl;
@@ -237,7 +365,14 @@ public:
         std::cout << "  LayerNorm: " << layernorm_ops_ << std::endl;
         std::cout << "  Attention: " << attention_ops_ << std::endl;
         std::cout << "  Reduction: " << reduction_ops_ << std::endl;
+        std::cout << "  Fused Attention+Softmax: " << fused_ops_ << std::endl;
+        std::cout << "Batches: " << batches_ << std::endl;
         std::cout << "Total Cycles: " << total_cycles_ << std::endl;
+        std::cout << "Sequential Cycles: " << sequential_cycles_ << std::endl;
+        std::cout << "Pipeline Occupancy: " << get_pipeline_occupancy() * 100.0 
+                  << "%" << std::endl;
+        std::cout << "Issue Utilization: " << get_issue_utilization() * 100.0 
+                  << "%" << std::endl;
         std::cout << "Total Energy: " << total_energy_nj_ << " nJ" << std::endl;
     }
     
@@ -2,12 +2,16 @@
  * Gated Task Scheduling Unit for LPDDR5-PIM
  * Enables sub-microsecond task switching between drafting and pre-verification
  * Uses rank-level gating within the same PIM array
+ * Drafting ranks can be partitioned into independent groups that draft concurrently
  *********************************************************************************/
 
 #ifndef GATED_TASK_SCHEDULER_H
 #define GATED_TASK_SCHEDULER_H
 
+#include <algorithm>
 #include <cstdint>
+#include <deque>
+#include <iostream>
 #include <vector>
 #include <string>
 
@@ -19,15 +23,19 @@ enum class PIMTaskType {
     PRE_VERIFICATION    // Small-batch TLM pre-verification
 };
 
+constexpr uint32_t ANY_DRAFTING_GROUP = UINT32_MAX;  // Dispatch to the first free group
+
 struct TaskDescriptor {
     PIMTaskType type;
     uint32_t rank_id;
+    uint32_t group_id;          // Target drafting group (ANY_DRAFTING_GROUP if unbound)
     uint32_t batch_size;
     uint64_t start_cycle;
     uint64_t estimated_cycles;
     bool completed;
     
-    TaskDescriptor() : type(PIMTaskType::IDLE), rank_id(0), batch_size(0),
+    TaskDescriptor() : type(PIMTaskType::IDLE), rank_id(0), 
+                      group_id(ANY_DRAFTING_GROUP), batch_size(0),
                       start_cycle(0), estimated_cycles(0), completed(false) {}
 };
 
@@ -41,18 +49,42 @@ struct RankState {
                  current_task(PIMTaskType::IDLE), remaining_cycles(0) {}
 };
 
+// Independent partition of the drafting ranks; each group drafts for its own
+// request (or tree branch) concurrently with the other groups
+struct DraftingGroup {
+    uint32_t group_id;
+    uint32_t first_rank;
+    uint32_t num_ranks;
+    bool busy;
+    TaskDescriptor task;
+    
+    // Statistics
+    uint64_t tasks_completed;
+    uint64_t tokens_drafted;
+    uint64_t busy_cycles;
+    uint64_t idle_cycles;
+    
+    DraftingGroup() : group_id(0), first_rank(0), num_ranks(0), busy(false),
+                     tasks_completed(0), tokens_drafted(0),
+                     busy_cycles(0), idle_cycles(0) {}
+};
+
 class GatedTaskScheduler {
 private:
     uint32_t num_ranks_;
     std::vector<RankState> rank_states_;
     
     // Task queue
-    std::vector<TaskDescriptor> pending_tasks_;
-    TaskDescriptor* active_task_;
+    std::deque<TaskDescriptor> pending_tasks_;
     
     // Gating control
-    uint32_t drafting_rank_;       // Rank(s) for DLM drafting
+    uint32_t drafting_rank_;       // First rank used for DLM drafting
     uint32_t verification_rank_;   // Rank for TLM pre-verification
+    std::vector<DraftingGroup> drafting_groups_;  // Partition of the drafting ranks
+    
+    // Active pre-verification task (drafting tasks live in their group)
+    TaskDescriptor verification_task_;
+    bool verifying_;
     
     // Task switching overhead
     uint32_t switch_latency_cycles_;  // Sub-microsecond switching
@@ -70,10 +102,61 @@ private:
     // Energy tracking
     double total_switch_energy_nj_;
     
+    bool drafting_mode() const {
+        return rank_states_[drafting_rank_].enabled;
+    }
+    
+    bool any_group_busy() const {
+        for (const auto& group : drafting_groups_) {
+            if (group.busy) return true;
+        }
+        return false;
+    }
+    
+    DraftingGroup* find_free_group(uint32_t group_id) {
+        if (group_id != ANY_DRAFTING_GROUP) {
+            if (group_id < drafting_groups_.size() && !drafting_groups_[group_id].busy) {
+                return &drafting_groups_[group_id];
+            }
+            return nullptr;
+        }
+        for (auto& group : drafting_groups_) {
+            if (!group.busy) return &group;
+        }
+        return nullptr;
+    }
+    
+    // Advance the ranks running one task; returns true once they have all finished
+    bool update_ranks(uint32_t first_rank, uint32_t count) {
+        bool task_done = true;
+        
+        for (uint32_t i = first_rank; i < first_rank + count; i++) {
+            if (rank_states_[i].busy) {
+                if (rank_states_[i].remaining_cycles > 0) {
+                    rank_states_[i].remaining_cycles--;
+                    task_done = false;
+                    
+                    // Count cycles by task type
+                    if (rank_states_[i].current_task == PIMTaskType::DRAFTING) {
+                        drafting_cycles_++;
+                    } else if (rank_states_[i].current_task == PIMTaskType::PRE_VERIFICATION) {
+                        verification_cycles_++;
+                    }
+                } else {
+                    rank_states_[i].busy = false;
+                    rank_states_[i].current_task = PIMTaskType::IDLE;
+                }
+            }
+        }
+        
+        return task_done;
+    }
+    
 public:
-    GatedTaskScheduler(uint32_t num_ranks = 16) 
-        : num_ranks_(num_ranks), active_task_(nullptr),
+    GatedTaskScheduler(uint32_t num_ranks = 16, uint32_t num_drafting_groups = 1) 
+        : num_ranks_(num_ranks),
           drafting_rank_(0), verification_rank_(num_ranks - 1),
+          verifying_(false),
           switch_latency_cycles_(1),  // Sub-microsecond at 800MHz = ~1 cycle
           current_switch_delay_(0), switching_(false),
           total_switches_(0), drafting_cycles_(0), verification_cycles_(0),
@@ -88,13 +171,38 @@ public:
         }
         // Reserve last rank for verification parameters
         rank_states_[verification_rank_].enabled = false;
+        
+        // Partition the drafting ranks into contiguous groups, spreading the
+        // remainder over the first groups
+        uint32_t num_drafting_ranks = num_ranks_ - 1;
+        num_drafting_groups = std::max(1u, std::min(num_drafting_groups, num_drafting_ranks));
+        drafting_groups_.resize(num_drafting_groups);
+        
+        uint32_t next_rank = drafting_rank_;
+        for (uint32_t g = 0; g < num_drafting_groups; g++) {
+            DraftingGroup& group = drafting_groups_[g];
+            group.group_id = g;
+            group.first_rank = next_rank;
+            group.num_ranks = num_drafting_ranks / num_drafting_groups +
+                              (g < num_drafting_ranks % num_drafting_groups ? 1 : 0);
+            next_rank += group.num_ranks;
+        }
     }
     
-    // Submit a task
+    // Submit a task (drafting tasks may be bound to one drafting group)
     bool submit_task(PIMTaskType type, uint32_t batch_size, 
-                     uint64_t estimated_cycles) {
+                     uint64_t estimated_cycles,
+                     uint32_t group_id = ANY_DRAFTING_GROUP) {
+        // A drafting task bound to a group that does not exist could never be
+        // dispatched and would block every task queued behind it
+        if (type == PIMTaskType::DRAFTING && group_id != ANY_DRAFTING_GROUP &&
+            group_id >= drafting_groups_.size()) {
+            return false;
+        }
+        
         TaskDescriptor task;
         task.type = type;
+        task.group_id = group_id;
         task.batch_size = batch_size;
         task.estimated_cycles = estimated_cycles;
         task.completed = false;
@@ -103,9 +211,10 @@ public:
         return true;
     }
     
-    // Try to schedule next task
+    // Try to schedule pending tasks; drafting tasks ahead of the first
+    // pre-verification task are dispatched to every free drafting group
     bool schedule_next_task(uint64_t current_cycle) {
-        if (active_task_ != nullptr || switching_) {
+        if (switching_ || verifying_) {
             return false;  // Already busy
         }
         
@@ -113,29 +222,45 @@ public:
             return false;  // No pending tasks
         }
         
-        TaskDescriptor& next_task = pending_tasks_.front();
-        
-        // Check if we need to switch rank configuration
-        bool need_switch = false;
-        if (next_task.type == PIMTaskType::PRE_VERIFICATION) {
-            // Need to enable verification rank, disable drafting ranks
-            if (rank_states_[verification_rank_].enabled == false) {
-                need_switch = true;
+        bool scheduled = false;
+        auto it = pending_tasks_.begin();
+        while (it != pending_tasks_.end() && it->type == PIMTaskType::DRAFTING) {
+            if (!drafting_mode()) {
+                // Need to enable drafting ranks, disable verification rank
+                if (any_group_busy()) {
+                    return scheduled;
+                }
+                initiate_task_switch(PIMTaskType::DRAFTING);
+                return true;
             }
-        } else if (next_task.type == PIMTaskType::DRAFTING) {
-            // Need to enable drafting ranks, disable verification rank
-            if (rank_states_[drafting_rank_].enabled == false) {
-                need_switch = true;
+            
+            DraftingGroup* group = find_free_group(it->group_id);
+            if (group != nullptr) {
+                start_drafting_task(*group, *it, current_cycle);
+                it = pending_tasks_.erase(it);
+                scheduled = true;
+            } else {
+                ++it;
             }
         }
         
-        if (need_switch) {
-            initiate_task_switch(next_task.type);
+        if (it != pending_tasks_.begin() || it == pending_tasks_.end()) {
+            return scheduled;  // Drafting tasks still queued ahead
+        }
+        
+        // Pre-verification gates off the drafting ranks, so it waits for all groups
+        if (any_group_busy()) {
+            return scheduled;
+        }
+        
+        // Need to enable verification rank, disable drafting ranks
+        if (rank_states_[verification_rank_].enabled == false) {
+            initiate_task_switch(PIMTaskType::PRE_VERIFICATION);
             return true;
         }
         
-        // Start task immediately
-        start_task(next_task, current_cycle);
+        start_verification_task(pending_tasks_.front(), current_cycle);
+        pending_tasks_.pop_front();
         return true;
     }
     
@@ -164,25 +289,34 @@ public:
         }
     }
     
-    // Start executing a task
-    void start_task(TaskDescriptor& task, uint64_t current_cycle) {
-        task.start_cycle = current_cycle;
-        active_task_ = &task;
+    // Start executing a drafting task on one group of ranks
+    void start_drafting_task(DraftingGroup& group, const TaskDescriptor& task,
+                             uint64_t current_cycle) {
+        group.busy = true;
+        group.task = task;
+        group.task.group_id = group.group_id;
+        group.task.rank_id = group.first_rank;
+        group.task.start_cycle = current_cycle;
         
-        // Mark appropriate ranks as busy
-        if (task.type == PIMTaskType::DRAFTING) {
-            for (uint32_t i = 0; i < num_ranks_ - 1; i++) {
-                rank_states_[i].busy = true;
-                rank_states_[i].current_task = PIMTaskType::DRAFTING;
-                rank_states_[i].remaining_cycles = task.estimated_cycles;
-            }
-        } else if (task.type == PIMTaskType::PRE_VERIFICATION) {
-            rank_states_[verification_rank_].busy = true;
-            rank_states_[verification_rank_].current_task = PIMTaskType::PRE_VERIFICATION;
-            rank_states_[verification_rank_].remaining_cycles = task.estimated_cycles;
+        for (uint32_t i = group.first_rank; i < group.first_rank + group.num_ranks; i++) {
+            rank_states_[i].busy = true;
+            rank_states_[i].current_task = PIMTaskType::DRAFTING;
+            rank_states_[i].remaining_cycles = task.estimated_cycles;
         }
     }
     
+    // Start executing a pre-verification task on the verification rank
+    void start_verification_task(const TaskDescriptor& task, uint64_t current_cycle) {
+        verifying_ = true;
+        verification_task_ = task;
+        verification_task_.rank_id = verification_rank_;
+        verification_task_.start_cycle = current_cycle;
+        
+        rank_states_[verification_rank_].busy = true;
+        rank_states_[verification_rank_].current_task = PIMTaskType::PRE_VERIFICATION;
+        rank_states_[verification_rank_].remaining_cycles = task.estimated_cycles;
+    }
+    
     // Update per cycle
     void update() {
         total_cycles_++;
@@ -194,53 +328,44 @@ public:
                 switch_overhead_cycles_++;
             } else {
                 switching_ = false;
-                // Switch complete, start pending task
-                if (!pending_tasks_.empty()) {
-                    start_task(pending_tasks_.front(), total_cycles_);
-                }
+                // Switch complete, start pending tasks
+                schedule_next_task(total_cycles_);
             }
             return;
         }
         
-        // Update active task
-        if (active_task_ != nullptr) {
-            bool task_done = true;
-            
-            for (uint32_t i = 0; i < num_ranks_; i++) {
-                if (rank_states_[i].busy) {
-                    if (rank_states_[i].remaining_cycles > 0) {
-                        rank_states_[i].remaining_cycles--;
-                        task_done = false;
-                        
-                        // Count cycles by task type
-                        if (rank_states_[i].current_task == PIMTaskType::DRAFTING) {
-                            drafting_cycles_++;
-                        } else if (rank_states_[i].current_task == PIMTaskType::PRE_VERIFICATION) {
-                            verification_cycles_++;
-                        }
-                    } else {
-                        rank_states_[i].busy = false;
-                        rank_states_[i].current_task = PIMTaskType::IDLE;
-                    }
-                }
+        bool active = verifying_;
+        
+        // Update active drafting groups
+        for (auto& group : drafting_groups_) {
+            if (!group.busy) {
+                group.idle_cycles++;
+                continue;
             }
             
-            if (task_done) {
-                active_task_->completed = true;
-                active_task_ = nullptr;
-                
-                // Remove completed task
-                if (!pending_tasks_.empty()) {
-                    pending_tasks_.erase(pending_tasks_.begin());
-                }
+            active = true;
+            group.busy_cycles++;
+            if (update_ranks(group.first_rank, group.num_ranks)) {
+                group.task.completed = true;
+                group.busy = false;
+                group.tasks_completed++;
+                group.tokens_drafted += group.task.batch_size;
             }
-        } else {
+        }
+        
+        // Update active pre-verification
+        if (verifying_ && update_ranks(verification_rank_, 1)) {
+            verification_task_.completed = true;
+            verifying_ = false;
+        }
+        
+        if (!active) {
             idle_cycles_++;
         }
     }
     
     bool is_busy() const {
-        return active_task_ != nullptr || switching_;
+        return verifying_ || switching_ || any_group_busy();
     }
     
     bool can_accept_task() const {
@@ -248,15 +373,31 @@ public:
     }
     
     PIMTaskType get_current_task_type() const {
-        if (active_task_ != nullptr) {
-            return active_task_->type;
+        if (verifying_) {
+            return PIMTaskType::PRE_VERIFICATION;
+        }
+        if (any_group_busy()) {
+            return PIMTaskType::DRAFTING;
         }
         return PIMTaskType::IDLE;
     }
     
+    uint32_t get_num_drafting_groups() const { 
+        return drafting_groups_.size(); 
+    }
+    
+    const std::vector<DraftingGroup>& get_drafting_groups() const {
+        return drafting_groups_;
+    }
+    
     // Statistics
     uint64_t get_total_switches() const { return total_switches_; }
     
+    double get_group_utilization(uint32_t group_id) const {
+        if (total_cycles_ == 0 || group_id >= drafting_groups_.size()) return 0.0;
+        return static_cast<double>(drafting_groups_[group_id].busy_cycles) / total_cycles_;
+    }
+    
     double get_utilization() const {
         if (total_cycles_ == 0) return 0.0;
         uint64_t active_cycles = drafting_cycles_ + verification_cycles_;
@@ -278,6 +419,18 @@ public:
                   << " (" << get_switch_overhead_percent() << "%)" << std::endl;
         std::cout << "Utilization: " << (get_utilization() * 100.0) << "%" << std::endl;
         std::cout << "Total Switch Energy: " << total_switch_energy_nj_ << " nJ" << std::endl;
+        std::cout << "Drafting Groups: " << drafting_groups_.size() << std::endl;
+        for (const auto& group : drafting_groups_) {
+            std::cout << "Drafting Group " << group.group_id 
+                      << ": ranks " << group.first_rank << "-" 
+                      << (group.first_rank + group.num_ranks - 1)
+                      << ", Tasks: " << group.tasks_completed
+                      << ", Tokens: " << group.tokens_drafted
+                      << ", Busy Cycles: " << group.busy_cycles
+                      << ", Idle Cycles: " << group.idle_cycles
+                      << ", Utilization: " << (get_group_utilization(group.group_id) * 100.0) 
+                      << "%" << std::endl;
+        }
     }
     
     // Hardware cost estimation
@@ -76,7 +76,7 @@ void PIMRank::update() {
 }
 
 // AHASD: Initialize AAU and Gated Task Scheduler
-void PIMRank::initializeAHASD(uint32_t num_ranks) {
+void PIMRank::initializeAHASD(uint32_t num_ranks, uint32_t num_drafting_groups) {
     if (aau == nullptr) {
         AAUConfig aau_config;
         aau_config.vector_width = 16;
@@ -87,7 +87,7 @@ void PIMRank::initializeAHASD(uint32_t num_ranks) {
     }
     
     if (gatedScheduler == nullptr) {
-        gatedScheduler = new GatedTaskScheduler(num_ranks);
+        gatedScheduler = new GatedTaskScheduler(num_ranks, num_drafting_groups);
     }
 }
 
@@ -100,10 +100,8 @@ void PIMRank::updateAHASD() {
     if (gatedScheduler != nullptr) {
         gatedScheduler->update();
         
-        // Try to schedule next task if idle
-        if (!gatedScheduler->is_busy()) {
-            gatedScheduler->schedule_next_task(currentClockCycle);
-        }
+        // Try to schedule pending tasks onto free drafting groups
+        gatedScheduler->schedule_next_task(currentClockCycle);
     }
 }
 
@@ -115,11 +113,22 @@ void PIMRank::executeAAUOperation(AAUOperation op, uint32_t num_elements) {
     }
 }
 
+// AHASD: Queue a batch of AAU operations so they overlap in the AAU pipeline
+uint32_t PIMRank::executeAAUBatch(const std::vector<AAURequest>& ops) {
+    if (aau == nullptr) {
+        return 0;
+    }
+    uint32_t accepted = aau->submit_batch(ops);
+    aau_invocations_ += accepted;
+    return accepted;
+}
+
 // AHASD: Start drafting task
-bool PIMRank::startDraftingTask(uint32_t batch_size, uint64_t estimated_cycles) {
+bool PIMRank::startDraftingTask(uint32_t batch_size, uint64_t estimated_cycles,
+                                uint32_t group_id) {
     if (gatedScheduler != nullptr && gatedScheduler->can_accept_task()) {
         bool success = gatedScheduler->submit_task(
-            PIMTaskType::DRAFTING, batch_size, estimated_cycles);
+            PIMTaskType::DRAFTING, batch_size, estimated_cycles, group_id);
         if (success) {
             total_drafting_ops_++;
         }
@@ -129,10 +129,12 @@ class PIMRank : public SimulatorObject
     uint64_t aau_invocations_;
     
     // AAU and scheduler control
-    void initializeAHASD(uint32_t num_ranks = 16);
+    void initializeAHASD(uint32_t num_ranks = 16, uint32_t num_drafting_groups = 1);
     void updateAHASD();
     void executeAAUOperation(AAUOperation op, uint32_t num_elements);
-    bool startDraftingTask(uint32_t batch_size, uint64_t estimated_cycles);
+    uint32_t executeAAUBatch(const std::vector<AAURequest>& ops);
+    bool startDraftingTask(uint32_t batch_size, uint64_t estimated_cycles,
+                           uint32_t group_id = ANY_DRAFTING_GROUP);
     bool startPreVerificationTask(uint32_t batch_size, uint64_t estimated_cycles);
     void printAHASDStats() const;
 };
@@ -0,0 +1,41 @@
+/*********************************************************************************
+ * GatedTaskScheduler tests: drafting groups and task admission
+ *********************************************************************************/
+
+#include "GatedTaskScheduler.h"
+#include "gtest/gtest.h"
+
+using namespace DRAMSim;
+
+static void run_until_idle(GatedTaskScheduler& scheduler, uint64_t max_cycles)
+{
+    for (uint64_t cycle = 0; cycle < max_cycles; cycle++)
+    {
+        scheduler.schedule_next_task(cycle);
+        scheduler.update();
+    }
+}
+
+TEST(GatedTaskSchedulerTest, rejects_drafting_task_for_unknown_group)
+{
+    GatedTaskScheduler scheduler(16, 4);
+    EXPECT_FALSE(scheduler.submit_task(PIMTaskType::DRAFTING, 1, 10, 4));
+    EXPECT_FALSE(scheduler.submit_task(PIMTaskType::DRAFTING, 1, 10, 100));
+    EXPECT_TRUE(scheduler.submit_task(PIMTaskType::DRAFTING, 1, 10, 3));
+    EXPECT_TRUE(scheduler.submit_task(PIMTaskType::DRAFTING, 1, 10));
+}
+
+TEST(GatedTaskSchedulerTest, pre_verification_runs_after_rejected_drafting_task)
+{
+    GatedTaskScheduler scheduler(16, 2);
+    EXPECT_TRUE(scheduler.submit_task(PIMTaskType::DRAFTING, 4, 10, 1));
+    EXPECT_FALSE(scheduler.submit_task(PIMTaskType::DRAFTING, 4, 10, 2));
+    EXPECT_TRUE(scheduler.submit_task(PIMTaskType::PRE_VERIFICATION, 2, 10));
+
+    run_until_idle(scheduler, 100);
+
+    EXPECT_FALSE(scheduler.is_busy());
+    EXPECT_EQ(scheduler.get_drafting_groups()[1].tasks_completed, 1u);
+    EXPECT_EQ(scheduler.get_total_switches(), 1u);  // to pre-verification
+    EXPECT_EQ(scheduler.get_current_task_type(), PIMTaskType::IDLE);
+}
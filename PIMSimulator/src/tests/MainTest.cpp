@@ -34,7 +34,7 @@ int main(int argc, char* argv[])
     else
     {
         ::testing::InitGoogleTest(&argc, argv);
-        testing::GTEST_FLAG(filter) = "-*bw*.*";
+        testing::GTEST_FLAG(filter) = "-*bw*.*:*Sweep*.*";
     }
 
     return RUN_ALL_TESTS();
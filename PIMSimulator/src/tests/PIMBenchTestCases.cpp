@@ -52,3 +52,49 @@ TEST_F(PIMBenchFixture, relu)
     executePIMKernel();
     expectPIMBench(2.0);
 }
+
+/*
+ * PIMGemvSweepTest:
+ * GEMV cycles of every DLM layer (QKV, O, FFN up/down) while varying the number of PIM ranks.
+ * Excluded from the default run; use scripts/run_pim_gemv_sweep.py or
+ *   ./sim --gtest_filter=*PIMGemvSweepFixture*
+ */
+
+// (name, model, layer, out_vec, in_vec)
+const GemvSweepShape dlm_gemv_shapes[] = {
+    // OPT-1.3B: hidden 2048, ffn 8192
+    {"opt_1_3b_qkv", "opt-1.3b", "qkv", 3 * 2048, 2048},
+    {"opt_1_3b_o", "opt-1.3b", "o", 2048, 2048},
+    {"opt_1_3b_ffn_up", "opt-1.3b", "ffn_up", 8192, 2048},
+    {"opt_1_3b_ffn_down", "opt-1.3b", "ffn_down", 2048, 8192},
+    // LLaMA2-7B: hidden 4096, ffn 11008 (gate and up projections share the same shape)
+    {"llama2_7b_qkv", "llama2-7b", "qkv", 3 * 4096, 4096},
+    {"llama2_7b_o", "llama2-7b", "o", 4096, 4096},
+    {"llama2_7b_ffn_up", "llama2-7b", "ffn_up", 11008, 4096},
+    {"llama2_7b_ffn_down", "llama2-7b", "ffn_down", 4096, 11008},
+    // PaLM-8B: hidden 4096, ffn 16384
+    {"palm_8b_qkv", "palm-8b", "qkv", 3 * 4096, 4096},
+    {"palm_8b_o", "palm-8b", "o", 4096, 4096},
+    {"palm_8b_ffn_up", "palm-8b", "ffn_up", 16384, 4096},
+    {"palm_8b_ffn_down", "palm-8b", "ffn_down", 4096, 16384},
+};
+
+const unsigned sweep_pim_ranks[] = {1, 2, 4, 8, 16};
+
+TEST_P(PIMGemvSweepFixture, gemv)
+{
+    GemvSweepShape shape = get<0>(GetParam());
+    unsigned num_pim_ranks = get<1>(GetParam());
+
+    setGemvSweepCase(shape, num_pim_ranks);
+    executePIMKernel();
+    printSweepRecord(shape, num_pim_ranks);
+    EXPECT_TRUE(getPIMCycle() > 0);
+}
+
+INSTANTIATE_TEST_CASE_P(
+    DLM, PIMGemvSweepFixture,
+    testing::Combine(testing::ValuesIn(dlm_gemv_shapes), testing::ValuesIn(sweep_pim_ranks)),
+    [](const testing::TestParamInfo<PIMGemvSweepFixture::ParamType>& info) {
+        return string(get<0>(info.param).name) + "_r" + to_string(get<1>(info.param));
+    });
@@ -15,6 +15,7 @@
 
 #include <memory>
 #include <string>
+#include <tuple>
 
 #include "tests/TestCases.h"
 
@@ -23,17 +24,19 @@ using namespace DRAMSim;
 class PIMBenchTestCase
 {
   public:
-    PIMBenchTestCase(KernelType k, unsigned b, unsigned out, unsigned in)
-        : kernel_type_(k), batch_(b), out_(out), in_(in)
+    PIMBenchTestCase(KernelType k, unsigned b, unsigned out, unsigned in,
+                     unsigned num_pim_ranks = 1)
+        : kernel_type_(k), batch_(b), out_(out), in_(in), num_pim_ranks_(num_pim_ranks)
     {
+        // memory capacity grows with the rank count so that NUM_RANKS >= num_pim_ranks
         mem_ = make_shared<MultiChannelMemorySystem>("ini/HBM2_samsung_2M_16B_x64.ini",
                                                      "system_hbm_64ch.ini", ".", "example_app",
-                                                     256 * 64 * 2);
+                                                     256 * 64 * 2 * num_pim_ranks_);
         pim_mem_ = make_shared<MultiChannelMemorySystem>("ini/HBM2_samsung_2M_16B_x64.ini",
                                                          "system_hbm_64ch.ini", ".", "example_app",
-                                                         256 * 64 * 2);
-        // # of pim channel = 64, # of pim rank = 1
-        kernel_ = make_shared<PIMKernel>(pim_mem_, 64, 1);
+                                                         256 * 64 * 2 * num_pim_ranks_);
+        // # of pim channel = 64, # of pim rank = num_pim_ranks
+        kernel_ = make_shared<PIMKernel>(pim_mem_, 64, num_pim_ranks_);
         dim_data_ = new DataDim(kernel_type_, batch_, out_, in_, false);
     }
 
@@ -106,6 +109,7 @@ class PIMBenchTestCase
     unsigned batch_;
     unsigned in_;
     unsigned out_;
+    unsigned num_pim_ranks_;
     bool is_pim_;
 
     shared_ptr<PIMKernel> kernel_;
@@ -116,8 +120,9 @@ class PIMBenchTestCase
 class GemvPIMBenchTest : public PIMBenchTestCase
 {
   public:
-    GemvPIMBenchTest(KernelType k, unsigned b, unsigned out, unsigned in)
-        : PIMBenchTestCase(k, b, out, in)
+    GemvPIMBenchTest(KernelType k, unsigned b, unsigned out, unsigned in,
+                     unsigned num_pim_ranks = 1)
+        : PIMBenchTestCase(k, b, out, in, num_pim_ranks)
     {
     }
 
@@ -318,4 +323,68 @@ class PIMBenchFixture : public testing::Test
     PIMBenchTestCase *perfTest;
 };
 
+/*
+ * GEMV shape of one DLM layer, used by the PIMGemvSweepFixture.
+ * name is "<model>_<layer>" and only contains [A-Za-z0-9_] (gtest parameter name)
+ */
+struct GemvSweepShape
+{
+    const char* name;
+    const char* model;
+    const char* layer;
+    unsigned out;
+    unsigned in;
+};
+
+inline void PrintTo(const GemvSweepShape& shape, ostream* os)
+{
+    *os << shape.name << " (" << shape.out << "x" << shape.in << ")";
+}
+
+class PIMGemvSweepFixture : public testing::TestWithParam<tuple<GemvSweepShape, unsigned>>
+{
+  public:
+    virtual void SetUp()
+    {
+        pim_cycle_ = 0;
+        perfTest = nullptr;
+    }
+
+    virtual void TearDown()
+    {
+        delete perfTest;
+    }
+
+    void setGemvSweepCase(const GemvSweepShape& shape, unsigned num_pim_ranks)
+    {
+        perfTest = new GemvPIMBenchTest(KernelType::GEMV, 1, shape.out, shape.in, num_pim_ranks);
+    }
+
+    void executePIMKernel(void)
+    {
+        perfTest->printTestMessage(true);
+        pim_cycle_ = perfTest->measureCycle(true);
+    }
+
+    /*
+     * one machine readable line per (shape, rank) point,
+     * parsed by scripts/run_pim_gemv_sweep.py
+     */
+    void printSweepRecord(const GemvSweepShape& shape, unsigned num_pim_ranks)
+    {
+        cout << "[GEMV-SWEEP] model=" << shape.model << ",layer=" << shape.layer
+             << ",out=" << shape.out << ",in=" << shape.in << ",ranks=" << num_pim_ranks
+             << ",cycles=" << pim_cycle_ << ",tck_ns=" << getConfigParam(FLOAT, "tCK") << endl;
+    }
+
+    uint64_t getPIMCycle() const
+    {
+        return pim_cycle_;
+    }
+
+  private:
+    uint64_t pim_cycle_;
+    PIMBenchTestCase* perfTest;
+};
+
 #endif /*__PIM_BENCH_TEST_CASE_H__*/
@@ -2,25 +2,133 @@
 import sys
 import os
 import argparse
+import sqlite3
+from parseAddr import sys_l2
 
-xshome = os.environ['NOOP_HOME']
-assert(xshome) # NOOP_HOME is set
-print('XSHOME:',xshome)
-
-xsbuild = xshome + '/build/'
+# Rows are queried and decoded in-process (the same output as
+# `sqlite3 db "select ..." | sh convert_tllog.sh / convert_mp.sh`).
+# Indexes on STAMP (and ADDRESS / TAG, SSET) are created in the db on first
+# use, so --last and the filters below don't scan the whole log.
+#
+# e.g.
+#   python3 l2DB_helper.py log --address 0x80000000 --last -n 50
+#   python3 l2DB_helper.py mp --stamp-min 10000 --stamp-max 20000
+#   python3 l2DB_helper.py log "CHANNEL = 3 AND SOURCE = 12"
 
 def find_lateset(suffix):
     fs = [f for f in os.listdir(xsbuild) if f.endswith(suffix)]
     fs.sort()
     return fs[-1]
 
-def parse_db(table_name, script):
-    return (f'sqlite3 {db} "select * from (' +
-    f'select * from {table_name} ' +
-    (f'where {sql} ' if(sql != '') else '') +
-    (f'order by STAMP desc ' if(last) else '') +
-    f'limit {limit}' +
-    f') order by STAMP asc" | sh {script}')
+### decoding, as in convert_tllog.sh and convert_mp.sh ###
+a_op = ["PutFullData", "PutPartialData", "ArithmeticData", "LogicalData", "Get", "Hint", "AcquireBlock", "AcquirePerm"]
+b_op = ["PutFullData", "PutPartialData", "ArithmeticData", "LogicalData", "Get", "Hint", "Probe"]
+c_op = ["AccessAck", "AccessAckData", "HintAck", "Invalid Opcode", "ProbeAck", "ProbeAckData", "Release", "ReleaseData"]
+d_op = ["AccessAck", "AccessAckData", "HintAck", "Invalid Opcode", "Grant", "GrantData", "ReleaseAck"]
+msa_op = {1: "AccessAckData", 2: "HintAck", 4: "Grant", 5: "GrantData", 6: "Release", 7: "ReleaseData"}
+grow = ["Grow NtoB", "Grow NtoT", "Grow BtoT"]
+cap = ["Cap toT", "Cap toB", "Cap toN"]
+report = ["Shrink TtoB", "Shrink TtoN", "Shrink BtoN", "Report TtoT", "Report BtoB", "Report NtoN"]
+
+def lookup(table, index, default):
+    return table[index] if 0 <= index < len(table) else default
+
+def hex64(val):
+    return '%x' % (val & ((1 << 64) - 1))
+
+def tllog_opstr(chn, op):
+    if chn == 4:
+        return "GrantAck"
+    ops = [a_op, b_op, c_op, d_op]
+    return lookup(ops[chn], op, "Unknown OP") if 0 <= chn < len(ops) else "Unknown OP"
+
+def tllog_paramstr(chn, param):
+    params = [grow, cap, report, cap]
+    return lookup(params[chn], param, "Reserved") if 0 <= chn < len(params) else "Reserved"
+
+def decode_tllog(row):
+    # ID ECHO USER DATA*4 ADDRESS SINK SOURCE PARAM OPCODE CHANNEL STAMP SITE
+    _, echo, user, d1, d2, d3, d4, address, sink, source, param, opcode, chn, stamp, site = row[:15]
+    return ' '.join([
+        str(stamp), site, lookup("ABCDE", chn, ""), tllog_opstr(chn, opcode), tllog_paramstr(chn, param),
+        str(sink), str(source), hex64(address), *['%016x' % (d & ((1 << 64) - 1)) for d in (d1, d2, d3, d4)],
+        'user: ' + hex64(user), 'echo: ' + hex64(echo)
+    ])
+
+def mp_opstr(chn, op, msTask):
+    if msTask == 0:
+        ops = {1: a_op, 2: b_op, 4: c_op}
+    else:
+        ops = {1: msa_op, 2: c_op}
+    if chn not in ops:
+        return "Unknown OP"
+    table = ops[chn]
+    return table.get(op, "Unknown OP") if isinstance(table, dict) else lookup(table, op, "Unknown OP")
+
+def site_bank(site):
+    digits = len(site) - len(site.rstrip('0123456789'))
+    return int(site[-digits:]) if digits else 0
+
+def decode_mp(row):
+    # ID METAWWAY METAWVALID MSHRID ALLOCPTR ALLOCVALID DIRWAY DIRHIT SSET TAG OPCODE CHANNEL MSHRTASK STAMP SITE
+    _, metaw_way, metaw_valid, mshr_id, alloc_ptr, alloc_valid, dir_way, dir_hit, sset, tag, opcode, chn, ms_task, stamp, site = row[:15]
+    addr = sys_l2.fullAddr(tag, sset, site_bank(site))
+    return ' '.join([
+        str(stamp), site, "Chn " if ms_task == 0 else "Mshr", {1: "A", 2: "B", 4: "C"}.get(chn, "Unknown Channel"),
+        '%14s |' % mp_opstr(chn, opcode, ms_task), '%x(%d)' % (tag, tag), '%x(%d)\t' % (sset, sset), '%x(%d)\t' % (addr, addr),
+        '|DIR %d %d' % (dir_hit, dir_way), '|ALLOC %d %2d' % (alloc_valid, alloc_ptr), '|MSHRID %2d' % mshr_id,
+        '|METAW %d %d' % (metaw_valid, metaw_way)
+    ])
+
+### query ###
+tables = {
+    'log': ('TLLOG', decode_tllog, [['STAMP'], ['ADDRESS']]),
+    'mp': ('L2MP', decode_mp, [['STAMP'], ['TAG', 'SSET']]),
+}
+
+def create_indexes(con, table_name, indexes):
+    # once per db, later runs only check sqlite_master
+    for columns in indexes:
+        name = f'{table_name}_{"_".join(columns)}_idx'
+        try:
+            con.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table_name}({", ".join(columns)})')
+        except sqlite3.OperationalError as e:
+            # read-only db: queries still work, just without the index
+            print(f'cannot create index {name}: {e}', file=sys.stderr)
+            return
+    con.commit()
+
+def build_query(cmd, table_name, args):
+    conds = []
+    params = []
+    if args.sql != '':
+        conds.append(f'({args.sql})')
+    if args.stamp_min is not None:
+        conds.append('STAMP >= ?')
+        params.append(args.stamp_min)
+    if args.stamp_max is not None:
+        conds.append('STAMP <= ?')
+        params.append(args.stamp_max)
+    if args.site is not None:
+        conds.append('SITE = ?')
+        params.append(args.site)
+    if args.address is not None:
+        if cmd == 'log':
+            conds.append('ADDRESS = ?')
+            params.append(args.address)
+        else:
+            # L2MP logs the tag and set, the bank is the number at the end of SITE
+            tag, sset, bank = sys_l2.sepAddr(args.address)
+            conds.append('TAG = ? AND SSET = ? AND SITE GLOB ?')
+            params += [tag, sset, f'*[^0-9]{bank}']
+    line = ('select * from (' +
+        f'select * from {table_name} ' +
+        (f'where {" and ".join(conds)} ' if conds else '') +
+        ('order by STAMP desc ' if args.last else '') +
+        'limit ?' +
+        ') order by STAMP asc')
+    params.append(args.limit)
+    return line, params
 
 parser = argparse.ArgumentParser(description='L2DB helper')
 parser.add_argument('cmd', choices=['log', 'mp'], help='[Required] log for TLLOG; mp for L2 MainPipe')
@@ -28,32 +136,34 @@ parser.add_argument('sql', nargs='?', default='', help='[Optional] sql query, e.
 parser.add_argument('-l', '--last', action='store_true', help='select the last N records')
 parser.add_argument('-n', '--limit', type=int, default=20, help='select N records')
 parser.add_argument('-p', '--path', default=None, help='path to db file (if not designated, use the latest in build)')
+parser.add_argument('--stamp-min', type=int, default=None, help='select records with STAMP >= this')
+parser.add_argument('--stamp-max', type=int, default=None, help='select records with STAMP <= this')
+parser.add_argument('--address', type=lambda x: int(x, 0), default=None, help='select records of this address (its block for mp)')
+parser.add_argument('--site', default=None, help='select records of this SITE')
+parser.add_argument('--no-index', action='store_true', help='do not create indexes in the db')
 args = parser.parse_args()
 # print(args)
 
-cmd = args.cmd
-sql = args.sql
-last = args.last
-limit = args.limit
-db = xsbuild + find_lateset('.db') if args.path == None else args.path
-print(db)
-
-line = ''
-if(cmd == 'log'):
-    line = parse_db('TLLOG', xshome + '/scripts/cache/convert_tllog.sh')
-
-elif(cmd == 'mp'):
-    line = parse_db('L2MP', xshome + '/scripts/cache/convert_mp.sh')
-
-# elif(cmd == 'clean'):
-#     os.system(f'rm -rf {xsbuild}*.vcd')
-#     os.system(f'rm -rf {xsbuild}*.vpd')
-#     os.system(f'rm -rf {xsbuild}*.gtkw')
-#     os.system(f'rm -rf {xsbuild}*.db')
-
+if args.path == None:
+    xshome = os.environ['NOOP_HOME']
+    assert(xshome) # NOOP_HOME is set
+    print('XSHOME:',xshome, file=sys.stderr)
+    xsbuild = xshome + '/build/'
+    db = xsbuild + find_lateset('.db')
 else:
-    print('Unknown command')
-    exit()
+    db = args.path
+print(db, file=sys.stderr)
+
+table_name, decode, indexes = tables[args.cmd]
+line, params = build_query(args.cmd, table_name, args)
+print(line, params, file=sys.stderr)
 
-print(line)
-os.system(line)
\ No newline at end of file
+with sqlite3.connect(db) as con:
+    if not args.no_index:
+        create_indexes(con, table_name, indexes)
+    try:
+        rows = con.execute(line, params).fetchall()
+    except sqlite3.Error as e:
+        print(f'query failed: {e}', file=sys.stderr)
+        sys.exit(1)
+    sys.stdout.write(''.join(decode(row) + '\n' for row in rows))
@@ -1,5 +1,8 @@
 #!/bin/python3
 import argparse
+import sys
+import warnings
+import numpy as np
 
 blockBits = 6
 
@@ -17,38 +20,149 @@ class Addr:
     def sepAddrHex(self, addr):
         tmp = self.sepAddr(addr)
         return (hex(tmp[0]), hex(tmp[1]), hex(tmp[2]))
+    # the same on uint64 arrays, for bulk mode
+    def fullAddrArray(self, tag, set, bank):
+        setBits, bankBits = np.uint64(self.setBits), np.uint64(self.bankBits)
+        return ((tag << (setBits + bankBits)) | (set << bankBits) | bank) << np.uint64(blockBits)
+    def sepAddrArray(self, addr):
+        setBits, bankBits = np.uint64(self.setBits), np.uint64(self.bankBits)
+        addr = addr >> np.uint64(blockBits)
+        return (addr >> (setBits + bankBits), (addr >> bankBits) & np.uint64((1 << self.setBits) - 1), addr & np.uint64((1 << self.bankBits) - 1))
 
 tl_test = Addr(3, 7, 0)
 sys_l2  = Addr(19, 9, 2)
 sys_l3  = Addr(16, 12, 2)
 seq = [None, tl_test, sys_l2, sys_l3]
 
+### bulk mode ###
+# hex digit value of every byte: padding counts as 0, bytes that are not hex digits as 255
+HEX_DIGITS = np.full(256, 255, dtype=np.uint8)
+HEX_DIGITS[0] = 0
+for d in b'0123456789abcdef':
+    HEX_DIGITS[d] = HEX_DIGITS[ord(chr(d).upper())] = int(chr(d), 16)
+HEX_WIDTH = 19  # '0x', 16 digits and one more byte to tell fields that are too long
+HEX_DTYPE = 'S%d' % HEX_WIDTH
+# HEX_SHIFTS[n][j]: bit position of digit j in a field of n characters; positions past
+# the end hold 0, and only the zeros of a '0x' prefix can sit above the 16th digit
+HEX_SHIFTS = np.clip(4 * (np.arange(HEX_WIDTH + 1)[:, None] - 1 - np.arange(HEX_WIDTH)), 0, 60).astype(np.uint64)
+
+def parseHex(fields):
+    # fields: 2-d bytes array; returns uint64 values and a mask of the rows whose fields are all hex
+    chars = fields.view(np.uint8).reshape(fields.shape + (HEX_WIDTH,)).copy()
+    length = np.count_nonzero(chars, axis=-1)
+    prefixed = (chars[..., 0] == ord('0')) & ((chars[..., 1] | 0x20) == ord('x'))
+    chars[..., 1][prefixed] = ord('0')
+    digits = HEX_DIGITS[chars]
+    ndigits = length - 2 * prefixed
+    ok = (digits != 255).all(axis=-1) & (ndigits > 0) & (ndigits <= 16)
+    value = (digits.astype(np.uint64) << HEX_SHIFTS[length]).sum(axis=-1, dtype=np.uint64)
+    return value, ok.all(axis=1)
+
+def selectFields(lines, columns):
+    # per-line split, only for inputs whose lines have different numbers of columns
+    rows = []
+    for line in lines:
+        fields = line.split()
+        if not fields or fields[0].startswith('#'):
+            continue
+        try:
+            rows.append([fields[c].encode('ascii', 'replace')[:HEX_WIDTH] for c in columns])
+        except IndexError:
+            continue  # header or a line of another kind
+    return np.array(rows, dtype=HEX_DTYPE).reshape(len(rows), len(columns))
+
+def readColumns(f, columns):
+    # hex numbers from the given whitespace-separated columns of every line;
+    # numpy tokenizes the text and decodes the digits, lines that are not hex are dropped
+    lines = f.read().replace(',', ' ').splitlines()
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', UserWarning)  # empty input
+            fields = np.loadtxt(lines, dtype=HEX_DTYPE, comments='#', usecols=columns, ndmin=2)
+    except (ValueError, IndexError):
+        fields = selectFields(lines, columns)  # the number of columns changes between lines
+    values, ok = parseHex(fields)
+    return [values[ok, i] for i in range(len(columns))]
+
+def writeColumns(out, addr, tag, set, bank):
+    out.write('addr,tag,set,bank\n')
+    out.write(''.join('%x,%x,%x,%x\n' % row for row in zip(addr.tolist(), tag.tolist(), set.tolist(), bank.tolist())))
+
+def conflictHist(out, tag, set, bank, top):
+    # accesses and distinct tags per (bank, set); many tags on one set means conflict misses
+    key = np.stack((bank, set, tag), axis=1)
+    blocks = np.unique(key, axis=0)
+    sets, accesses = np.unique(key[:, :2], axis=0, return_counts=True)
+    _, tags = np.unique(blocks[:, :2], axis=0, return_counts=True)
+    out.write('%d addresses, %d blocks, %d sets used\n' % (len(tag), len(blocks), len(sets)))
+    out.write('\ntop %d sets by distinct tags\n' % top)
+    out.write('%6s %8s %10s %8s\n' % ('bank', 'set', 'accesses', 'tags'))
+    for i in np.lexsort((-accesses, -tags))[:top]:
+        out.write('%6x %8x %10d %8d\n' % (sets[i][0], sets[i][1], accesses[i], tags[i]))
+    out.write('\nsets by number of distinct tags\n')
+    hist = np.bincount(tags)
+    width = 50 / max(hist.max(), 1)
+    for n in np.nonzero(hist)[0]:
+        out.write('%6d %8d %s\n' % (n, hist[n], '#' * int(hist[n] * width)))
+
+def bulk(args):
+    i = args.cmd[0]
+    o = args.cmd[1]
+    columns = [args.column] if i == '0' else [args.column, args.column + 1, args.column + 2]
+    f = sys.stdin if args.file == '-' else open(args.file)
+    with f:
+        values = readColumns(f, columns)
+    if i == '0':
+        fullAddr = values[0]
+    else:
+        fullAddr = seq[int(i)].fullAddrArray(*values)
+    oo = seq[int(o)] if o != '0' else seq[int(i)]
+    tag, set, bank = oo.sepAddrArray(fullAddr)
+    if args.output or not args.hist:
+        out = open(args.output, 'w') if args.output else sys.stdout
+        writeColumns(out, fullAddr, tag, set, bank)
+        if out is not sys.stdout:
+            out.close()
+    if args.hist:
+        conflictHist(sys.stdout, tag, set, bank, args.top)
+
 ### main ###
-parser = argparse.ArgumentParser(description='0: fullAddr, 1: tl_test, 2: sys_l2, 3: sys_l3')
-parser.add_argument('cmd', help='e.g., 02=fullAddr to l2[tag set bank] of XS')
-parser.add_argument('addr', nargs='*', default=None, help='addr OR tag set bank')
-args = parser.parse_args()
-cmd = args.cmd
-addr = args.addr
-
-i = cmd[0] # input
-o = cmd[1] # output
-ii = seq[int(i)]
-oo = seq[int(o)]
-
-if i == '0':
-    assert(len(addr) == 1)
-    fullAddr = int(addr[0], 16)
-    print(oo.sepAddrHex(fullAddr))
-else:
-    assert(len(addr) == 3)
-    tag = int(addr[0], 16)
-    set = int(addr[1], 16)
-    bank = int(addr[2], 16)
-    fullAddr = ii.fullAddr(tag, set, bank)
-    print(hex(fullAddr))
-    if o != '0':
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='0: fullAddr, 1: tl_test, 2: sys_l2, 3: sys_l3')
+    parser.add_argument('cmd', help='e.g., 02=fullAddr to l2[tag set bank] of XS')
+    parser.add_argument('addr', nargs='*', default=None, help='addr OR tag set bank')
+    parser.add_argument('-f', '--file', default=None, help='bulk mode: decode every line of this file (- for stdin)')
+    parser.add_argument('-c', '--column', type=int, default=0, help='bulk mode: column of the addr (or of tag, followed by set and bank), negative counts from the end')
+    parser.add_argument('-o', '--output', default=None, help='bulk mode: write the addr,tag,set,bank csv here')
+    parser.add_argument('--hist', action='store_true', help='bulk mode: print set-conflict histograms (no csv unless -o)')
+    parser.add_argument('--top', type=int, default=20, help='bulk mode: number of sets listed in --hist')
+    args = parser.parse_args()
+    if args.file is not None:
+        if args.cmd[0] != '0' and -3 < args.column < 0:
+            parser.error('-c must be <= -3 (or >= 0) for tag, set and bank columns')
+        bulk(args)
+        sys.exit(0)
+    cmd = args.cmd
+    addr = args.addr
+
+    i = cmd[0] # input
+    o = cmd[1] # output
+    ii = seq[int(i)]
+    oo = seq[int(o)]
+
+    if i == '0':
+        assert(len(addr) == 1)
+        fullAddr = int(addr[0], 16)
         print(oo.sepAddrHex(fullAddr))
+    else:
+        assert(len(addr) == 3)
+        tag = int(addr[0], 16)
+        set = int(addr[1], 16)
+        bank = int(addr[2], 16)
+        fullAddr = ii.fullAddr(tag, set, bank)
+        print(hex(fullAddr))
+        if o != '0':
+            print(oo.sepAddrHex(fullAddr))
 
 # examples:
 # fullAddr to L2:
@@ -59,4 +173,8 @@ else:
 # > python3 parseAddr.py 23 0x628b 0x10c 0x3
 # 0xc5170cc0
 # ('0xc51', '0x70c', '0x3')
+#
+# bulk, one address per line (or the 9th column from the end of `l2DB_helper.py log` output):
+# > python3 parseAddr.py 02 -f addrs.txt -o l2.csv
+# > python3 l2DB_helper.py log -n 1000000 | python3 parseAddr.py 03 -f - -c -9 --hist
 
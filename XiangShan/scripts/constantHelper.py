@@ -6,8 +6,13 @@ import json
 import sys
 import math
 import time
+import shutil
+import hashlib
+import numpy as np
 from datetime import datetime
 
+from core_allocator import get_allocator
+
 # usage: python3 constantHelper.py JSON_FILE_PATH [BUILD_PATH]
 # 
 # an example json config file is as follow:
@@ -54,8 +59,28 @@ from datetime import datetime
 #     "concurrent_emu": 4,
 #     "max_instr": 1000000,
 #     "seed": 3888,
-#     "work_load": "~/nexus-am/apps/maprobe/build/maprobe-riscv64-xs.bin"
+#     "work_load": "~/nexus-am/apps/maprobe/build/maprobe-riscv64-xs.bin",
+
+#     "surrogate": {"screen_ratio": 0.3, "min_samples": 20, "explore": 1.0},
+#     "low_fidelity": {"max_instr": 100000, "promote_ratio": 0.3}
 # }
+#
+# "surrogate" and "low_fidelity" are optional and cut the number of full emu runs:
+#  - surrogate: a Gaussian process over the constant values, trained on every
+#    cached full run, ranks the new individuals of a round by mean + explore * std
+#    and only the top screen_ratio of them are simulated; the rest take the
+#    predicted fitness. It starts once min_samples full runs are cached.
+#  - low_fidelity: the individuals left are first run for max_instr instructions,
+#    and only the best promote_ratio of them are run at full length; the rest take
+#    the short-run fitness with counters scaled to the full length.
+#  Only simulated full-length fitness is ever cached or reported as the optimum.
+#
+# Up to concurrent_emu emus run at once, each on its own leased window of
+# emu_threads cores (see core_allocator.py), and a new one starts as soon as
+# any finishes. The opt_target counters of every finished run are kept in
+# BUILD_PATH/.constant_fitness_cache.json, so an individual that was already
+# simulated with the same emu, work_load, max_instr and seed, in this run or
+# an earlier one, is never simulated again.
 
 
 # parameters according to noop
@@ -83,6 +108,7 @@ else:
 EMU_PATH = os.path.join(BUILD_PATH, "emu")
 CONFIG_FILE_PREFIX = ".constant_result_"
 PERF_FILE_POSTFIX = "tmp"
+FITNESS_CACHE_FILE = ".constant_fitness_cache.json"
 MAXVAL = (1 << 63) - 1
 
 class Constant:
@@ -96,7 +122,7 @@ class Constant:
 
 
 class Config:
-    def __init__(self, constants, opt_target, population_num, iteration_num, crossover_rate, mutation_rate, emu_threads, concurrent_emu, max_instr, seed, work_load, tag) -> None:
+    def __init__(self, constants, opt_target, population_num, iteration_num, crossover_rate, mutation_rate, emu_threads, concurrent_emu, max_instr, seed, work_load, tag, surrogate = None, low_fidelity = None) -> None:
         self.constants = constants
         self.opt_target = opt_target
         self.population_num = int(population_num)
@@ -109,6 +135,8 @@ class Config:
         self.seed = int(seed)
         self.work_load = work_load
         self.tag = tag
+        self.surrogate = surrogate
+        self.low_fidelity = low_fidelity
     def get_ith_constant(self, i) -> Constant:
         return self.constants[i]
     def get_constain_num(self) -> int:
@@ -118,12 +146,13 @@ class Config:
 def loadConfig(json_path, tag) -> Config:
     obj = json.load(open(json_path, "r"))
     constants = [Constant(obj['constants'][i]) for i in range(len(obj['constants']))]
-    config = Config(constants, obj['opt_target'], obj['population_num'], obj['iteration_num'], obj['crossover_rate'], obj['mutation_rate'], obj['emu_threads'], obj['concurrent_emu'], obj['max_instr'], obj['seed'], obj['work_load'], tag)
+    config = Config(constants, obj['opt_target'], obj['population_num'], obj['iteration_num'], obj['crossover_rate'], obj['mutation_rate'], obj['emu_threads'], obj['concurrent_emu'], obj['max_instr'], obj['seed'], obj['work_load'], tag, obj.get('surrogate'), obj.get('low_fidelity'))
     return config
 
 class RunContext:
     def __init__(self, config: Config) -> None:
         self.config = config
+        self.leases = dict()
     def checkCoreFree(self) -> bool:
         percent_per_core = psutil.cpu_percent(interval=1 ,percpu=True)
         acc = 0
@@ -138,17 +167,16 @@ class RunContext:
     def get_free_cores(self) -> tuple[bool, int, int, int]:
         thread = self.config.emu_threads
         # return (Success?, numa node, start_core, end_core)
-        num_core = psutil.cpu_count(logical=False) # SMT is not allowed
-        core_usage = psutil.cpu_percent(interval=2, percpu=True)
-        num_window = num_core // thread
-        for i in range(num_window):
-            start = i * thread
-            end = (i + 1) * thread
-            window_usage = core_usage[start:end]
-            free = sum(window_usage) < 30 * thread and True not in map(lambda x: x > 80, window_usage)
-            if free:
-                return (True, int(start >= (num_core // 2)), start, end - 1)
-        return (False, 0, 0, 0)
+        # the window stays leased to this process until release_cores(start_core)
+        lease = get_allocator().try_acquire(thread, owner=self.config.tag)
+        if lease is None:
+            return (False, 0, 0, 0)
+        self.leases[lease.start] = lease
+        return (True, lease.node, lease.start, lease.end)
+    def release_cores(self, coreStart) -> None:
+        lease = self.leases.pop(coreStart, None)
+        if lease is not None:
+            lease.release()
     def getStdIn(self, population: list, id: int) -> str:
         res = 'echo \"'
         res += str(len(population[id]))
@@ -158,29 +186,124 @@ class RunContext:
         res += '\"'
         return res
 
-    def genRunCMD(self, population, id, numa = None, coreStart = None, coreEnd = None) -> str:
+    def genRunCMD(self, population, id, numa = None, coreStart = None, coreEnd = None, max_instr = None) -> str:
         stdinStr = self.getStdIn(population, id)
+        max_instr = self.config.max_instr if max_instr is None else max_instr
         if None in [numa, coreStart, coreEnd]:
-            return "{} | {} -i {} --diff {} -I {} -s {}".format(stdinStr, EMU_PATH, self.config.work_load, DIFF_PATH, self.config.max_instr, self.config.seed)
-        return "{} | numactl -m {} -C {}-{} {} -i {} --diff {} -I {} -s {}".format(stdinStr, numa, coreStart, coreEnd, EMU_PATH, self.config.work_load, DIFF_PATH, self.config.max_instr, self.config.seed)
+            return "{} | {} -i {} --diff {} -I {} -s {}".format(stdinStr, EMU_PATH, self.config.work_load, DIFF_PATH, max_instr, self.config.seed)
+        return "{} | numactl -m {} -C {}-{} {} -i {} --diff {} -I {} -s {}".format(stdinStr, numa, coreStart, coreEnd, EMU_PATH, self.config.work_load, DIFF_PATH, max_instr, self.config.seed)
     
-    def getOutPath(self, iterid, i):
+    def getOutPath(self, iterid, i, suffix = ""):
         dirPath = os.path.join(BUILD_PATH, self.config.tag)
         if not os.path.exists(dirPath):
             os.mkdir(dirPath)
-        return os.path.join(dirPath, f"{iterid}-{i}-out.txt")
+        return os.path.join(dirPath, f"{iterid}-{i}{suffix}-out.txt")
 
-    def getPerfPath(self, iterid, i):
+    def getPerfPath(self, iterid, i, suffix = ""):
         # return os.path.join(BUILD_PATH, CONFIG_FILE_PREFIX + str(i) + '.' + PERF_FILE_POSTFIX)
         dirPath = os.path.join(BUILD_PATH, self.config.tag)
         if not os.path.exists(dirPath):
             os.mkdir(dirPath)
-        return os.path.join(dirPath, f"{iterid}-{i}-err.txt")
+        return os.path.join(dirPath, f"{iterid}-{i}{suffix}-err.txt")
+
+class FitnessCache:
+    # opt_target counters per individual, persisted across runs of this script
+    def __init__(self, config: Config, path, max_instr = None) -> None:
+        self.config = config
+        self.path = path
+        self.max_instr = config.max_instr if max_instr is None else max_instr
+        self.scope = self.get_scope()
+        self.entries = dict()
+        try:
+            with open(path, "r") as fp:
+                self.entries = json.load(fp).get(self.scope, dict())
+        except (OSError, ValueError):
+            pass
+    def get_scope(self) -> str:
+        # runs are only comparable on the same emu binary, workload and run length
+        try:
+            st = os.stat(EMU_PATH)
+            emu = f"{st.st_size}-{int(st.st_mtime)}"
+        except OSError:
+            emu = "missing"
+        scope = [emu, os.path.expanduser(self.config.work_load), self.max_instr, self.config.seed]
+        return hashlib.sha1(json.dumps(scope).encode()).hexdigest()
+    def fitness(self, key: str, scale = 1):
+        # None unless every target of this config was recorded for key;
+        # scale extrapolates the counters of a shorter run to max_instr
+        counters = self.entries.get(key)
+        if counters is None:
+            return None
+        res = 0
+        for opt in self.config.opt_target:
+            name, target = list(opt.items())[0]
+            if name not in counters:
+                return None
+            (total, count) = counters[name]
+            total = total * scale
+            # max and min policy
+            if target['policy'] == 'max':
+                res += total - count * int(target['baseline'])
+            elif target['policy'] == 'min':
+                res += count * int(target['baseline']) - total
+        return res
+    def store(self, key: str, counters: dict) -> None:
+        self.entries[key] = counters
+        try:
+            with open(self.path, "r") as fp:
+                content = json.load(fp)
+        except (OSError, ValueError):
+            content = dict()
+        # merge, other scopes and concurrent runs may have written meanwhile
+        content.setdefault(self.scope, dict()).update(self.entries)
+        tmp = f"{self.path}.{os.getpid()}"
+        with open(tmp, "w") as fp:
+            json.dump(content, fp)
+        os.replace(tmp, self.path)
+
+
+class Surrogate:
+    # Gaussian process regression over constant values scaled by their guide
+    MAX_SAMPLES = 500
+    def __init__(self, config: Config) -> None:
+        self.config = config
+        self.x = None
+    def features(self, indivs: list) -> np.ndarray:
+        guides = np.array([max(constant.guide, 1) for constant in self.config.constants], dtype=float)
+        return np.array([[val[1] for val in indiv] for indiv in indivs], dtype=float) / guides
+    def kernel(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        dist = ((a[:, None, :] - b[None, :, :]) ** 2).sum(axis=2)
+        return np.exp(-0.5 * dist / self.length ** 2)
+    def fit(self, indivs: list, fitness: list) -> None:
+        # the most recent MAX_SAMPLES runs keep the O(n^3) solve cheap
+        x = self.features(indivs[-self.MAX_SAMPLES:])
+        y = np.array(fitness[-self.MAX_SAMPLES:], dtype=float)
+        self.mean, self.std = y.mean(), max(y.std(), 1e-9)
+        dist = np.sqrt(((x[:, None, :] - x[None, :, :]) ** 2).sum(axis=2))
+        # median heuristic for the length scale
+        self.length = max(np.median(dist[dist > 0]) if (dist > 0).any() else 1.0, 1e-3)
+        k = self.kernel(x, x) + 1e-2 * np.eye(len(x))
+        self.chol = np.linalg.cholesky(k)
+        self.alpha = np.linalg.solve(self.chol.T, np.linalg.solve(self.chol, (y - self.mean) / self.std))
+        self.x = x
+    def predict(self, indivs: list) -> tuple[np.ndarray, np.ndarray]:
+        x = self.features(indivs)
+        ks = self.kernel(x, self.x)
+        mu = ks @ self.alpha
+        v = np.linalg.solve(self.chol, ks.T)
+        var = np.clip(1 - (v ** 2).sum(axis=0), 0, None)
+        return mu * self.std + self.mean, np.sqrt(var) * self.std
+
 
 class Solution:
     def __init__(self, config: Config) -> None:
         self.config = config
         self.context = RunContext(config)
+        self.cache = FitnessCache(config, os.path.join(BUILD_PATH, FITNESS_CACHE_FILE))
+        self.low_cache = None
+        if config.low_fidelity is not None:
+            self.low_cache = FitnessCache(config, os.path.join(BUILD_PATH, FITNESS_CACHE_FILE), int(config.low_fidelity['max_instr']))
+        self.emu_runs = [0, 0]  # full, low fidelity
     def genFirstPopulation(self) -> list:
         res = []
         used = []
@@ -193,48 +316,117 @@ class Solution:
             res.append(candidate)
         assert(len(res) == config.population_num)
         return res
-    def profilling_fitness(self, iterid: int) -> list:
-        fitness = []
-        lines = []
-        for idx in range(self.config.population_num):
-            with open(self.context.getPerfPath(iterid, idx), "r") as fp:
-                lines = fp.readlines()
-                res = 0
-                for line in lines:
-                    for opt in config.opt_target:
-                        if list(opt.keys())[0] in line:
-                            # max and min policy
-                            if list(opt.values())[0]['policy'] == 'max':
-                                res += int(list(filter(lambda x: x != '', line.split(' ')))[-1]) - int(list(opt.values())[0]['baseline'])
-                            elif list(opt.values())[0]['policy'] == 'min':
-                                res += int(list(opt.values())[0]['baseline']) - int(list(filter(lambda x: x != '', line.split(' ')))[-1])
-                fitness.append(res)
-        assert(len(fitness) == self.config.population_num)
-        return fitness
-    def run_one_round(self, iterid: int, population: list) -> None:
-        procs = []
-        i = 0
-        while i < len(population):
-            if i % self.config.concurrent_emu == 0:
-                for proc in procs:
-                    proc.wait()
-                procs.clear()
-            print(population[i])
-            # while True:
-            #     (succ, numa, coreStart, coreEnd) = self.context.get_free_cores()
-            #     if succ:
-            #         with open(self.context.getOutPath(iterid, i), "w") as stdout, open(self.context.getPerfPath(iterid, i), "w") as stderr:
-            #             # print(self.context.genRunCMD(population, i, numa, coreStart, coreEnd), flush=True)
-            #             procs.append(Popen(args=self.context.genRunCMD(population, i, numa, coreStart, coreEnd), shell=True, encoding='utf-8', stdin=PIPE, stdout=stdout, stderr=stderr))
-            #         break
-            #     print("no free {} core".format(self.config.concurrent_emu * self.config.emu_threads))
-            #     time.sleep(5)
-            ## only for tutorial
-            with open(self.context.getOutPath(iterid, i), "w") as stdout, open(self.context.getPerfPath(iterid, i), "w") as stderr:
-                procs.append(Popen(args=self.context.genRunCMD(population, i), shell=True, encoding='utf-8', stdin=PIPE, stdout=stdout, stderr=stderr))
-            i += 1
-        for proc in procs:
-            proc.wait()
+    def profilling_counters(self, path) -> dict:
+        # {target: [sum, count]} of the opt_target counters printed by one run
+        counters = {list(opt.keys())[0]: [0, 0] for opt in self.config.opt_target}
+        with open(path, "r") as fp:
+            for line in fp:
+                for name in counters:
+                    if name in line:
+                        counters[name][0] += int(list(filter(lambda x: x != '', line.split(' ')))[-1])
+                        counters[name][1] += 1
+        return counters
+    def simulate(self, iterid: int, population: list, pending: list, cache: FitnessCache, suffix = "") -> set:
+        # run pending individuals from a work queue into cache, returns the failed keys
+        pending = list(pending)
+        pin = shutil.which("numactl") is not None
+        if pin and self.config.emu_threads > get_allocator().num_cores:
+            # no window would ever be free, like CoreAllocator.acquire
+            raise ValueError(f"cannot lease {self.config.emu_threads} cores on a host with {get_allocator().num_cores} cores")
+        running = dict()
+        failed = set()
+        reported = False
+        while pending or running:
+            # start runs while there is a free slot and a free core window
+            while pending and len(running) < self.config.concurrent_emu:
+                if pin:
+                    (succ, numa, coreStart, coreEnd) = self.context.get_free_cores()
+                    if not succ:
+                        if not running and not reported:
+                            print("no free {} cores, waiting".format(self.config.emu_threads))
+                            reported = True
+                        break
+                else:
+                    (numa, coreStart, coreEnd) = (None, None, None)
+                i = pending.pop(0)
+                print(population[i], flush=True)
+                with open(self.context.getOutPath(iterid, i, suffix), "w") as stdout, open(self.context.getPerfPath(iterid, i, suffix), "w") as stderr:
+                    proc = Popen(args=self.context.genRunCMD(population, i, numa, coreStart, coreEnd, cache.max_instr), shell=True, encoding='utf-8', stdin=PIPE, stdout=stdout, stderr=stderr)
+                running[proc] = (i, coreStart)
+            # collect finished runs as they come
+            finished = [proc for proc in running if proc.poll() is not None]
+            for proc in finished:
+                (i, coreStart) = running.pop(proc)
+                self.context.release_cores(coreStart)
+                self.emu_runs[0 if cache is self.cache else 1] += 1
+                key = self.HashList(population[i]).key()
+                if proc.returncode != 0:
+                    print(f"emu of {population[i]} exited with {proc.returncode}, see {self.context.getPerfPath(iterid, i, suffix)}")
+                    failed.add(key)
+                    continue
+                cache.store(key, self.profilling_counters(self.context.getPerfPath(iterid, i, suffix)))
+                print(f"{population[i]} fitness {cache.fitness(key)}{suffix}", flush=True)
+            if not finished:
+                time.sleep(0.5)
+        return failed
+    def screen(self, pending: list, ratio: float, score: dict) -> tuple[list, list]:
+        # split pending into the best ceil(ratio * n) by score and the rest
+        if not pending:
+            return ([], [])
+        keep = max(1, math.ceil(ratio * len(pending)))
+        order = sorted(pending, key=lambda i : score[i], reverse=True)
+        return (order[:keep], order[keep:])
+    def run_one_round(self, iterid: int, population: list) -> list:
+        # fitness of every individual; only genomes missing from the cache are simulated
+        keys = [self.HashList(indiv).key() for indiv in population]
+        pending = []
+        for (i, key) in enumerate(keys):
+            if self.cache.fitness(key) is None and key not in [keys[j] for j in pending]:
+                pending.append(i)
+        print(f"{len(population) - len(pending)} of {len(population)} individuals are cached, simulating {len(pending)}")
+        estimate = dict()
+        failed = set()
+
+        surrogate = self.config.surrogate
+        trained = [(key, self.cache.fitness(key)) for key in self.cache.entries]
+        trained = [(key, fit) for (key, fit) in trained if fit is not None and self.parse_key(key) is not None]
+        if surrogate is not None and pending and len(trained) >= int(surrogate.get('min_samples', 20)):
+            model = Surrogate(self.config)
+            model.fit([self.parse_key(key) for (key, _) in trained], [fit for (_, fit) in trained])
+            (mu, sigma) = model.predict([population[i] for i in pending])
+            predicted = {i: mu[j] for (j, i) in enumerate(pending)}
+            ucb = {i: mu[j] + float(surrogate.get('explore', 1.0)) * sigma[j] for (j, i) in enumerate(pending)}
+            (pending, skipped) = self.screen(pending, float(surrogate.get('screen_ratio', 0.3)), ucb)
+            for i in skipped:
+                estimate[keys[i]] = predicted[i]
+            print(f"surrogate keeps {len(pending)}, predicts {len(skipped)}")
+
+        if self.low_cache is not None and len(pending) > 1:
+            low = [i for i in pending if self.low_cache.fitness(keys[i]) is None]
+            failed |= self.simulate(iterid, population, low, self.low_cache, "-low")
+            scale = self.config.max_instr / self.low_cache.max_instr
+            short = {i: -MAXVAL if keys[i] in failed else self.low_cache.fitness(keys[i], scale) for i in pending}
+            (pending, rest) = self.screen(pending, float(self.config.low_fidelity.get('promote_ratio', 0.3)), short)
+            for i in rest:
+                estimate[keys[i]] = short[i]
+            print(f"low fidelity promotes {len(pending)} of {len(pending) + len(rest)}")
+
+        failed |= self.simulate(iterid, population, pending, self.cache)
+        print(f"emu runs so far: {self.emu_runs[0]} full, {self.emu_runs[1]} low fidelity")
+        # failed runs are not cached and rank last
+        res = []
+        for key in keys:
+            fit = self.cache.fitness(key)
+            if fit is None:
+                fit = -MAXVAL if key in failed else estimate.get(key, -MAXVAL)
+            res.append(fit)
+        return res
+    def parse_key(self, key: str):
+        # inverse of HashList.key(), None for genomes of another set of constants
+        indiv = [const.rsplit(' ', 1) for const in key.split(';')]
+        if [name for (name, _) in indiv] != [constant.name for constant in self.config.constants]:
+            return None
+        return [[name, int(val)] for (name, val) in indiv]
     def mutation(self, item: list) -> list:
         res = []
         for val in item:
@@ -307,12 +499,12 @@ class Solution:
     class HashList:
         def __init__(self, obj: list) -> None:
             # obj: [['test1', 38], ['test2', 15]]
-            self.obj = obj
+            # copied, mutation() changes individuals in place
+            self.obj = [list(const) for const in obj]
+        def key(self) -> str:
+            return ';'.join(map(lambda const : ' '.join(map(lambda x : str(x), const)), self.obj))
         def __hash__(self) -> str:
-            res = ''
-            for const in self.obj:
-                res += ' '.join(map(lambda x : str(x), const))
-            return hash(res)
+            return hash(self.key())
         def __eq__(self, __o: object) -> bool:
             for (idx, const) in enumerate(self.obj):
                 if const != __o.obj[idx]:
@@ -338,12 +530,16 @@ class Solution:
                 print()
             print("iteration ", i, " begins")
             print()
-            self.run_one_round(i, parentPoplation)
-            fitness = self.profilling_fitness(i)
+            fitness = self.run_one_round(i, parentPoplation)
             for (pop, fit) in zip(parentPoplation, fitness):
-                globalMap[self.HashList(pop)] = fit
+                # estimated fitness never becomes the reported optimum
+                if self.cache.fitness(self.HashList(pop).key()) is not None:
+                    globalMap[self.HashList(pop)] = fit
             parentPoplation = self.genNextPop(parentPoplation, fitness)
 
+        if not globalMap:
+            print("no opt constant: every emu run failed or was only estimated, see the logs in", os.path.join(BUILD_PATH, self.config.tag))
+            return
         globalMap = zip(globalMap.keys(), globalMap.values())
         globalMap = sorted(globalMap, key=lambda x : x[1], reverse=True)
         print("opt constant for gene algrithom is ", list(globalMap)[0][0].obj, " fitness", int(list(globalMap)[0][1]))
@@ -0,0 +1,267 @@
+#! /usr/bin/env python3
+
+# Exclusive core windows for emu runs shared by all launchers on a host.
+#
+# Leases live in a small JSON state file guarded by flock(2), so concurrent
+# launchers (xiangshan.py, constantHelper.py, other users' jobs) never get
+# overlapping windows and no CPU usage has to be sampled. A lease belongs to
+# the process that took it: it is released explicitly, at interpreter exit,
+# or reclaimed by the next allocation once its owner has died or its
+# optional TTL has expired.
+#
+# usage:
+#   from core_allocator import CoreAllocator
+#   with CoreAllocator().acquire(16) as lease:
+#       run(f"{lease.numactl_prefix()} ./build/emu ...")
+#
+#   python3 core_allocator.py --list
+#   python3 core_allocator.py -n 16 -- ./build/emu -i workload.bin
+
+import argparse
+import atexit
+import fcntl
+import glob
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+
+DEFAULT_STATE_PATH = os.getenv("XS_CORE_ALLOCATOR", "/tmp/xs-core-allocator.json")
+
+
+def parse_cpulist(cpulist):
+    # "0-3,8,10-11" -> [0, 1, 2, 3, 8, 10, 11]
+    cpus = []
+    for item in cpulist.strip().split(","):
+        if not item:
+            continue
+        if "-" in item:
+            first, last = item.split("-")
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(item))
+    return cpus
+
+
+def physical_core_count():
+    # SMT siblings are not handed out; Linux numbers them after all physical cores
+    cores = set()
+    for topology in glob.glob("/sys/devices/system/cpu/cpu[0-9]*/topology"):
+        try:
+            with open(os.path.join(topology, "physical_package_id")) as f:
+                package = f.read().strip()
+            with open(os.path.join(topology, "core_id")) as f:
+                core = f.read().strip()
+        except OSError:
+            continue
+        cores.add((package, core))
+    return len(cores) if cores else os.cpu_count()
+
+
+def numa_nodes(num_cores):
+    # core -> NUMA node, falling back to two halves when sysfs has no node info
+    node_of = dict()
+    for node_path in glob.glob("/sys/devices/system/node/node[0-9]*"):
+        node = int(re.search(r"node(\d+)$", node_path).group(1))
+        try:
+            with open(os.path.join(node_path, "cpulist")) as f:
+                cpus = parse_cpulist(f.read())
+        except OSError:
+            continue
+        for cpu in cpus:
+            node_of[cpu] = node
+    if not node_of:
+        half = max(num_cores // 2, 1)
+        node_of = {cpu: min(cpu // half, 1) for cpu in range(num_cores)}
+    return node_of
+
+
+def process_start_time(pid):
+    # start time in clock ticks, distinguishes a live owner from a reused pid
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # the command name may contain spaces, fields restart after its ')'
+    return int(stat[stat.rindex(")") + 2:].split()[19])
+
+
+class CoreLease(object):
+    def __init__(self, allocator, lease_id, node, start, end):
+        self.allocator = allocator
+        self.lease_id = lease_id
+        self.node = node
+        self.start = start
+        self.end = end
+
+    def cores(self):
+        return range(self.start, self.end + 1)
+
+    def numactl_prefix(self):
+        return f"numactl -m {self.node} -C {self.start}-{self.end}"
+
+    def renew(self, ttl):
+        self.allocator.renew(self, ttl)
+
+    def release(self):
+        self.allocator.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def __repr__(self):
+        return f"CoreLease(node={self.node}, cores={self.start}-{self.end})"
+
+
+class CoreAllocator(object):
+    def __init__(self, state_path=DEFAULT_STATE_PATH, num_cores=None):
+        self.state_path = state_path
+        self.num_cores = physical_core_count() if num_cores is None else num_cores
+        self.node_of = numa_nodes(self.num_cores)
+        self.pid = os.getpid()
+        self.start_time = process_start_time(self.pid)
+        self.held = dict()
+        atexit.register(self.release_all)
+
+    def __locked_state(self, update):
+        # run update(leases) under an exclusive flock and write back what it returns
+        fd = os.open(self.state_path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                os.fchmod(fd, 0o666)  # shared by all users of the host
+            except OSError:
+                pass
+            with os.fdopen(os.dup(fd), "r+") as f:
+                content = f.read()
+                try:
+                    leases = json.loads(content)["leases"] if content else []
+                except (ValueError, KeyError, TypeError):
+                    leases = []
+                leases = [lease for lease in leases if self.__is_live(lease)]
+                result, leases = update(leases)
+                f.seek(0)
+                f.truncate()
+                json.dump({"leases": leases}, f, indent=1)
+            return result
+        finally:
+            os.close(fd)
+
+    def __is_live(self, lease):
+        if lease.get("expires") is not None and lease["expires"] < time.time():
+            return False
+        return process_start_time(lease["pid"]) == lease["pid_start"]
+
+    def __find_window(self, n, leases):
+        busy = set()
+        for lease in leases:
+            busy.update(range(lease["start"], lease["end"] + 1))
+        for start in range(0, self.num_cores - n + 1, n):
+            window = range(start, start + n)
+            if busy.intersection(window):
+                continue
+            nodes = set(self.node_of.get(core) for core in window)
+            if len(nodes) != 1 or None in nodes:
+                continue  # never straddle NUMA nodes
+            return start
+        return None
+
+    def try_acquire(self, n, owner="", ttl=None):
+        # lease a free window of n cores, or None if all windows are taken
+        def update(leases):
+            start = self.__find_window(n, leases)
+            if start is None:
+                return None, leases
+            lease_id = f"{self.pid}-{self.start_time}-{start}"
+            entry = {
+                "id": lease_id, "start": start, "end": start + n - 1, "node": self.node_of[start],
+                "pid": self.pid, "pid_start": self.start_time, "owner": owner,
+                "acquired": time.time(), "expires": None if ttl is None else time.time() + ttl
+            }
+            return entry, leases + [entry]
+        entry = self.__locked_state(update)
+        if entry is None:
+            return None
+        lease = CoreLease(self, entry["id"], entry["node"], entry["start"], entry["end"])
+        self.held[lease.lease_id] = lease
+        return lease
+
+    def acquire(self, n, owner="", ttl=None, timeout=None, poll=0.5):
+        # block until a window of n cores is free; None after timeout seconds
+        if n > self.num_cores:
+            raise ValueError(f"cannot lease {n} cores on a host with {self.num_cores} cores")
+        deadline = None if timeout is None else time.time() + timeout
+        reported = False
+        while True:
+            lease = self.try_acquire(n, owner, ttl)
+            if lease is not None:
+                return lease
+            if deadline is not None and time.time() >= deadline:
+                return None
+            if not reported:
+                print(f"No free {n} cores found, waiting for a lease to be released")
+                reported = True
+            time.sleep(poll * random.uniform(0.5, 1.5))
+
+    def renew(self, lease, ttl):
+        def update(leases):
+            for entry in leases:
+                if entry["id"] == lease.lease_id:
+                    entry["expires"] = time.time() + ttl
+            return None, leases
+        self.__locked_state(update)
+
+    def release(self, lease):
+        if self.held.pop(lease.lease_id, None) is None:
+            return
+        self.__locked_state(lambda leases: (None, [l for l in leases if l["id"] != lease.lease_id]))
+
+    def release_all(self):
+        held = set(self.held)
+        if not held or os.getpid() != self.pid:
+            return  # nothing to do, or a forked child that does not own the leases
+        self.held.clear()
+        self.__locked_state(lambda leases: (None, [l for l in leases if l["id"] not in held]))
+
+    def leases(self):
+        return self.__locked_state(lambda leases: (list(leases), leases))
+
+
+default_allocator = None
+
+def get_allocator():
+    # the process-wide allocator on the default state file
+    global default_allocator
+    if default_allocator is None:
+        default_allocator = CoreAllocator()
+    return default_allocator
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lease exclusive core windows for emu runs")
+    parser.add_argument("-n", "--num-cores", type=int, help="lease a window of this many cores and run the command under numactl")
+    parser.add_argument("--list", action="store_true", help="list the live leases")
+    parser.add_argument("--state", type=str, default=DEFAULT_STATE_PATH, help="lease state file")
+    parser.add_argument("--timeout", type=float, help="give up after this many seconds without a free window")
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="command to run")
+    args = parser.parse_args()
+
+    allocator = CoreAllocator(args.state)
+    if args.list:
+        for lease in allocator.leases():
+            print(f"node {lease['node']} cores {lease['start']}-{lease['end']} pid {lease['pid']} {lease['owner']}")
+    if args.num_cores is not None:
+        command = args.command[1:] if args.command[:1] == ["--"] else args.command
+        lease = allocator.acquire(args.num_cores, owner=" ".join(command), timeout=args.timeout)
+        if lease is None:
+            print(f"No free {args.num_cores} cores within {args.timeout} seconds")
+            sys.exit(1)
+        with lease:
+            sys.exit(subprocess.call(lease.numactl_prefix().split() + command))
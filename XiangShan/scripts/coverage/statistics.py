@@ -18,10 +18,14 @@
 #***************************************************************************************
 
 
-import sys
 import re
 import copy
 import pprint
+import argparse
+import os
+from multiprocessing import Pool
+
+import numpy as np
 
 LINE_COVERRED = "LINE_COVERRED"
 NOT_LINE_COVERRED = "NOT_LINE_COVERRED"
@@ -42,93 +46,64 @@ TREECOVERAGE = "TREECOVERAGE"
 LINECOVERAGE = 0
 TOGGLECOVERAGE = 1
 
-def check_one_hot(l):
-    cnt = 0
-    for e in l:
-        if e:
-            cnt += 1
-    return cnt <= 1
-
-def get_lines(input_file):
-    lines = []
-    with open(input_file) as f:
-        for line in f:
-            lines.append(line)
-    return lines
+# line annotations as small integers, the index into ANNOTATIONS
+ANNOTATIONS = [DONTCARE, LINE_COVERRED, NOT_LINE_COVERRED, TOGGLE_COVERRED, NOT_TOGGLE_COVERRED]
+DONTCARE_CODE, LINE_COVERRED_CODE, NOT_LINE_COVERRED_CODE, TOGGLE_COVERRED_CODE, NOT_TOGGLE_COVERRED_CODE = range(5)
+
+# pattern_1: 040192     if(array_0_MPORT_en & array_0_MPORT_mask) begin
+# pattern_2: 2218110        end else if (_T_30) begin // @[Conditional.scala 40:58]
+# pattern_2: 000417     end else begin
+# a count of digits is covered, a '%' followed by zeros is not,
+# if/end else are line coverage points, reg/wire/input/output toggle coverage points
+annotation_pattern = re.compile(r'^\s*(?:(\d+)|(%0+))\s+(if|end else|reg|wire|input|output)')
+
+def classify_line(line):
+    match = annotation_pattern.match(line)
+    if not match:
+        return DONTCARE_CODE
+    if match.group(3) in ("if", "end else"):
+        return LINE_COVERRED_CODE if match.group(1) else NOT_LINE_COVERRED_CODE
+    return TOGGLE_COVERRED_CODE if match.group(1) else NOT_TOGGLE_COVERRED_CODE
 
 def get_line_annotation(lines):
-    line_annotations = []
-    # pattern_1: 040192     if(array_0_MPORT_en & array_0_MPORT_mask) begin
-    # pattern_2: 2218110        end else if (_T_30) begin // @[Conditional.scala 40:58]
-    # pattern_2: 000417     end else begin
-    line_coverred_pattern_1 = re.compile('^\s*(\d+)\s+if')
-    line_coverred_pattern_2 = re.compile('^\s*(\d+)\s+end else')
-    not_line_coverred_pattern_1 = re.compile('^\s*(%0+)\s+if')
-    not_line_coverred_pattern_2 = re.compile('^\s*(%0+)\s+end else')
-
-    toggle_coverred_pattern_1 = re.compile('^\s*(\d+)\s+reg')
-    toggle_coverred_pattern_2 = re.compile('^\s*(\d+)\s+wire')
-    toggle_coverred_pattern_3 = re.compile('^\s*(\d+)\s+input')
-    toggle_coverred_pattern_4 = re.compile('^\s*(\d+)\s+output')
-
-    not_toggle_coverred_pattern_1 = re.compile('^\s*(%0+)\s+reg')
-    not_toggle_coverred_pattern_2 = re.compile('^\s*(%0+)\s+wire')
-    not_toggle_coverred_pattern_3 = re.compile('^\s*(%0+)\s+input')
-    not_toggle_coverred_pattern_4 = re.compile('^\s*(%0+)\s+output')
-
-    line_cnt = 0
-
-    for line in lines:
-        line_coverred_match = line_coverred_pattern_1.search(line) or line_coverred_pattern_2.search(line)
-        not_line_coverred_match = not_line_coverred_pattern_1.search(line) or not_line_coverred_pattern_2.search(line)
-
-        assert not (line_coverred_match and not_line_coverred_match)
-
-        toggle_coverred_match = toggle_coverred_pattern_1.search(line) or toggle_coverred_pattern_2.search(line) or \
-                toggle_coverred_pattern_3.search(line) or toggle_coverred_pattern_4.search(line)
-        not_toggle_coverred_match = not_toggle_coverred_pattern_1.search(line) or not_toggle_coverred_pattern_2.search(line) or \
-                not_toggle_coverred_pattern_3.search(line) or not_toggle_coverred_pattern_4.search(line)
-
-        assert not (toggle_coverred_match and not_toggle_coverred_match)
-
-        all_match = (line_coverred_match, not_line_coverred_match,
-                toggle_coverred_match, not_toggle_coverred_match)
-        if not check_one_hot(all_match):
-            print("not_one_hot")
-            print(line_cnt)
-            print(all_match)
-            assert False, "This line matches multiple patterns"
-        if line_coverred_match:
-            line_annotations.append(LINE_COVERRED)
-        elif not_line_coverred_match:
-            line_annotations.append(NOT_LINE_COVERRED)
-        elif toggle_coverred_match:
-            line_annotations.append(TOGGLE_COVERRED)
-        elif not_toggle_coverred_match:
-            line_annotations.append(NOT_TOGGLE_COVERRED)
-        else:
-            line_annotations.append(DONTCARE)
-        line_cnt += 1
-    return line_annotations
-
-# get the line coverage statistics in line range [start, end)
-def get_coverage_statistics(line_annotations, start, end):
-    line_coverred = 0
-    not_line_coverred = 0
-    toggle_coverred = 0
-    not_toggle_coverred = 0
-    for i in range(start, end):
-        if line_annotations[i] == LINE_COVERRED:
-            line_coverred += 1
-
-        if line_annotations[i] == NOT_LINE_COVERRED:
-            not_line_coverred += 1
+    return [ANNOTATIONS[classify_line(line)] for line in lines]
 
-        if line_annotations[i] == TOGGLE_COVERRED:
-            toggle_coverred += 1
+# per-file worker: annotation codes of every line, and the module ranges when asked
+def annotate_file(task):
+    input_file, with_modules = task
+    codes = bytearray()
+    parser = ModuleParser() if with_modules else None
+    with open(input_file) as f:
+        for line_count, line in enumerate(f):
+            codes.append(classify_line(line))
+            if parser:
+                parser.feed(line, line_count)
+    return input_file, bytes(codes), parser.modules if parser else None
+
+# a line is covered once any run covers it
+def merge_annotations(all_codes):
+    merged = np.frombuffer(all_codes[0], dtype=np.uint8).copy()
+    for codes in all_codes[1:]:
+        codes = np.frombuffer(codes, dtype=np.uint8)
+        merged[codes == LINE_COVERRED_CODE] = LINE_COVERRED_CODE
+        merged[codes == TOGGLE_COVERRED_CODE] = TOGGLE_COVERRED_CODE
+    return merged
+
+# prefix sums of every annotation kind, so any line range is counted in O(1)
+def get_coverage_index(codes):
+    codes = np.asarray(codes, dtype=np.uint8)
+    index = np.zeros((len(ANNOTATIONS), len(codes) + 1), dtype=np.int64)
+    for code in range(len(ANNOTATIONS)):
+        np.cumsum(codes == code, out=index[code, 1:])
+    return index
 
-        if line_annotations[i] == NOT_TOGGLE_COVERRED:
-            not_toggle_coverred += 1
+# get the line coverage statistics in line range [start, end)
+def get_coverage_statistics(coverage_index, start, end):
+    counts = coverage_index[:, end] - coverage_index[:, start]
+    line_coverred = int(counts[LINE_COVERRED_CODE])
+    not_line_coverred = int(counts[NOT_LINE_COVERRED_CODE])
+    toggle_coverred = int(counts[TOGGLE_COVERRED_CODE])
+    not_toggle_coverred = int(counts[NOT_TOGGLE_COVERRED_CODE])
 
     # deal with divide by zero
     line_coverage = 1.0
@@ -141,22 +116,25 @@ def get_coverage_statistics(line_annotations, start, end):
     return ((line_coverred, not_line_coverred, line_coverage),
             (toggle_coverred, not_toggle_coverred, toggle_coverage))
 
-# get modules and all it's submodules
-def get_modules(lines):
-    modules = {}
-
+# get modules and all it's submodules, one line at a time
+class ModuleParser:
     module_pattern = re.compile("module (\w+)\(")
     endmodule_pattern = re.compile("endmodule")
     submodule_pattern = re.compile("(\w+) (\w+) \( // @\[\w+.scala \d+:\d+\]")
 
-    line_count = 0
+    def __init__(self):
+        self.modules = {}
+        self.name = "ModuleName"
 
-    name = "ModuleName"
-
-    for line in lines:
-        module_match = module_pattern.search(line)
-        endmodule_match = endmodule_pattern.search(line)
-        submodule_match = submodule_pattern.search(line)
+    def feed(self, line, line_count):
+        # cheap substring checks first, most lines are none of these
+        if "module" not in line and "// @[" not in line:
+            return
+        modules = self.modules
+        name = self.name
+        module_match = self.module_pattern.search(line)
+        endmodule_match = self.endmodule_pattern.search(line)
+        submodule_match = self.submodule_pattern.search(line)
 
         assert not (module_match and endmodule_match)
 
@@ -200,9 +178,13 @@ def get_modules(lines):
                     modules[name][CHILDREN] = []
                 submodule = {MODULE: submodule_type, INSTANCE: submodule_instance}
                 modules[name][CHILDREN].append(submodule)
+        self.name = name
 
-        line_count += 1
-    return modules
+def get_modules(lines):
+    parser = ModuleParser()
+    for line_count, line in enumerate(lines):
+        parser.feed(line, line_count)
+    return parser.modules
 
 # we define two coverage metrics:
 # self coverage: coverage results of this module(excluding submodules)
@@ -277,23 +259,29 @@ def print_tree_coverage(tree_coverage):
             dfs(module, 0)
 
 if __name__ == "__main__":
-    assert len(sys.argv) == 2, "Expect input_file"
-    input_file = sys.argv[1]
+    parser = argparse.ArgumentParser(description="line and toggle coverage of annotated verilog")
+    parser.add_argument("input_file", nargs="+", help="annotated verilog, several runs of the same design are merged")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of files annotated in parallel")
+    args = parser.parse_args()
     pp = pprint.PrettyPrinter(indent=4)
 
-    lines = get_lines(input_file)
-    # print("lines:")
-    # pp.pprint(lines)
-
-    annotations = get_line_annotation(lines)
-    # print("annotations:")
-    # pp.pprint(annotations)
-
-    modules = get_modules(lines)
+    # each file is read once; module ranges come from the first one
+    tasks = [(input_file, i == 0) for i, input_file in enumerate(args.input_file)]
+    if len(tasks) == 1:
+        results = [annotate_file(tasks[0])]
+    else:
+        with Pool(min(args.jobs, len(tasks))) as pool:
+            results = pool.map(annotate_file, tasks)
+    modules = results[0][2]
+    for input_file, codes, _ in results[1:]:
+        assert len(codes) == len(results[0][1]), "%s is not annotated from the same design as %s" % (input_file, args.input_file[0])
+
+    annotations = merge_annotations([codes for _, codes, _ in results])
+    coverage_index = get_coverage_index(annotations)
     # print("modules:")
     # pp.pprint(modules)
 
-    self_coverage = {module: get_coverage_statistics(annotations, modules[module][BEGIN], modules[module][END])
+    self_coverage = {module: get_coverage_statistics(coverage_index, modules[module][BEGIN], modules[module][END])
             for module in modules}
     # print("self_coverage:")
     # pp.pprint(self_coverage)
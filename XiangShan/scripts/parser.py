@@ -1,8 +1,13 @@
 #! /usr/bin/env python3
 
 import argparse
+import hashlib
+import io
+import mmap
 import os
+import pickle
 import re
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date
 from shutil import copy, copytree
 
@@ -47,16 +52,46 @@ class VModule(object):
     # we can only get the submodule's module name, and set instance name "multiline_instance"
     submodule_re_multiline = re.compile(r'^\s*(\w+)\s*#*\(\s*$')
     difftest_module_re = re.compile(r'^  \w*Difftest\w+\s+\w+ \( //.*$')
+    # print every submodule match while parsing (very noisy on full SoCs)
+    verbose = False
 
-    def __init__(self, name):
+    def __init__(self, name, source=None):
         self.name = name
-        self.lines = []
+        # lazy modules keep only (file, byte offset, length) of their body and
+        # rebuild the lines from the file when they are needed
+        self.source = source
+        self.lines = [] if source is None else None
         self.io = []
         self.submodule = dict()
         self.instance = set()
         self.in_difftest = False
 
+    def is_lazy(self):
+        return self.lines is None
+
+    def load_lines(self):
+        # replay the source lines through add_line to rebuild the body
+        vfile, offset, length = self.source
+        body = VModule(self.name)
+        in_header = True
+        for raw in io.BytesIO(read_source(vfile, offset, length)):
+            line = decode_line(raw)
+            if in_header:
+                # blank lines before the module header were not part of the module
+                if self.module_re.match(line):
+                    in_header = False
+                elif line.strip() == "":
+                    continue
+            body.add_line(line)
+        return body.lines
+
+    def materialize(self):
+        if self.is_lazy():
+            self.lines = self.load_lines()
+
     def add_line(self, line):
+        # lazy modules only track parsing state and metadata here
+        body = self.lines if self.lines is not None else []
         debug_dontCare = False
         if "RenameTable" in self.name:
             if line.strip().startswith("assign io_debug_rdata_"):
@@ -69,37 +104,38 @@ class VModule(object):
         difftest_match = self.difftest_module_re.match(line)
         if difftest_match:
             self.in_difftest = True
-            self.lines.append("`ifndef SYNTHESIS\n")
+            body.append("`ifndef SYNTHESIS\n")
 
         if debug_dontCare:
-            self.lines.append("`ifndef SYNTHESIS\n")
-        self.lines.append(line)
+            body.append("`ifndef SYNTHESIS\n")
+        body.append(line)
         if debug_dontCare:
-            self.lines.append("`else\n")
+            body.append("`else\n")
             debug_dontCare_name = line.strip().split(" ")[1]
-            self.lines.append(f"  assign {debug_dontCare_name} = 0;\n")
-            self.lines.append("`endif\n")
+            body.append(f"  assign {debug_dontCare_name} = 0;\n")
+            body.append("`endif\n")
 
         # end of difftest module
         if self.in_difftest and line.strip() == ");":
             self.in_difftest = False
-            self.lines.append("`endif\n")
+            body.append("`endif\n")
 
-        if len(self.lines):
+        if len(body):
             io_match = self.io_re.match(line)
             if io_match:
                 this_io = VIO(tuple(map(lambda i: io_match.group(i), range(1, 4))))
                 self.io.append(this_io)
             submodule_mutiline_match = self.submodule_re_multiline.match(line)
             submodule_match = self.submodule_re.match(line) or submodule_mutiline_match
-            if submodule_mutiline_match:
+            if submodule_mutiline_match and self.verbose:
                 print('submodule_re_mutiline:')
                 print(line)
             if submodule_match:
                 this_submodule = submodule_match.group(1)
                 if this_submodule != "module":
-                    print(self.name + " submodule_match:")
-                    print(this_submodule)
+                    if self.verbose:
+                        print(self.name + " submodule_match:")
+                        print(this_submodule)
                     self.add_submodule(this_submodule)
                     if (submodule_mutiline_match):
                         self.add_instance(this_submodule, "multiline_instance")
@@ -114,6 +150,7 @@ class VModule(object):
         return self.name
 
     def set_name(self, updated_name):
+        self.materialize()
         for i, line in enumerate(self.lines):
             module_match = VModule.module_re.match(line)
             if module_match:
@@ -125,7 +162,8 @@ class VModule(object):
         self.name = updated_name
 
     def get_lines(self):
-        return self.lines + ["\n"]
+        lines = self.load_lines() if self.is_lazy() else self.lines
+        return lines + ["\n"]
 
     def get_io(self, prefix="", match=""):
         if match:
@@ -164,6 +202,7 @@ class VModule(object):
         self.lines = [s]
 
     def replace_with_macro(self, macro, s):
+        self.materialize()
         replaced_lines = []
         in_io, in_body = False, False
         for line in self.lines:
@@ -185,6 +224,22 @@ class VModule(object):
                 replaced_lines.append(line)
         self.lines = replaced_lines
 
+    def to_record(self):
+        # compact, cheaply picklable form used to return modules from loader processes
+        io_info = tuple(vio.info for vio in self.io)
+        return (self.name, self.lines, io_info, self.submodule, tuple(self.instance), self.in_difftest, self.source)
+
+    @classmethod
+    def from_record(cls, record):
+        name, lines, io_info, submodule, instance, in_difftest, source = record
+        module = cls(name, source)
+        module.lines = lines
+        module.io = [VIO(info) for info in io_info]
+        module.submodule = submodule
+        module.instance = set(instance)
+        module.in_difftest = in_difftest
+        return module
+
     def __str__(self):
         module_name = "Module {}: \n".format(self.name)
         module_io = "\n".join(map(lambda x: "\t" + str(x), self.io)) + "\n"
@@ -195,38 +250,86 @@ class VModule(object):
 
 
 class VCollection(object):
-    def __init__(self):
+    def __init__(self, lazy_bodies=False, cache=None):
         self.modules = []
+        # keep module bodies in the source files instead of in memory
+        self.lazy_bodies = lazy_bodies
+        # ParseCache of per-file results, or None to always parse
+        self.cache = cache
         self.ancestors = []
+        # name -> module index (the last loaded module wins, as in a linear scan)
+        self.module_index = dict()
+        # memoized hierarchy walks, cleared whenever the module set changes
+        self.instance_count_cache = dict()
+        self.prefix_subtree_cache = dict()
+
+    def index_module(self, module):
+        self.modules.append(module)
+        self.module_index[module.get_name()] = module
+        self.invalidate_hierarchy_cache()
+
+    def rename_module(self, module, updated_name):
+        if self.module_index.get(module.get_name()) is module:
+            del self.module_index[module.get_name()]
+        module.set_name(updated_name)
+        self.module_index[updated_name] = module
+        self.invalidate_hierarchy_cache()
+
+    def invalidate_hierarchy_cache(self):
+        self.instance_count_cache.clear()
+        self.prefix_subtree_cache.clear()
 
     def load_modules(self, vfile):
-        in_module = False
-        current_module = None
-        skipped_lines = []
-        with open(vfile) as f:
-            print("Loading modules from {}...".format(vfile))
-            for i, line in enumerate(f):
-                module_match = VModule.module_re.match(line)
-                if module_match:
-                    module_name = module_match.group(1)
-                    if in_module or current_module is not None:
-                        print("Line {}: does not find endmodule for {}".format(i, current_module))
-                        exit()
-                    current_module = VModule(module_name)
-                    for skip_line in skipped_lines:
-                        print("[WARNING]{}:{} is added to module {}:\n{}".format(vfile, i, module_name, skip_line), end="")
-                        current_module.add_line(skip_line)
-                    skipped_lines = []
-                    in_module = True
-                if not in_module or current_module is None:
-                    if line.strip() != "":# and not line.strip().startswith("//"):
-                        skipped_lines.append(line)
+        print("Loading modules from {}...".format(vfile))
+        cached = None if self.cache is None else self.cache.load(vfile, self.lazy_bodies)
+        if cached is not None:
+            self.load_records(*cached)
+            return
+        warnings = []
+        with open(vfile, "rb") as f:
+            modules, error = parse_modules(f, vfile, warnings=warnings, lazy=self.lazy_bodies)
+        records = [module.to_record() for module in modules]
+        self.load_records(records, warnings, error)
+        if self.cache is not None:
+            self.cache.store(vfile, self.lazy_bodies, records, warnings)
+
+    def load_records(self, records, warnings, error=None):
+        for warning in warnings:
+            print(warning, end="")
+        for record in records:
+            self.index_module(VModule.from_record(record))
+        if error is not None:
+            print(error)
+            exit()
+
+    def load_modules_parallel(self, files, jobs=None, chunk_bytes=64 << 20):
+        # Split files (large ones at endmodule boundaries) across a process pool.
+        # Chunks are merged in file order, so the result matches load_modules.
+        # Files with a valid cache entry are not parsed at all.
+        cached, chunks, num_chunks = [], [], []
+        for vfile in files:
+            entry = None if self.cache is None else self.cache.load(vfile, self.lazy_bodies)
+            file_chunks = [] if entry is not None else split_verilog_file(vfile, chunk_bytes)
+            cached.append(entry)
+            chunks += file_chunks
+            num_chunks.append(len(file_chunks))
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            verbose = [VModule.verbose] * len(chunks)
+            lazy = [self.lazy_bodies] * len(chunks)
+            results = executor.map(load_verilog_chunk, chunks, verbose, lazy) if chunks else iter(())
+            for vfile, entry, n in zip(files, cached, num_chunks):
+                print("Loading modules from {}...".format(vfile))
+                if entry is not None:
+                    self.load_records(*entry)
                     continue
-                current_module.add_line(line)
-                if line.startswith("endmodule"):
-                    self.modules.append(current_module)
-                    current_module = None
-                    in_module = False
+                file_records, file_warnings = [], []
+                for _ in range(n):
+                    records, messages, error = next(results)
+                    self.load_records(records, messages, error)
+                    file_records += records
+                    file_warnings += messages
+                if self.cache is not None:
+                    self.cache.store(vfile, self.lazy_bodies, file_records, file_warnings)
 
     def get_module_names(self):
         return list(map(lambda m: m.get_name(), self.modules))
@@ -238,22 +341,65 @@ class VCollection(object):
         else:
             return self.modules
 
+    def find_module(self, name, try_prefix=None):
+        target = self.module_index.get(name)
+        if target is None and try_prefix is not None:
+            name_no_prefix = name[len(try_prefix):]
+            target = self.module_index.get(name_no_prefix)
+            if target is not None:
+                print(f"Replace {name_no_prefix} with modulename {name}. Please DOUBLE CHECK the verilog.")
+                self.rename_module(target, name)
+        return target
+
+    def get_closure(self, target, try_prefix=None, ignore_modules=None):
+        # each module is expanded once, however many times it is instantiated
+        submodules = {target}
+        visited = {target.get_name()}
+        stack = [target]
+        while stack:
+            module = stack.pop()
+            for submodule, _ in module.get_instance():
+                if ignore_modules is not None and submodule in ignore_modules:
+                    continue
+                if submodule in visited:
+                    continue
+                visited.add(submodule)
+                result = self.find_module(submodule, try_prefix)
+                if result is None:
+                    print("Error: cannot find submodules of {} or the module itself".format(submodule))
+                    return None
+                submodules.add(result)
+                stack.append(result)
+        return submodules
+
+    def has_prefixed_submodule(self, name, negedge_prefix, try_prefix=None, ignore_modules=None):
+        # whether the subtree below module `name` instantiates a negedge module
+        key = (name, negedge_prefix, try_prefix)
+        if key in self.prefix_subtree_cache:
+            return self.prefix_subtree_cache[key]
+        self.prefix_subtree_cache[key] = False  # guards against malformed cycles
+        found = False
+        module = self.find_module(name, try_prefix)
+        if module is not None:
+            for submodule, _ in module.get_instance():
+                if ignore_modules is not None and submodule in ignore_modules:
+                    continue
+                if submodule.startswith(negedge_prefix) or \
+                        (try_prefix is not None and submodule.startswith(try_prefix + negedge_prefix)) or \
+                        self.has_prefixed_submodule(submodule, negedge_prefix, try_prefix, ignore_modules):
+                    found = True
+                    break
+        self.prefix_subtree_cache[key] = found
+        return found
+
     def get_module(self, name, negedge_modules=None, negedge_prefix=None, with_submodule=False, try_prefix=None, ignore_modules=None):
         if negedge_modules is None:
             negedge_modules = []
-        target = None
-        for module in self.modules:
-            if module.get_name() == name:
-                target = module
-        if target is None and try_prefix is not None:
-            for module in self.modules:
-                name_no_prefix = name[len(try_prefix):]
-                if module.get_name() == name_no_prefix:
-                    target = module
-                    print(f"Replace {name_no_prefix} with modulename {name}. Please DOUBLE CHECK the verilog.")
-                    target.set_name(name)
+        target = self.find_module(name, try_prefix)
         if target is None or not with_submodule:
             return target
+        if negedge_prefix is None:
+            return self.get_closure(target, try_prefix, ignore_modules)
         submodules = set()
         submodules.add(target)
         for submodule, instance in target.get_instance():
@@ -268,6 +414,10 @@ class VCollection(object):
                     is_negedge_module = True
             if is_negedge_module:
                 negedge_modules.append("/".join(self.ancestors))
+            elif not self.has_prefixed_submodule(submodule, negedge_prefix, try_prefix, ignore_modules):
+                # no negedge instance below: skip walking every path of this subtree
+                self.ancestors.pop()
+                continue
             result = self.get_module(submodule, negedge_modules, negedge_prefix, with_submodule=True, try_prefix=try_prefix, ignore_modules=ignore_modules)
             self.ancestors.pop()
             if result is None:
@@ -326,19 +476,211 @@ class VCollection(object):
     def add_module(self, name, line):
         module = VModule(name)
         module.add_line(line)
-        self.modules.append(module)
+        self.index_module(module)
         return module
 
     def count_instances(self, top_name, name):
+        # counts[m] = number of `name` instances below module m, shared by all queries for `name`
+        counts = self.instance_count_cache.setdefault(name, dict())
+        return self._count_instances(top_name, name, counts)
+
+    def _count_instances(self, top_name, name, counts):
         if top_name == name:
             return 1
+        if top_name in counts:
+            return counts[top_name]
+        counts[top_name] = 0  # guards against malformed cycles
         count = 0
-        top_module = self.get_module(top_name)
+        top_module = self.module_index.get(top_name)
         if top_module is not None:
-            for submodule in top_module.submodule:
-                count += top_module.submodule[submodule] * self.count_instances(submodule, name)
+            for submodule, num in top_module.submodule.items():
+                count += num * self._count_instances(submodule, name, counts)
+        counts[top_name] = count
         return count
 
+def decode_line(raw):
+    # decode like open(): utf-8 with \r\n translated to \n
+    line = raw.decode("utf-8")
+    if line.endswith("\r\n"):
+        line = line[:-2] + "\n"
+    return line
+
+source_maps = dict()
+
+def read_source(vfile, offset, length):
+    # bytes of a lazy module body, read through a cached read-only mmap
+    source = source_maps.get(vfile)
+    if source is None:
+        with open(vfile, "rb") as f:
+            source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        source_maps[vfile] = source
+    return source[offset:offset + length]
+
+def file_digest(vfile):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(vfile, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class ParseCache(object):
+    # On-disk parse results (module records and warnings), one entry per file.
+    # An entry is reused while its file keeps the same size and mtime. When
+    # only the mtime changed (regenerated but identical RTL), a content hash
+    # decides. Bump VERSION whenever parse_modules or the records change.
+    VERSION = 1
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        # file -> (size, mtime) seen by load(), so store() describes what was parsed
+        self.stats = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def entry_path(self, vfile):
+        key = hashlib.sha1(os.path.realpath(vfile).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key + ".pkl")
+
+    def read_entry(self, vfile):
+        try:
+            with open(self.entry_path(vfile), "rb") as f:
+                return pickle.load(f)
+        except Exception:
+            # missing, truncated or written by an incompatible version
+            return None
+
+    def write_entry(self, vfile, entry):
+        path = self.entry_path(vfile)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def load(self, vfile, lazy):
+        # (records, warnings) of vfile, or None if it has to be parsed
+        stat = os.stat(vfile)
+        self.stats[vfile] = (stat.st_size, stat.st_mtime_ns)
+        entry = self.read_entry(vfile)
+        valid = isinstance(entry, dict) and entry.get("version") == self.VERSION and \
+            entry["path"] == os.path.realpath(vfile) and entry["lazy"] == lazy and entry["size"] == stat.st_size
+        if valid and entry["mtime"] != stat.st_mtime_ns:
+            valid = entry["digest"] == file_digest(vfile)
+            if valid:
+                entry["mtime"] = stat.st_mtime_ns
+                self.write_entry(vfile, entry)
+        if not valid:
+            self.misses += 1
+            return None
+        self.hits += 1
+        records = entry["records"]
+        if lazy:
+            # lazy bodies are byte ranges of the file, under its current name
+            records = [record[:-1] + ((vfile,) + record[-1][1:],) for record in records]
+        return records, entry["warnings"]
+
+    def store(self, vfile, lazy, records, warnings):
+        size, mtime = self.stats.pop(vfile, (None, None))
+        digest = file_digest(vfile)
+        stat = os.stat(vfile)
+        if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+            return # changed while it was parsed
+        self.write_entry(vfile, {
+            "version": self.VERSION, "path": os.path.realpath(vfile), "lazy": lazy,
+            "size": size, "mtime": mtime, "digest": digest,
+            "records": records, "warnings": warnings
+        })
+
+def parse_modules(raw_lines, vfile, first_line=0, warnings=None, offset=0, lazy=False):
+    # Group binary lines (starting at byte `offset` of vfile) into modules.
+    # Non-empty lines outside a module are added to the next module. Lazy
+    # modules record the byte range of their body instead of its lines.
+    # Returns (modules, error) where error reports a module without
+    # endmodule (parsing stops there).
+    in_module = False
+    current_module = None
+    skipped_lines = []
+    skipped_start = None
+    modules = []
+    for i, raw in enumerate(raw_lines, first_line):
+        line = decode_line(raw)
+        line_start = offset
+        offset += len(raw)
+        module_match = VModule.module_re.match(line)
+        if module_match:
+            module_name = module_match.group(1)
+            if in_module or current_module is not None:
+                return modules, "Line {}: does not find endmodule for {}".format(i, current_module)
+            module_start = line_start if skipped_start is None else skipped_start
+            current_module = VModule(module_name, (vfile, module_start, 0) if lazy else None)
+            for skip_line in skipped_lines:
+                warning = "[WARNING]{}:{} is added to module {}:\n{}".format(vfile, i, module_name, skip_line)
+                if warnings is None:
+                    print(warning, end="")
+                else:
+                    warnings.append(warning)
+                current_module.add_line(skip_line)
+            skipped_lines = []
+            skipped_start = None
+            in_module = True
+        if not in_module or current_module is None:
+            if line.strip() != "":# and not line.strip().startswith("//"):
+                if skipped_start is None:
+                    skipped_start = line_start
+                skipped_lines.append(line)
+            continue
+        current_module.add_line(line)
+        if line.startswith("endmodule"):
+            if lazy:
+                module_start = current_module.source[1]
+                current_module.source = (vfile, module_start, offset - module_start)
+            modules.append(current_module)
+            current_module = None
+            in_module = False
+    return modules, None
+
+def split_verilog_file(vfile, chunk_bytes):
+    # (file, start, end, first line number) chunks that end right after an endmodule line
+    size = os.path.getsize(vfile)
+    if size <= chunk_bytes:
+        return [(vfile, 0, size, 0)]
+    chunks = []
+    start, first_line = 0, 0
+    with open(vfile, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        while start + chunk_bytes < size:
+            boundary = data.find(b"\nendmodule", start + chunk_bytes)
+            if boundary < 0:
+                break
+            end = data.find(b"\n", boundary + 1)
+            if end < 0 or end + 1 >= size:
+                break
+            end += 1
+            chunks.append((vfile, start, end, first_line))
+            first_line += data[start:end].count(b"\n")
+            start = end
+    chunks.append((vfile, start, size, first_line))
+    return chunks
+
+def read_lines(f, end):
+    # stream binary lines of f up to byte offset end
+    position = f.tell()
+    while position < end:
+        raw = f.readline()
+        if not raw:
+            break
+        position += len(raw)
+        yield raw
+
+def load_verilog_chunk(chunk, verbose=False, lazy=False):
+    # process pool worker: parse one chunk and return compact module records
+    vfile, start, end, first_line = chunk
+    VModule.verbose = verbose
+    warnings = []
+    with open(vfile, "rb") as f:
+        f.seek(start)
+        modules, error = parse_modules(read_lines(f, end), vfile, first_line, warnings, start, lazy)
+    return [module.to_record() for module in modules], warnings, error
+
 def check_data_module_template(collection):
     error_modules = []
     field_re = re.compile(r'io_(w|r)data_(\d*)(_.*|)')
@@ -358,10 +700,16 @@ def check_data_module_template(collection):
             error_modules.append(module)
     return error_modules
 
-def create_verilog(files, top_module, config, try_prefix=None, ignore_modules=None):
-    collection = VCollection()
-    for f in files:
-        collection.load_modules(f)
+def create_verilog(files, top_module, config, try_prefix=None, ignore_modules=None, jobs=None, lazy_bodies=True, cache_dir=None):
+    cache = None if cache_dir is None else ParseCache(cache_dir)
+    collection = VCollection(lazy_bodies, cache)
+    if jobs == 1:
+        for f in files:
+            collection.load_modules(f)
+    else:
+        collection.load_modules_parallel(files, jobs)
+    if cache is not None:
+        print(f"Parse cache: {cache.hits} files reused, {cache.misses} parsed ({cache_dir})")
     today = date.today()
     directory = f'{top_module}-Release-{config}-{today.strftime("%b-%d-%Y")}'
     success = collection.dump_to_file(top_module, os.path.join(directory, top_module), try_prefix=try_prefix, ignore_modules=ignore_modules)
@@ -700,6 +1048,11 @@ if __name__ == "__main__":
     parser.add_argument('--with-extra-files', action='store_true', help='copy extra files')  # for southlake alone
     parser.add_argument('--sram-replace', action='store_true', help='replace SRAM libraries')
     parser.add_argument('--mbist-scan-replace', action='store_true', help='replace mbist and scan controllers') # for southlake alone
+    parser.add_argument('--jobs', type=int, default=None, help='verilog loader processes (default: all cores, 1: serial)')
+    parser.add_argument('--verbose', action='store_true', help='print every submodule match while parsing')
+    parser.add_argument('--eager-bodies', action='store_true', help='keep all module bodies in memory instead of reading them back from the source files')
+    parser.add_argument('--cache-dir', type=str, help='parse cache directory (default: build/.parser_cache)')
+    parser.add_argument('--no-cache', action='store_true', help='parse all files without reading or updating the parse cache')
 
     args = parser.parse_args()
 
@@ -724,7 +1077,11 @@ if __name__ == "__main__":
     print(f"Top-level Module: {top_module} with prefix {module_prefix}")
     print(f"Config:           {config}")
     print(f"Ignored modules:  {ignore_modules}")
-    collection, out_dir = create_verilog(files, top_module, config, try_prefix=module_prefix, ignore_modules=ignore_modules)
+    VModule.verbose = args.verbose
+    cache_dir = None
+    if not args.no_cache:
+        cache_dir = args.cache_dir if args.cache_dir is not None else os.path.join(build_path, ".parser_cache")
+    collection, out_dir = create_verilog(files, top_module, config, try_prefix=module_prefix, ignore_modules=ignore_modules, jobs=args.jobs, lazy_bodies=not args.eager_bodies, cache_dir=cache_dir)
     assert(collection)
 
     rtl_dirs = [top_module]
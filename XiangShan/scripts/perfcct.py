@@ -1,13 +1,39 @@
 import sqlite3 as sql
 import argparse
+import os
+import sys
+import numpy as np
 
 
+# usage: python3 perfcct.py DB_FILE_PATH [-v] [--pc-min PC] [--pc-max PC] [--start-cycle C] [--end-cycle C] [--limit N] [-o FILE]
+#
+#  Rows are streamed from the LifeTimeCommitTrace table in batches of --batch rows
+#  and written in one buffered write per batch, so the whole trace is never held in memory.
+#  The PC range, the commit cycle window and the row limit are evaluated by SQLite.
+#
+# usage: python3 perfcct.py DB_FILE_PATH --stats [--top N] [--hist-max CYCLES] [filters as above]
+#
+#  Instead of the timelines, print where the cycles go: the latency distribution of every
+#  stage transition (fetch->decode->...->commit), how often each transition is the longest
+#  one of an instruction, a histogram of the gaps between consecutive commits, and the PCs
+#  with the most cycles from fetch to commit. Stages recorded as 0 take no cycles.
+
 
 parser = argparse.ArgumentParser()
 parser.add_argument('sqldb')
 parser.add_argument('-v', '--visual', action='store_true', default=False)
 parser.add_argument('-z', '--zoom', action='store', type=float, default=1)
 parser.add_argument('-p', '--period', action='store', default=333)
+parser.add_argument('--pc-min', action='store', type=lambda x: int(x, 0), default=None, help='lowest PC to dump')
+parser.add_argument('--pc-max', action='store', type=lambda x: int(x, 0), default=None, help='highest PC to dump')
+parser.add_argument('--start-cycle', action='store', type=int, default=None, help='first commit cycle to dump')
+parser.add_argument('--end-cycle', action='store', type=int, default=None, help='last commit cycle to dump')
+parser.add_argument('-n', '--limit', action='store', type=int, default=None, help='dump at most this many instructions')
+parser.add_argument('-o', '--output', action='store', default=None, help='write to this file instead of stdout')
+parser.add_argument('--batch', action='store', type=int, default=65536, help='rows fetched per batch')
+parser.add_argument('-s', '--stats', action='store_true', default=False, help='print stage latency statistics instead of timelines')
+parser.add_argument('--top', action='store', type=int, default=20, help='number of hot PCs in --stats')
+parser.add_argument('--hist-max', action='store', type=int, default=1024, help='latencies above this many cycles share the last histogram bin')
 
 args = parser.parse_args()
 
@@ -54,39 +80,212 @@ def dump_visual(pos, records):
     else:
         line += f'{stage(i)}' + non_stage() * (cycle_per_line - pos_next - 1) + ']'
     line += str(records)
-    print(line)
+    return line
 
 
 def dump_txt(pos, records):
-    for i in range(len(pos)):
-        print(f'{stage(i)}{pos[i]}', end=' ')
-    print(records)
+    return ''.join([f'{stages[i]}{p} ' for i, p in enumerate(pos)]) + str(records)
 
 
-dump = dump_txt
-if args.visual:
-    dump = dump_visual
+def signed_pc(pc):
+    # PCs are stored as signed 64-bit integers
+    return pc - (1 << 64) if pc >= 1 << 63 else pc
 
-with sql.connect(sqldb) as con:
+
+def build_filters(col_name):
+    # WHERE clause and parameters for the PC range and the commit cycle window
+    conds = []
+    params = []
+    pc_col = next((c for c in col_name if c.lower().startswith('pc')), None)
+    if (args.pc_min is not None or args.pc_max is not None) and pc_col is None:
+        print('LifeTimeCommitTrace has no PC column')
+        sys.exit(1)
+    pc_min = signed_pc(args.pc_min if args.pc_min is not None else 0)
+    pc_max = signed_pc(args.pc_max if args.pc_max is not None else (1 << 64) - 1)
+    if args.pc_min is not None or args.pc_max is not None:
+        if pc_min <= pc_max:
+            conds.append(f'{pc_col} BETWEEN ? AND ?')
+        else:
+            # the unsigned range crosses 1 << 63, where signed PCs wrap around
+            conds.append(f'({pc_col} >= ? OR {pc_col} <= ?)')
+        params += [pc_min, pc_max]
+    at_cols = [c for c in col_name if c.lower().startswith('at')]
+    commit_col = next((c for c in at_cols if c.lower() == 'atcommit'), at_cols[-1] if at_cols else None)
+    if args.start_cycle is not None:
+        conds.append(f'{commit_col} >= ?')
+        params.append(args.start_cycle * tick_per_cycle)
+    if args.end_cycle is not None:
+        conds.append(f'{commit_col} < ?')
+        params.append((args.end_cycle + 1) * tick_per_cycle)
+    where = ' WHERE ' + ' AND '.join(conds) if conds else ''
+    return where, params
+
+
+def query_trace(con, select):
+    # cursor over the filtered trace, columns is None for all of them
     cur = con.cursor()
-    cur.execute("SELECT * FROM LifeTimeCommitTrace")
+    cur.execute("SELECT * FROM LifeTimeCommitTrace LIMIT 0")
     col_name = [i[0] for i in cur.description]
-    col_name = col_name[1:]
-    col_name = [i.lower() for i in col_name]
-    rows = cur.fetchall()
-    for row in rows:
-        row = row[1:]
-        pos = []
-        records = []
-        i = 0
-        for val in row:
-            if col_name[i].startswith('at'):
-                pos.append(val//tick_per_cycle)
-            elif col_name[i].startswith('pc'):
-                if val < 0:
-                    val = val + 1 << 64
-                records.append(hex(val))
-            else:
-                records.append(val)
-            i += 1
-        dump(pos, records)
\ No newline at end of file
+    where, params = build_filters(col_name[1:])
+    query = f"SELECT {select(col_name[1:])} FROM LifeTimeCommitTrace" + where + " ORDER BY rowid"
+    if args.limit is not None:
+        query += " LIMIT ?"
+        params.append(args.limit)
+    cur.execute(query, params)
+    return cur, col_name
+
+
+def dump_trace(con, out):
+    cur, col_name = query_trace(con, lambda cols: '*')
+
+    col_name = [i.lower() for i in col_name[1:]]
+    at_idx = [i + 1 for i, c in enumerate(col_name) if c.startswith('at')]
+    pc_idx = set(i + 1 for i, c in enumerate(col_name) if c.startswith('pc'))
+    rec_idx = [i + 1 for i, c in enumerate(col_name) if not c.startswith('at')]
+    dump = dump_visual if args.visual else dump_txt
+
+    while True:
+        rows = cur.fetchmany(args.batch)
+        if not rows:
+            break
+        lines = []
+        for row in rows:
+            pos = [row[i] // tick_per_cycle for i in at_idx]
+            records = [hex(row[i] + (1 << 64) if row[i] < 0 else row[i]) if i in pc_idx else row[i] for i in rec_idx]
+            lines.append(dump(pos, records))
+        lines.append('')
+        out.write('\n'.join(lines))
+
+
+class StageStats:
+    # latency statistics accumulated chunk by chunk over column arrays
+
+    def __init__(self, at_cols):
+        self.names = [f'{stages[i]}->{stages[i + 1]} ({at_cols[i][2:]}->{at_cols[i + 1][2:]})' for i in range(len(at_cols) - 1)]
+        self.bins = args.hist_max + 1
+        self.hist = np.zeros((len(self.names), self.bins), dtype=np.int64)
+        self.total_hist = np.zeros(self.bins, dtype=np.int64)
+        self.gap_hist = np.zeros(self.bins, dtype=np.int64)
+        self.cycles = np.zeros(len(self.names), dtype=np.int64)
+        self.bottleneck = np.zeros(len(self.names), dtype=np.int64)
+        self.count = 0
+        self.last_commit = None
+        # per PC: number of instructions and cycles spent in every transition
+        self.pcs = np.zeros(0, dtype=np.int64)
+        self.pc_count = np.zeros(0, dtype=np.int64)
+        self.pc_cycles = np.zeros((0, len(self.names)), dtype=np.int64)
+
+    def add(self, at, pc):
+        cycles = at // tick_per_cycle
+        # leading stages recorded as 0 start at the first recorded stage, and any
+        # later stage recorded as 0 inherits the cycle of the stage before it
+        recorded = at != 0
+        first = cycles[np.arange(len(cycles)), np.argmax(recorded, axis=1)]
+        cycles = np.where(recorded, cycles, first[:, None])
+        cycles = np.maximum.accumulate(cycles, axis=1)
+        delta = np.diff(cycles, axis=1)
+        total = cycles[:, -1] - cycles[:, 0]
+        for i in range(delta.shape[1]):
+            self.hist[i] += np.bincount(np.minimum(delta[:, i], args.hist_max), minlength=self.bins)
+        self.total_hist += np.bincount(np.minimum(total, args.hist_max), minlength=self.bins)
+        self.cycles += delta.sum(axis=0)
+        self.bottleneck += np.bincount(np.argmax(delta, axis=1), minlength=delta.shape[1])
+        commits = cycles[:, -1]
+        if self.last_commit is not None:
+            commits = np.concatenate(([self.last_commit], commits))
+        gaps = np.abs(np.diff(commits))
+        self.gap_hist += np.bincount(np.minimum(gaps, args.hist_max), minlength=self.bins)
+        self.last_commit = cycles[-1, -1]
+        self.count += len(at)
+        if pc is not None:
+            self.add_pcs(pc, delta)
+
+    def add_pcs(self, pc, delta):
+        # merge the chunk into the per-PC table, both sides reduced by np.unique
+        pcs = np.concatenate((self.pcs, pc))
+        pcs, inverse = np.unique(pcs, return_inverse=True)
+        count = np.zeros(len(pcs), dtype=np.int64)
+        cycles = np.zeros((len(pcs), delta.shape[1]), dtype=np.int64)
+        old, new = inverse[:len(self.pcs)], inverse[len(self.pcs):]
+        count[old] += self.pc_count
+        cycles[old] += self.pc_cycles
+        count += np.bincount(new, minlength=len(pcs))
+        np.add.at(cycles, new, delta)
+        self.pcs, self.pc_count, self.pc_cycles = pcs, count, cycles
+
+    def percentile(self, hist, q):
+        index = int(np.searchsorted(np.cumsum(hist), q * hist.sum()))
+        return f'>{args.hist_max - 1}' if index >= args.hist_max else str(index)
+
+    def report(self, out):
+        if self.count == 0:
+            out.write('no instruction matches the filters\n')
+            return
+        total_cycles = self.cycles.sum()
+        out.write(f'{self.count} instructions, {total_cycles} cycles from fetch to commit, '
+                  f'mean {total_cycles / self.count:.2f}\n\n')
+        out.write(f'{"transition":<36} {"mean":>8} {"p50":>6} {"p90":>6} {"p99":>6} {"max":>6} {"cycles %":>9} {"longest %":>10}\n')
+        rows = [(name, self.hist[i], self.cycles[i], self.bottleneck[i]) for i, name in enumerate(self.names)]
+        rows.append(('total (fetch->commit)', self.total_hist, total_cycles, None))
+        for name, hist, cycles, longest in rows:
+            max_bin = int(np.nonzero(hist)[0][-1])
+            max_cycles = f'>{args.hist_max - 1}' if max_bin >= args.hist_max else str(max_bin)
+            longest = '' if longest is None else f'{100 * longest / self.count:.2f}'
+            out.write(f'{name:<36} {cycles / self.count:>8.2f} {self.percentile(hist, 0.5):>6} {self.percentile(hist, 0.9):>6} '
+                      f'{self.percentile(hist, 0.99):>6} {max_cycles:>6} {100 * cycles / max(total_cycles, 1):>9.2f} '
+                      f'{longest:>10}\n')
+
+        out.write('\ncycles between consecutive commits\n')
+        gaps = self.gap_hist
+        width = 50 / max(gaps.max(), 1)
+        for gap in np.nonzero(gaps)[0]:
+            label = f'>{args.hist_max - 1}' if gap >= args.hist_max else str(gap)
+            out.write(f'{label:>6} {gaps[gap]:>12} {100 * gaps[gap] / gaps.sum():>7.2f}% {"#" * int(gaps[gap] * width)}\n')
+
+        if len(self.pcs) == 0:
+            return
+        out.write(f'\ntop {args.top} PCs by cycles from fetch to commit\n')
+        out.write(f'{"pc":>18} {"count":>10} {"cycles":>12} {"cycles %":>9} {"mean":>8}  longest transition\n')
+        pc_total = self.pc_cycles.sum(axis=1)
+        for i in np.argsort(-pc_total, kind='stable')[:args.top]:
+            pc = int(self.pcs[i])
+            stage_index = int(np.argmax(self.pc_cycles[i]))
+            out.write(f'{hex(pc + (1 << 64) if pc < 0 else pc):>18} {self.pc_count[i]:>10} {pc_total[i]:>12} '
+                      f'{100 * pc_total[i] / max(total_cycles, 1):>9.2f} {pc_total[i] / self.pc_count[i]:>8.2f}  '
+                      f'{self.names[stage_index]} {100 * self.pc_cycles[i, stage_index] / max(pc_total[i], 1):.1f}%\n')
+
+
+def stats_trace(con, out):
+    cur, col_name = query_trace(con, lambda cols: ', '.join(
+        [c for c in cols if c.lower().startswith('at')] + [c for c in cols if c.lower().startswith('pc')][:1]))
+    at_cols = [c for c in col_name[1:] if c.lower().startswith('at')]
+    has_pc = any(c.lower().startswith('pc') for c in col_name[1:])
+    if len(at_cols) < 2:
+        print('LifeTimeCommitTrace needs at least two stage columns')
+        sys.exit(1)
+    stats = StageStats(at_cols)
+    while True:
+        rows = cur.fetchmany(args.batch)
+        if not rows:
+            break
+        chunk = np.array(rows, dtype=np.int64)
+        stats.add(chunk[:, :len(at_cols)], chunk[:, len(at_cols)] if has_pc else None)
+    stats.report(out)
+
+
+with sql.connect(sqldb) as con:
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        if args.stats:
+            stats_trace(con, out)
+        else:
+            dump_trace(con, out)
+        out.flush()
+    except BrokenPipeError:
+        # the reader (e.g. head) went away, stop quietly
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        sys.exit(1)
+    finally:
+        if out is not sys.stdout:
+            out.close()
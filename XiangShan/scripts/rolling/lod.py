@@ -0,0 +1,204 @@
+import os
+import sys
+import argparse
+import sqlite3
+import numpy as np
+from rolling import fetch_rolling
+
+
+# Level-of-detail pyramids for rolling counters.
+#
+# Level 0 is the derived series itself, every further level merges `factor`
+# consecutive points of the level below into one (x of the last point, min,
+# max and mean of y). Pyramids are kept in a sidecar file next to the chiseldb
+# (DB_PATH.lod.npz) and rebuilt when the db changes, so only the first plot of
+# a huge trace pays for the full table scan. Plotting picks, for the visible
+# x range, the finest level that fits in max_points and draws its mean with
+# the min/max envelope, and redraws whenever the view is zoomed or panned.
+#
+# usage:
+#   python3 lod.py DB_FILE_PATH --perf-name IPC --export lod-ipc [--format csv|npy] [--level LEVEL]
+#   python3 rolling.py plot DB_FILE_PATH --perf-name IPC --lod
+#
+#  the export writes one file per zoom level: level-N.csv (x,min,max,mean) or
+#  level-N.npy (a structured array with the same fields).
+
+
+LOD_VERSION = 1
+LOD_FACTOR = 4
+LOD_MIN_POINTS = 256
+LOD_DTYPE = np.dtype([('x', np.float64), ('min', np.float64), ('max', np.float64), ('mean', np.float64)])
+
+
+class Pyramid:
+
+    def __init__(self, levels):
+        # levels[0] is the finest, each level is a LOD_DTYPE array
+        self.levels = levels
+
+    @staticmethod
+    def build(xdata, ydata, factor=LOD_FACTOR, min_points=LOD_MIN_POINTS):
+        base = np.empty(len(xdata), dtype=LOD_DTYPE)
+        base['x'] = xdata
+        base['min'] = ydata
+        base['max'] = ydata
+        base['mean'] = ydata
+        levels = [base]
+        counts = np.ones(len(xdata))
+        while len(levels[-1]) > min_points:
+            below = levels[-1]
+            # the trailing partial group keeps the last x of the series
+            starts = np.arange(0, len(below), factor)
+            ends = np.minimum(starts + factor, len(below)) - 1
+            level = np.empty(len(starts), dtype=LOD_DTYPE)
+            level['x'] = below['x'][ends]
+            level['min'] = np.fmin.reduceat(below['min'], starts)
+            level['max'] = np.fmax.reduceat(below['max'], starts)
+            # mean of the underlying points, not of the means
+            weight = np.add.reduceat(counts, starts)
+            level['mean'] = np.add.reduceat(below['mean'] * counts, starts) / weight
+            counts = weight
+            levels.append(level)
+        return Pyramid(levels)
+
+    def select(self, xmin=None, xmax=None, max_points=4000):
+        # finest level with at most max_points inside [xmin, xmax]
+        for level in self.levels:
+            lo = 0 if xmin is None else np.searchsorted(level['x'], xmin, side='left')
+            hi = len(level) if xmax is None else np.searchsorted(level['x'], xmax, side='right')
+            if hi - lo <= max_points or level is self.levels[-1]:
+                # one point beyond each edge so the line reaches the border
+                return level[max(lo - 1, 0):hi + 1]
+
+
+def sidecar_path(db_path):
+    return db_path + '.lod.npz'
+
+def series_key(perf_name, hart, aggregate, clk_itval):
+    return '{}_{}_{}_{}'.format(perf_name, hart, aggregate, clk_itval)
+
+def db_stamp(db_path):
+    st = os.stat(db_path)
+    return np.array([LOD_VERSION, st.st_size, st.st_mtime_ns], dtype=np.int64)
+
+def load_sidecar(db_path):
+    # {key: Pyramid} of a sidecar still matching the db, else empty
+    path = sidecar_path(db_path)
+    try:
+        with np.load(path) as npz:
+            if not np.array_equal(npz['stamp'], db_stamp(db_path)):
+                return {}
+            arrays = {}
+            for name in npz.files:
+                if name != 'stamp':
+                    key, level = name.rsplit('_L', 1)
+                    arrays.setdefault(key, {})[int(level)] = npz[name]
+    except (OSError, ValueError, KeyError):
+        return {}
+    pyramids = {}
+    for key, levels in arrays.items():
+        xdata, ydata = levels[0]
+        base = np.empty(len(xdata), dtype=LOD_DTYPE)
+        base['x'] = xdata
+        for field in ('min', 'max', 'mean'):
+            base[field] = ydata
+        pyramids[key] = Pyramid([base] + [levels[i] for i in range(1, len(levels))])
+    return pyramids
+
+def store_sidecar(db_path, pyramids):
+    path = sidecar_path(db_path)
+    arrays = {'stamp': db_stamp(db_path)}
+    for key, pyramid in pyramids.items():
+        # min, max and mean are the same on level 0, only keep (x, y)
+        base = pyramid.levels[0]
+        arrays['{}_L0'.format(key)] = np.vstack([base['x'], base['mean']])
+        for level, data in enumerate(pyramid.levels[1:], 1):
+            arrays['{}_L{}'.format(key, level)] = data
+    tmp = path + '.tmp.npz'
+    try:
+        np.savez(tmp, **arrays)
+        os.replace(tmp, path)
+    except OSError as e:
+        # a read-only db directory only costs the rebuild next time
+        print("cannot write LOD sidecar {}: {}".format(path, e))
+
+def load_pyramids(db_path, cursor, counters, aggregate, clk_itval):
+    # {(perf_name, hart): Pyramid}, building and storing the missing ones
+    keys = {counter: series_key(counter[0], counter[1], aggregate, clk_itval) for counter in counters}
+    pyramids = load_sidecar(db_path)
+    missing = [counter for counter in counters if keys[counter] not in pyramids]
+    if missing:
+        for counter, (xdata, ydata) in fetch_rolling(cursor, missing, aggregate, clk_itval).items():
+            pyramids[keys[counter]] = Pyramid.build(xdata, ydata)
+        store_sidecar(db_path, pyramids)
+    return {counter: pyramids[keys[counter]] for counter in counters}
+
+def export_pyramid(pyramid, out_dir, fmt='csv', level=None):
+    os.makedirs(out_dir, exist_ok=True)
+    levels = range(len(pyramid.levels)) if level is None else [level]
+    for idx in levels:
+        data = pyramid.levels[idx]
+        path = os.path.join(out_dir, 'level-{}.{}'.format(idx, fmt))
+        if fmt == 'npy':
+            np.save(path, data)
+        else:
+            np.savetxt(path, np.column_stack([data[field] for field in LOD_DTYPE.names]),
+                       delimiter=',', header=','.join(LOD_DTYPE.names), comments='', fmt='%.17g')
+        print("level {}: {} points -> {}".format(idx, len(data), path))
+
+
+class LodPlot:
+
+    def __init__(self, ax, max_points=4000):
+        self.ax = ax
+        self.max_points = max_points
+        self.series = []
+        self.redrawing = False
+        ax.callbacks.connect('xlim_changed', self.redraw)
+
+    def add(self, pyramid, **kwargs):
+        data = pyramid.select(max_points=self.max_points)
+        line, = self.ax.plot(data['x'], data['mean'], lw=1, ls='-', **kwargs)
+        band = self.ax.fill_between(data['x'], data['min'], data['max'], color=line.get_color(), alpha=0.25, lw=0)
+        self.series.append([pyramid, line, band])
+
+    def redraw(self, ax):
+        # adding the new envelopes may autoscale and change xlim again
+        if self.redrawing:
+            return
+        self.redrawing = True
+        try:
+            xmin, xmax = ax.get_xlim()
+            for series in self.series:
+                pyramid, line, band = series
+                data = pyramid.select(xmin, xmax, self.max_points)
+                line.set_data(data['x'], data['mean'])
+                band.remove()
+                series[2] = ax.fill_between(data['x'], data['min'], data['max'], color=line.get_color(), alpha=0.25, lw=0)
+            ax.figure.canvas.draw_idle()
+        finally:
+            self.redrawing = False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="build and export level-of-detail pyramids of xs rolling counters")
+    parser.add_argument('db_path', metavar='db_path', type=str, help='path to chiseldb file')
+    parser.add_argument('--perf-name', required=True, type=str, help="name of the performance counter")
+    parser.add_argument('--aggregate', '-A', default=1, type=int, help="aggregation ratio")
+    parser.add_argument('--interval', '-I', default=-1, type=int, help="interval value in the interval based mode")
+    parser.add_argument('--hart', default=0, type=int, help="hart of the counter")
+    parser.add_argument('--export', default=None, type=str, help="directory to write one file per zoom level")
+    parser.add_argument('--format', default='csv', choices=['csv', 'npy'], help="export format")
+    parser.add_argument('--level', default=None, type=int, help="only export this level")
+    args = parser.parse_args()
+
+    cursor = sqlite3.connect(args.db_path).cursor()
+    counter = (args.perf_name, args.hart)
+    pyramid = load_pyramids(args.db_path, cursor, [counter], args.aggregate, args.interval)[counter]
+    for idx, level in enumerate(pyramid.levels):
+        print("level {}: {} points".format(idx, len(level)))
+    if args.level is not None and not 0 <= args.level < len(pyramid.levels):
+        print("level should be in [0, {})".format(len(pyramid.levels)))
+        sys.exit(1)
+    if args.export:
+        export_pyramid(pyramid, args.export, args.format, args.level)
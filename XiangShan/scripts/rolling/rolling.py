@@ -1,15 +1,17 @@
 import sys
+import os
 import argparse
 import sqlite3
+from multiprocessing import Pool
 import matplotlib.pyplot as plt
 import numpy as np
 
 
 # usage: single db file
-#   python3 rolling.py plot DB_FILE_PATH [--perf-name PERF_NAME] [--aggregate AGGREGATE] [--interval INTERVAL] [--perf-file PERF_FILE]
+#   python3 rolling.py plot DB_FILE_PATH [--perf-name PERF_NAME] [--aggregate AGGREGATE] [--interval INTERVAL] [--perf-file PERF_FILE] [--hart HARTS]
 #
 # usage: diff mutiple db files
-#   python3 rolling.py diff MUTI_DB_FILE_PATH [--perf-name PERF_NAME] [--aggregate AGGREGATE] [--interval INTERVAL] [--perf-file PERF_FILE]
+#   python3 rolling.py diff MUTI_DB_FILE_PATH [--perf-name PERF_NAME] [--aggregate AGGREGATE] [--interval INTERVAL] [--perf-file PERF_FILE] [--hart HARTS]
 #
 #  If you only observe one rolling counter, indicate the --perf-name parameter.
 #  If you want to observe multiple at the same time, you can indicate the --perf-file parameter,
@@ -32,12 +34,74 @@ import numpy as np
 #                            IPC
 #                            L1PrefetchAccuracy
 #    run `python3 rolling.py diff db.txt --perf-file perf.txt -I (interval in RTL)`
+#    besides plotting, diff aligns every db on the x-axis of the first one (the baseline)
+#    and prints the mean/max delta of each counter and where the largest change happens.
+#    add `--windows N --report diff.csv` to also dump the mean delta of N equal windows,
+#    and `--no-plot` to only print the summary.
 #  eg.
 #    want to observe the IPC rolling in single db (db0).
 #    run `python3 rolling.py plot path-to-db0 --perf-name IPC`
+#  eg.
+#    the IPC rolling of a whole benchmark has too many points to plot.
+#    run `python3 rolling.py plot path-to-db0 --perf-name IPC --lod`
+#    it draws a min/max/mean summary that is refined as you zoom in (see lod.py)
 #
 
 
+# Rows joined per group_concat: keeps each text value far below SQLite's
+# default 1e9-byte SQLITE_LIMIT_LENGTH even for 20-digit values.
+ROWID_PAGE = 1 << 22
+
+
+def read_columns(cursor, counters):
+    # Raw (xAxisPt, yAxisPt) columns of every (perf_name, hart) in counters.
+    # SQLite joins each column into one text value that numpy parses in C,
+    # which is much cheaper than building a Python tuple per record.
+    # Tables are read in rowid pages so that no joined value grows too big.
+    tables = ["{}_rolling_{}".format(perf_name, hart) for perf_name, hart in counters]
+    cursor.execute(" UNION ALL ".join(
+        "SELECT min(rowid), max(rowid) FROM {}".format(table) for table in tables))
+    columns = []
+    for table, (first, last) in zip(tables, cursor.fetchall()):
+        xparts, yparts = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        if first is not None:
+            sql = "SELECT group_concat(xAxisPt), group_concat(yAxisPt) FROM {} WHERE rowid BETWEEN ? AND ?".format(table)
+            for start in range(first, last + 1, ROWID_PAGE):
+                xcol, ycol = cursor.execute(sql, (start, start + ROWID_PAGE - 1)).fetchone()
+                if xcol is not None:
+                    xparts.append(np.fromstring(xcol, dtype=np.int64, sep=','))
+                    yparts.append(np.fromstring(ycol, dtype=np.int64, sep=','))
+        columns.append((np.concatenate(xparts), np.concatenate(yparts)))
+    return columns
+
+
+def fetch_rolling(cursor, counters, aggregate, clk_itval):
+    # Aggregate every (perf_name, hart) in counters with a single query and
+    # return {(perf_name, hart): (xdata, ydata)} as numpy arrays.
+    # A trailing group with less than `aggregate` records is dropped.
+    series_data = {}
+    for counter, (xcol, ycol) in zip(counters, read_columns(cursor, counters)):
+        groups = len(xcol) // aggregate
+        xcol = xcol[:groups * aggregate].reshape(groups, aggregate)
+        sumy = ycol[:groups * aggregate].reshape(groups, aggregate).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if clk_itval == -1:
+                # normal mode
+                # db log in normal mode: (xAxis, ydata)
+                # xAxis is current position in X Axis, ydata is the Increment value between this point and last point
+                xdata = xcol[:, -1]
+                ydata = sumy / np.diff(xdata, prepend=0)
+            else:
+                # intervalBased mode, -I interval should be specified
+                # db log in intervalBased mode: (xdata, ydata)
+                # xdata, ydata in the Increment value in a certain interval
+                sumx = xcol.sum(axis=1)
+                xdata = (clk_itval * aggregate) * np.arange(1, groups + 1)
+                ydata = np.where(sumy == 0, 0, sumx / sumy)
+        series_data[counter] = (xdata, ydata)
+    return series_data
+
+
 class DataSet:
     
     def __init__(self, db_path):
@@ -47,43 +111,12 @@ class DataSet:
         self.ydata = []
     
     def derive(self, perf_name, aggregate, clk_itval, hart):
-        sql = "SELECT xAxisPt, yAxisPt FROM {}_rolling_{}".format(perf_name, hart)
-        self.cursor.execute(sql)
-        result = self.cursor.fetchall()
-        aggcnt = 0
-        recordcnt = 0
-        aggydata = 0
-        aggxdata = 0
-        self.xdata = []
-        self.ydata = []
-        if clk_itval == -1:
-            # normal mode
-            # db log in normal mode: (xAxis, ydata)
-            # xAxis is current position in X Axis, ydata is the Increment value between this point and last point
-            for row in result:
-                aggcnt += 1
-                aggydata += row[1]
-                if aggcnt == aggregate:
-                    self.xdata.append(row[0])
-                    self.ydata.append(aggydata/(row[0]-aggxdata))
-                    aggcnt = 0
-                    aggydata = 0
-                    aggxdata = row[0]
-        else:
-            # intervalBased mode, -I interval should be specified
-            # db log in intervalBased mode: (xdata, ydata)
-            # xdata, ydata in the Increment value in a certain interval
-            for row in result:
-                aggcnt += 1
-                aggxdata += row[0]
-                aggydata += row[1]
-                if aggcnt == aggregate:
-                    self.xdata.append((clk_itval * aggregate) * (recordcnt + 1))
-                    self.ydata.append(0 if aggydata == 0 else aggxdata/aggydata)
-                    aggcnt = 0
-                    aggxdata = 0
-                    aggydata = 0
-                    recordcnt += 1
+        self.xdata, self.ydata = fetch_rolling(self.cursor, [(perf_name, hart)], aggregate, clk_itval)[(perf_name, hart)]
+
+    def derive_all(self, perf_names, aggregate, clk_itval, harts):
+        # all counters of all harts in one query
+        counters = [(perf_name, hart) for perf_name in perf_names for hart in harts]
+        return fetch_rolling(self.cursor, counters, aggregate, clk_itval)
     
     def plot(self, lb='PERF'):
         plt.plot(self.xdata, self.ydata, lw=1, ls='-', label=lb)
@@ -104,39 +137,151 @@ def check_args(args):
     if not args.perf_name and not args.perf_file:
         err_exit("should either specify perf-name or perf-file")
 
-def plot_dataset(path, perf_name, aggregate, clk_itval, perf_file, db_id=-1):
+def read_perf_names(perf_name, perf_file):
+    if not perf_file:
+        return [perf_name]
+    with open(perf_file) as fp:
+        perfs = fp.readlines()
+        perfs = [perf.strip() for perf in perfs]
+        return list(filter(lambda x: not x.startswith('//'), perfs))
+
+def parse_harts(harts):
+    return [int(hart) for hart in harts.split(',')]
+
+def plot_dataset(path, perf_name, aggregate, clk_itval, perf_file, db_id=-1, harts=[0]):
     dataset = DataSet(path)
     label = '_' + str(db_id) if db_id != -1 else ''
     
-    if perf_file:
-        with open(perf_file) as fp:
-            perfs = fp.readlines()
-            perfs = [perf.strip() for perf in perfs]
-            perfs = list(filter(lambda x: not x.startswith('//'), perfs))
-            for perf in perfs:
-                dataset.derive(perf, aggregate, clk_itval, 0)
-                dataset.plot(perf + label)
-    else:
-        dataset.derive(perf_name, aggregate, clk_itval, 0)
-        dataset.plot(perf_name + label)
+    perfs = read_perf_names(perf_name, perf_file)
+    series = dataset.derive_all(perfs, aggregate, clk_itval, harts)
+    for (perf, hart), (dataset.xdata, dataset.ydata) in series.items():
+        hart_label = '_hart' + str(hart) if len(harts) > 1 else ''
+        dataset.plot(perf + hart_label + label)
+
+def plot_lod(path, perf_name, aggregate, clk_itval, perf_file, harts, max_points):
+    from lod import LodPlot, load_pyramids
+    dataset = DataSet(path)
+    counters = [(perf, hart) for perf in read_perf_names(perf_name, perf_file) for hart in harts]
+    lod_plot = LodPlot(plt.gca(), max_points)
+    for (perf, hart), pyramid in load_pyramids(path, dataset.cursor, counters, aggregate, clk_itval).items():
+        hart_label = '_hart' + str(hart) if len(harts) > 1 else ''
+        lod_plot.add(pyramid, label=perf + hart_label)
 
 def handle_plot(args):
     check_args(args)
     
-    plot_dataset(args.db_path, args.perf_name, args.aggregate, args.interval, args.perf_file)
+    if args.lod:
+        plot_lod(args.db_path, args.perf_name, args.aggregate, args.interval, args.perf_file, parse_harts(args.hart), args.max_points)
+    else:
+        plot_dataset(args.db_path, args.perf_name, args.aggregate, args.interval, args.perf_file, harts=parse_harts(args.hart))
         
     DataSet.legend()
     DataSet.show()
 
+def load_series(task):
+    # one (db, counter) pair, run in a worker process
+    idx, path, perf, aggregate, clk_itval, harts = task
+    return idx, DataSet(path).derive_all([perf], aggregate, clk_itval, harts)
+
+def load_runs(paths, perfs, aggregate, clk_itval, harts, jobs):
+    # [{(perf, hart): (xdata, ydata)}] in the order of paths
+    runs = [dict() for _ in paths]
+    tasks = [(idx, path, perf, aggregate, clk_itval, harts) for idx, path in enumerate(paths) for perf in perfs]
+    with Pool(min(jobs, len(tasks))) as pool:
+        for idx, series in pool.imap_unordered(load_series, tasks):
+            runs[idx].update(series)
+    for run in runs:
+        # keep the counter order of the perf file for plotting
+        ordered = {(perf, hart): run[(perf, hart)] for perf in perfs for hart in harts}
+        run.clear()
+        run.update(ordered)
+    return runs
+
+def align(base, other):
+    # interpolate other onto the x-axis of base over the range both runs cover
+    bx, by = base
+    ox, oy = other
+    if len(bx) == 0 or len(ox) == 0:
+        return bx[:0], by[:0], oy[:0]
+    keep = (bx >= max(bx[0], ox[0])) & (bx <= min(bx[-1], ox[-1]))
+    x = bx[keep]
+    return x, by[keep], np.interp(x, ox, oy)
+
+def window_deltas(x, delta, windows):
+    # mean delta of `windows` equal slices of the common x-axis
+    if len(x) == 0:
+        return []
+    edges = np.linspace(x[0], x[-1], windows + 1)
+    index = np.clip(np.searchsorted(edges, x, side='right') - 1, 0, windows - 1)
+    counts = np.bincount(index, minlength=windows)
+    sums = np.bincount(index, weights=delta, minlength=windows)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = sums / counts
+    return [(edges[w], edges[w + 1], means[w]) for w in range(windows) if counts[w]]
+
+def diff_runs(runs, windows):
+    # compare every run with runs[0], returns (summaries, window rows)
+    summaries = []
+    rows = []
+    for idx, run in enumerate(runs[1:], 1):
+        for (perf, hart), series in run.items():
+            x, base_y, y = align(runs[0][(perf, hart)], series)
+            if len(x) == 0:
+                summaries.append((idx, perf, hart, 0))
+                continue
+            delta = y - base_y
+            with np.errstate(divide='ignore', invalid='ignore'):
+                rel = np.nanmean(np.where(base_y == 0, np.nan, delta / base_y)) * 100
+            drop = np.argmin(delta)
+            rise = np.argmax(delta)
+            summaries.append((idx, perf, hart, len(x), delta.mean(), rel, delta[drop], x[drop], delta[rise], x[rise]))
+            for start, end, mean in window_deltas(x, delta, windows):
+                rows.append((idx, perf, hart, start, end, mean))
+    return summaries, rows
+
+def print_summary(paths, summaries):
+    print("baseline: {}".format(paths[0]))
+    print("{:>3} {:<32} {:>4} {:>8} {:>12} {:>9} {:>12} {:>14} {:>12} {:>14}".format(
+        "db", "counter", "hart", "points", "mean delta", "mean %", "max drop", "at x", "max rise", "at x"))
+    for summary in summaries:
+        idx, perf, hart, points = summary[:4]
+        if points == 0:
+            print("{:>3} {:<32} {:>4} {:>8} no overlap with the baseline".format(idx, perf, hart, points))
+            continue
+        print("{:>3} {:<32} {:>4} {:>8} {:>12.6g} {:>9.3f} {:>12.6g} {:>14.0f} {:>12.6g} {:>14.0f}".format(*summary))
+
+def write_report(report, paths, rows):
+    with open(report, 'w') as fp:
+        fp.write("db,db_path,counter,hart,x_start,x_end,mean_delta\n")
+        for idx, perf, hart, start, end, mean in rows:
+            fp.write("{},{},{},{},{:.0f},{:.0f},{:.9g}\n".format(idx, paths[idx], perf, hart, start, end, mean))
+
 def handle_diff(args):
     check_args(args)
     
-    db_path = args.db_path
+    with open(args.db_path) as fp:
+        paths = [db.strip() for db in fp if db.strip()]
+    if not paths:
+        err_exit("no db file in {}".format(args.db_path))
+    if args.windows <= 0:
+        err_exit("number of windows must be no less than 1")
+    
+    perfs = read_perf_names(args.perf_name, args.perf_file)
+    harts = parse_harts(args.hart)
+    runs = load_runs(paths, perfs, args.aggregate, args.interval, harts, args.jobs)
     
-    with open(db_path) as fp:
-        for (idx, db) in enumerate(fp):
-            plot_dataset(db.strip(), args.perf_name, args.aggregate, args.interval, args.perf_file, idx)
+    if len(runs) > 1:
+        summaries, rows = diff_runs(runs, args.windows)
+        print_summary(paths, summaries)
+        if args.report:
+            write_report(args.report, paths, rows)
     
+    if args.no_plot:
+        return
+    for idx, run in enumerate(runs):
+        for (perf, hart), (xdata, ydata) in run.items():
+            hart_label = '_hart' + str(hart) if len(harts) > 1 else ''
+            plt.plot(xdata, ydata, lw=1, ls='-', label=perf + hart_label + '_' + str(idx))
     DataSet.legend()
     DataSet.show()
 
@@ -151,6 +296,9 @@ if __name__ == "__main__":
     cmd1_parser.add_argument('--aggregate', '-A', default=1, type=int, help="aggregation ratio")
     cmd1_parser.add_argument('--interval', '-I', default=-1, type=int, help="interval value in the interval based mode")
     cmd1_parser.add_argument('--perf-file', '-F', default=None, type=str, help="path to a file including all interested performance counters")
+    cmd1_parser.add_argument('--hart', default='0', type=str, help="comma-separated harts to plot")
+    cmd1_parser.add_argument('--lod', action='store_true', help="plot level-of-detail summaries cached in DB_PATH.lod.npz")
+    cmd1_parser.add_argument('--max-points', default=4000, type=int, help="points per counter drawn in --lod mode")
     
     # sub function for diff multiple db files
     cmd2_parser = subparsers.add_parser('diff', help='for diff multiple db files')
@@ -159,6 +307,11 @@ if __name__ == "__main__":
     cmd2_parser.add_argument('--aggregate', '-A', default=1, type=int, help="aggregation ratio")
     cmd2_parser.add_argument('--interval', '-I', default=-1, type=int, help="interval value in the interval based mode")
     cmd2_parser.add_argument('--perf-file', '-F', default=None, type=str, help="path to a file including all interested performance counters")
+    cmd2_parser.add_argument('--hart', default='0', type=str, help="comma-separated harts to plot")
+    cmd2_parser.add_argument('--jobs', '-j', default=os.cpu_count(), type=int, help="number of processes loading db files")
+    cmd2_parser.add_argument('--windows', default=10, type=int, help="number of windows in the per-window delta report")
+    cmd2_parser.add_argument('--report', default=None, type=str, help="write per-window deltas against the first db to this csv file")
+    cmd2_parser.add_argument('--no-plot', action='store_true', help="only print the diff summary")
 
     args = parser.parse_args()
     
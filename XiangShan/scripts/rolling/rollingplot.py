@@ -4,9 +4,12 @@ import sqlite3
 import matplotlib.pyplot as plt
 import numpy as np
 import os
+from rolling import fetch_rolling
+from lod import Pyramid
 
 
-# usage: python3 rollingplot.py DB_FILE_PATH PERF_NAME [--aggregate AGGREGATE_RATIO]
+# usage: python3 rollingplot.py DB_FILE_PATH PERF_NAME [--aggregate AGGREGATE_RATIO] [--max-points MAX_POINTS]
+#  traces longer than MAX_POINTS are drawn from the level-of-detail pyramid (see lod.py)
 
 
 class DataSet:
@@ -18,24 +21,15 @@ class DataSet:
         self.ydata = []
     
     def derive(self, perf_name, aggregate, hart):
-        sql = "SELECT xAxisPt, yAxisPt FROM {}_rolling_{}".format(perf_name, hart)
-        self.cursor.execute(sql)
-        result = self.cursor.fetchall()
-        aggcnt = 0
-        aggydata = 0
-        aggxdata = 0
-        for row in result:
-            aggcnt += 1
-            aggydata += row[1]
-            if aggcnt == aggregate:
-                self.xdata.append(row[0])
-                self.ydata.append(aggydata/(row[0]-aggxdata))
-                aggcnt = 0
-                aggydata = 0
-                aggxdata = row[0]
+        self.xdata, self.ydata = fetch_rolling(self.cursor, [(perf_name, hart)], aggregate, -1)[(perf_name, hart)]
     
-    def plot(self):
-        plt.plot(self.xdata, self.ydata, lw=1, ls='-', c='black')
+    def plot(self, pyramid=None, max_points=4000):
+        if pyramid is None:
+            plt.plot(self.xdata, self.ydata, lw=1, ls='-', c='black')
+        else:
+            data = pyramid.select(max_points=max_points)
+            plt.fill_between(data['x'], data['min'], data['max'], color='black', alpha=0.25, lw=0)
+            plt.plot(data['x'], data['mean'], lw=1, ls='-', c='black')
         dirName = "results"
         if not os.path.exists(dirName):
             os.mkdir(dirName)
@@ -50,6 +44,7 @@ if __name__ == "__main__":
     parser.add_argument('db_path', metavar='db_path', type=str, help='path to chiseldb file')
     parser.add_argument('perf_name', metavar='perf_name', type=str, help="name of the performance counter")
     parser.add_argument('--aggregate', '-A', default=1, type=int, help="aggregation ratio")
+    parser.add_argument('--max-points', default=4000, type=int, help="longer traces are drawn as a min/max/mean summary")
     args = parser.parse_args()
 
     if args.aggregate <= 0:
@@ -62,4 +57,7 @@ if __name__ == "__main__":
 
     dataset = DataSet(db_path)
     dataset.derive(perf_name, aggregate, 0)
-    dataset.plot()
\ No newline at end of file
+    pyramid = None
+    if len(dataset.xdata) > args.max_points:
+        pyramid = Pyramid.build(dataset.xdata, dataset.ydata)
+    dataset.plot(pyramid, args.max_points)
\ No newline at end of file
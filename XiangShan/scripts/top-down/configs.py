@@ -3,6 +3,7 @@ stats_dir = ''
 CSV_PATH = 'results/results.csv'
 JSON_FILE = 'resources/spec06_rv64gcb_o2_20m.json'
 OUT_CSV = 'results/results-weighted.csv'
+STORE_PATH = 'results/stats-store.pkl'
 INT_ONLY = False
 FP_ONLY = False
 
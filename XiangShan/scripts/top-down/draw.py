@@ -138,3 +138,4 @@ def draw():
 
     fig.savefig(osp.join('results', 'result.png'),
                 bbox_inches='tight', pad_inches=0.05, dpi=200)
+    plt.close(fig)
@@ -1,11 +1,12 @@
-from multiprocessing import Process, Manager
-import threading
+from multiprocessing import Pool
 import os.path as osp
 import os
+import pickle
 import resource
 import json
 import argparse
-import psutil
+import time
+import traceback
 import numpy as np
 import pandas as pd
 import utils as u
@@ -13,44 +14,102 @@ import configs as cf
 from draw import draw
 
 
-def batch():
+def extract_and_post_process(task):
+    # a checkpoint that cannot be processed is reported and left out, like a
+    # crashed worker process, instead of aborting the whole batch
+    workload = task[0]
+    try:
+        return process_checkpoint(task)
+    except Exception:
+        print('Failed to process job:', workload)
+        traceback.print_exc()
+        return workload, None, task[4]
+
+
+def process_checkpoint(task):
+    workload, path, targets, cache_dir, key = task
+    flag_file = osp.join(osp.dirname(path), 'simulator_out.txt')
+    with open(flag_file, encoding='utf-8') as f:
+        contents = f.read()
+        if 'EXCEEDING CYCLE/INSTR LIMIT' not in contents and 'HIT GOOD TRAP' not in contents:
+            print('Skip unfinished job:', workload)
+            return workload, None, key
+
+    print('Process finished job:', workload)
+
+    d = u.xs_get_stats(path, targets, cache_dir)
+    if len(d):
+
+        # add bmk and point after topdown processing
+        segments = workload.split('_')
+        if len(segments):
+            d['point'] = segments[-1]
+            d['workload'] = '_'.join(segments[:-1])
+            d['bmk'] = segments[0]
+
+    return workload, d, key
+
+
+def checkpoint_key(path):
+    # a checkpoint is reprocessed once its stats or its finish flag change
+    flag_file = osp.join(osp.dirname(path), 'simulator_out.txt')
+    err_st = os.stat(path)
+    try:
+        out_st = os.stat(flag_file)
+    except OSError:
+        return (path, err_st.st_size, err_st.st_mtime_ns, None, None)
+    return (path, err_st.st_size, err_st.st_mtime_ns, out_st.st_size, out_st.st_mtime_ns)
+
+
+def load_store():
+    # key: workload point, value: (checkpoint_key, stats) of a finished checkpoint
+    try:
+        with open(cf.STORE_PATH, 'rb') as f:
+            store = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return {}
+    if store.get('targets') != repr(cf.targets):
+        return {}
+    return store['points']
+
+
+def save_store(points):
+    tmp_path = cf.STORE_PATH + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({'targets': repr(cf.targets), 'points': points}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cf.STORE_PATH)
+
+
+def batch(jobs=None, cache_dir=None, incremental=False):
     paths = u.glob_stats(cf.stats_dir, fname='simulator_err.txt')
 
-    manager = Manager()
-    all_bmk_dict = manager.dict()
-
-    semaphore = threading.Semaphore(psutil.cpu_count())
-
-    # for workload, path in paths:
-    def extract_and_post_process(gloabl_dict, workload, path):
-        with semaphore:
-            flag_file = osp.join(osp.dirname(path), 'simulator_out.txt')
-            with open(flag_file, encoding='utf-8') as f:
-                contents = f.read()
-                if 'EXCEEDING CYCLE/INSTR LIMIT' not in contents and 'HIT GOOD TRAP' not in contents:
-                    print('Skip unfinished job:', workload)
-                    return
-
-            print('Process finished job:', workload)
-
-            d = u.xs_get_stats(path, cf.targets)
-            if len(d):
-
-                # add bmk and point after topdown processing
-                segments = workload.split('_')
-                if len(segments):
-                    d['point'] = segments[-1]
-                    d['workload'] = '_'.join(segments[:-1])
-                    d['bmk'] = segments[0]
-
-            gloabl_dict[workload] = d
-        return
-
-    jobs = [Process(target=extract_and_post_process, args=(
-        all_bmk_dict, workload, path)) for workload, path in paths]
-    _ = [p.start() for p in jobs]
-    _ = [p.join() for p in jobs]
-
+    # In incremental mode, finished checkpoints whose files did not change since
+    # the last run are taken from the store instead of being parsed again
+    store = load_store() if incremental else {}
+    points = {}
+    tasks = []
+    for workload, path in paths:
+        key = checkpoint_key(path) if incremental else None
+        entry = store.get(workload)
+        if entry is not None and entry[0] == key:
+            points[workload] = entry
+        else:
+            tasks.append((workload, path, cf.targets, cache_dir, key))
+
+    # A bounded pool works through the checkpoints in chunks and returns plain
+    # dicts, instead of one process per checkpoint sharing a manager dict
+    jobs = jobs or os.cpu_count()
+    chunksize = max(1, len(tasks) // (jobs * 4))
+    if tasks:
+        with Pool(processes=jobs) as pool:
+            for workload, d, key in pool.imap_unordered(extract_and_post_process, tasks, chunksize):
+                if d is not None:
+                    points[workload] = (key, d)
+    if incremental:
+        save_store(points)
+        print(f'{len(tasks)} checkpoints processed, {len(paths) - len(tasks)} unchanged')
+
+    all_bmk_dict = {workload: d for workload, (_, d) in points.items()}
     df = pd.DataFrame.from_dict(all_bmk_dict, orient='index')
     df = df.sort_index()
     df = df.reindex(sorted(df.columns), axis=1)
@@ -60,86 +119,50 @@ def batch():
     df.to_csv(cf.CSV_PATH, index=True)
 
 
-def proc_input(wl_df: pd.DataFrame, js: dict, workload: str):
-    # we implement the weighted metrics computation with the following formula:
-    # weight = vec_weight matmul matrix_perf
-    # (N, 1) = (1, W) matmul (W, N)
-    # To make sure the matrix_perf is in the same order as the vec_weight,
-    # we sort the matrix_perf by point
-    assert isinstance(wl_df.iloc[0]['point'], np.int64)
-    wl_df = wl_df.sort_values(by=['point'])
-    # We also sort the vec_weight by point
-    wl_js = dict(js[workload])
-    wl_df['cpi'] = 1.0 / wl_df['ipc']
-    vec_weight = pd.DataFrame.from_dict(wl_js['points'], orient='index')
-
-    # convert string index into int64
-    vec_weight.index = vec_weight.index.astype(np.int64)
-    # select only existing points
-    vec_weight = vec_weight.loc[wl_df['point']]
-    # make their sum equals 1.0
-    vec_weight.columns = ['weight']
-
-    vec_weight['weight'] = vec_weight['weight'].astype(np.float64)
-    coverage = np.sum(vec_weight.values)
-    vec_weight = vec_weight / coverage
-
-    # Drop these auxiliary fields
-    to_drop = {'bmk', 'point', 'workload', 'ipc'}
-    to_drop = to_drop.intersection(set(wl_df.columns.to_list()))
-    wl_df = wl_df.drop(to_drop, axis=1)
-
-    weight_metrics = np.matmul(vec_weight.values.reshape(1, -1), wl_df.values)
-    weight_metrics_df = pd.DataFrame(weight_metrics, columns=wl_df.columns)
-    # We have to process coverage here to avoid apply weight on top of weight
-    weight_metrics_df['coverage'] = coverage
-    return weight_metrics_df.values, weight_metrics_df.columns
-
-
-def proc_bmk(bmk_df: pd.DataFrame, js: dict):
-    # Similar to per-input proc, we view the instruction count as the weight
-    # and compute weighted metrics with matrix multiplication
-    workloads = bmk_df['workload'].unique()
-    metric_list = []
-    for wl in workloads:
-        metrics, cols = proc_input(bmk_df[bmk_df['workload'] == wl], js, wl)
-        metric_list.append(metrics)
-    metrics = np.concatenate(metric_list, axis=0)
-    metrics = pd.DataFrame(metrics, columns=cols)
-
-    input_dict = {}
-    for workload in workloads:
-        if workload.startswith(workload):
-            input_dict[workload] = int(js[workload]['insts'])
-    input_insts = pd.DataFrame.from_dict(
-        input_dict, orient='index', columns=['insts'])
-    # make their sum equals 1.0
-    vec_weight = input_insts / np.sum(input_insts.values)
-    weight_metric = np.matmul(vec_weight.values.reshape(1, -1), metrics.values)
-    return weight_metric, metrics.columns
+def flatten_simpoint_weights(js: dict, workloads) -> pd.DataFrame:
+    # one row per (workload, point) with its SimPoint weight and the input's
+    # instruction count, ready to be joined with the per-point stats
+    rows = [(wl, np.int64(point), np.float64(weight), np.float64(js[wl].get('insts', 1)))
+            for wl in workloads for point, weight in js[wl]['points'].items()]
+    return pd.DataFrame(rows, columns=['workload', 'point', 'weight', 'insts'])
 
 
 def compute_weighted_metrics():
+    # Weighted metrics of all benchmarks at once:
+    #   per input:     sum over its points of metric * weight / coverage, where
+    #                  coverage is the summed weight of the points that were run
+    #   per benchmark: sum over its inputs of input metric * insts / total insts
+    # The coverage column is weighted like the metrics at the benchmark level.
     df = pd.read_csv(cf.CSV_PATH, index_col=0)
-    bmks = df['bmk'].unique()
     with open(cf.JSON_FILE, 'r', encoding='utf-8') as f:
         js = json.load(f)
-    weighted = {}
-    for bmk in bmks:
-        if bmk not in cf.spec_bmks['06']['int'] and cf.INT_ONLY:
-            continue
-        if bmk not in cf.spec_bmks['06']['float'] and cf.FP_ONLY:
-            continue
-        df_bmk = df[df['bmk'] == bmk]
-        workloads = df_bmk['workload'].unique()
-        n_wl = len(workloads)
-        if n_wl == 1:
-            metrics, cols = proc_input(df_bmk, js, workloads[0])
-        else:
-            metrics, cols = proc_bmk(df_bmk, js)
-        weighted[bmk] = metrics[0]
-    weighted_df = pd.DataFrame.from_dict(
-        weighted, orient='index', columns=cols)
+    if cf.INT_ONLY:
+        df = df[df['bmk'].isin(cf.spec_bmks['06']['int'])]
+    if cf.FP_ONLY:
+        df = df[df['bmk'].isin(cf.spec_bmks['06']['float'])]
+    assert df['point'].dtype == np.int64
+
+    df = df.assign(cpi=1.0 / df['ipc'])
+    # Drop these auxiliary fields
+    metric_cols = [c for c in df.columns if c not in {'bmk', 'point', 'workload', 'ipc'}]
+
+    weights = flatten_simpoint_weights(js, df['workload'].unique())
+    merged = df.merge(weights, on=['workload', 'point'], how='left', validate='one_to_one')
+    missing = merged[merged['weight'].isna()]
+    if len(missing):
+        raise KeyError(f'points without SimPoint weight: {list(zip(missing["workload"], missing["point"]))}')
+
+    keys = [merged['bmk'], merged['workload']]
+    coverage = merged.groupby(keys, sort=False)['weight'].sum()
+    point_weight = merged['weight'] / merged.groupby(keys, sort=False)['weight'].transform('sum')
+    per_input = merged[metric_cols].mul(point_weight, axis=0).groupby(keys, sort=False).sum()
+    per_input['coverage'] = coverage
+
+    insts = merged.groupby(keys, sort=False)['insts'].first()
+    input_weight = insts / insts.groupby(level=0, sort=False).transform('sum')
+    weighted_df = per_input.mul(input_weight, axis=0).groupby(level=0, sort=False).sum()
+    weighted_df.index.name = None
+
     if 'cpi' in weighted_df.columns:
         weighted_df = weighted_df.sort_values(by='cpi', ascending=False)
     else:
@@ -153,6 +176,14 @@ if __name__ == '__main__':
                         help='stat output directory')
     parser.add_argument('-j', '--json', action='store', required=True,
                         help='specify json file', default='resources/spec06_rv64gcb_o2_20m.json')
+    parser.add_argument('--jobs', action='store', type=int, default=None,
+                        help='stats extraction processes (default: all cores)')
+    parser.add_argument('--stats-cache', action='store', default=None,
+                        help='directory caching parsed stats of unchanged stat files')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only process new or changed checkpoints, reusing results/stats-store.pkl')
+    parser.add_argument('--watch', action='store', type=float, default=None,
+                        help='refresh the results incrementally every WATCH seconds')
     opt = parser.parse_args()
     cf.stats_dir = opt.stat_dir
     cf.JSON_FILE = opt.json
@@ -161,6 +192,11 @@ if __name__ == '__main__':
     if resource.getrlimit(resource.RLIMIT_NOFILE)[0] <= 8192:
         resource.setrlimit(resource.RLIMIT_NOFILE, (8192, 8192))
 
-    batch()
-    compute_weighted_metrics()
-    draw()
+    while True:
+        batch(opt.jobs, opt.stats_cache, opt.incremental or opt.watch is not None)
+        compute_weighted_metrics()
+        draw()
+        if opt.watch is None:
+            break
+        print(f'Results refreshed, next refresh in {opt.watch} seconds')
+        time.sleep(opt.watch)
@@ -1,5 +1,7 @@
+import hashlib
 import os
 import os.path as osp
+import pickle
 from os.path import expanduser as expu
 import re
 
@@ -10,40 +12,126 @@ def to_num(x: str) -> (int, float):
     return int(x)
 
 
-def xs_get_stats(stat_file: str, targets: list) -> dict:
+# Counter lines look like '[PERF ][time=   N] <module>: <counter>,   <value>'.
+# The '<module>: <counter>' head selects the target, so most lines are settled
+# with one split and a dict lookup instead of trying every target regex.
+PERF_LINE_RE = re.compile(r'\[PERF \]\[time=\s*\d+\] (.+?),\s+-?[\d.]+\s*$')
+STATS_CACHE_VERSION = 1
+
+
+class StatsMatcher:
+    def __init__(self, targets: dict):
+        self.patterns = {}
+        self.accumulate_counts = {}  # key: target, value: number of trailing matches summed
+        for k, p in targets.items():
+            if isinstance(p, str):
+                self.patterns[k] = re.compile(p)
+            else:
+                self.patterns[k] = re.compile(p[0])
+                self.accumulate_counts[k] = p[1]
+        # any-target prefilter for lines that are not settled by their head
+        try:
+            self.any_target = re.compile('|'.join(f'(?:{pattern.pattern})' for pattern in self.patterns.values()))
+        except re.error:
+            self.any_target = None  # e.g. targets with inline flags cannot be joined
+        # key: counter head, value: target it matched. Misses are not memoized: a
+        # target may reject one value of a counter (e.g. a negative) and accept another.
+        self.head_targets = {}
+
+    def scan(self, line: str):
+        # first target (in targets order) matching line, like trying every regex in turn
+        if self.any_target is not None and self.any_target.search(line) is None:
+            return None, None
+        for k, pattern in self.patterns.items():
+            m = pattern.search(line)
+            if m is not None:
+                return k, m
+        return None, None
+
+    def match(self, line: str):
+        perf = PERF_LINE_RE.match(line)
+        if perf is None:
+            return self.scan(line)
+        head = perf.group(1)
+        k = self.head_targets.get(head)
+        if k is not None:
+            m = self.patterns[k].search(line)
+            if m is not None:
+                return k, m
+        k, m = self.scan(line)
+        if k is not None:
+            self.head_targets[head] = k
+        return k, m
+
+
+matchers = {}
+
+
+def get_matcher(targets: dict) -> StatsMatcher:
+    key = repr(targets)
+    if key not in matchers:
+        matchers[key] = StatsMatcher(targets)
+    return matchers[key]
+
+
+def stats_cache_path(cache_dir: str, stat_file: str) -> str:
+    digest = hashlib.sha1(osp.realpath(expu(stat_file)).encode('utf-8')).hexdigest()
+    return osp.join(cache_dir, digest + '.pkl')
+
+
+def load_cached_stats(cache_dir: str, stat_file: str, targets: dict):
+    try:
+        with open(stats_cache_path(cache_dir, stat_file), 'rb') as f:
+            entry = pickle.load(f)
+    except Exception:
+        return None
+    st = os.stat(expu(stat_file))
+    if not isinstance(entry, dict) or entry.get('version') != STATS_CACHE_VERSION:
+        return None
+    if (entry['size'], entry['mtime'], entry['targets']) != (st.st_size, st.st_mtime_ns, repr(targets)):
+        return None
+    return entry['stats']
+
+
+def store_cached_stats(cache_dir: str, stat_file: str, targets: dict, st, stats: dict):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = stats_cache_path(cache_dir, stat_file)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({'version': STATS_CACHE_VERSION, 'size': st.st_size, 'mtime': st.st_mtime_ns,
+                     'targets': repr(targets), 'stats': stats}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def xs_get_stats(stat_file: str, targets: dict, cache_dir: str = None) -> dict:
 
     if not os.path.isfile(expu(stat_file)):
         print(stat_file)
     assert os.path.isfile(expu(stat_file))
-    with open(stat_file, encoding='utf-8') as f:
-        lines = f.read().splitlines()
 
-    if lines is None:
-        return None
+    if cache_dir is not None:
+        stats = load_cached_stats(cache_dir, stat_file, targets)
+        if stats is not None:
+            return stats
+    st = os.stat(expu(stat_file))
 
-    patterns = {}
-    accumulate_table = {}  # key: pattern, value: (count, [matched values])
-    for k, p in targets.items():
-        if isinstance(p, str):
-            patterns[k] = re.compile(p)
-        else:
-            patterns[k] = re.compile(p[0])
-            accumulate_table[k] = (p[1], [])
+    matcher = get_matcher(targets)
+    accumulate_table = {k: [] for k in matcher.accumulate_counts}  # key: target, value: matched values
     stats = {}
 
-    for _, line in enumerate(lines):
-        for k, pattern in patterns.items():
-            m = pattern.search(line)
-            if m is not None:
-                if k in accumulate_table:
-                    accumulate_table[k][1].append(to_num(m.group(1)))
-                else:
-                    stats[k] = to_num(m.group(1))
-                break
-    for k, accumulate in accumulate_table:
-        stats[k] = sum(accumulate[1][-accumulate[0]:])
-
-    desired_keys = set(patterns.keys())
+    with open(stat_file, encoding='utf-8') as f:
+        for line in f:
+            k, m = matcher.match(line.rstrip('\n'))
+            if k is None:
+                continue
+            if k in accumulate_table:
+                accumulate_table[k].append(to_num(m.group(1)))
+            else:
+                stats[k] = to_num(m.group(1))
+    for k, values in accumulate_table.items():
+        stats[k] = sum(values[-matcher.accumulate_counts[k]:])
+
+    desired_keys = set(matcher.patterns.keys())
     obtained_keys = set(stats.keys())
     not_found_keys = desired_keys - obtained_keys
     if not_found_keys:
@@ -53,6 +141,8 @@ def xs_get_stats(stat_file: str, targets: list) -> dict:
     assert len(not_found_keys) == 0
 
     stats['ipc'] = stats['commitInstr'] / stats['total_cycles']
+    if cache_dir is not None:
+        store_cached_stats(cache_dir, stat_file, targets, st, stats)
     return stats
 
 
@@ -26,8 +26,13 @@ import subprocess
 import sys
 import time
 import shlex
-import psutil
-import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from core_allocator import get_allocator
+
+# return code of a command killed for exceeding the timeout, as with timeout(1)
+TIMEOUT_RETURN_CODE = 124
 
 def find_files_with_suffix(root_dir, suffixes):
     matching_files = []
@@ -210,6 +215,9 @@ class XiangShan(object):
     def __init__(self, args):
         self.args = XSArgs(args)
         self.timeout = args.timeout
+        # concurrent CI: processes of the running workloads
+        self.running_procs = set()
+        self.ci_lock = threading.Lock()
 
     def show(self):
         self.args.show()
@@ -258,20 +266,27 @@ class XiangShan(object):
             make -C $NOOP_HOME simv {make_args} CONSIDER_FSDB=1')  # set CONSIDER_FSDB for compatibility
         return return_code
 
-    def run_emu(self, workload):
-        print("Running XiangShan emu with the following configurations:")
-        self.show()
+    def run_emu(self, workload, lease=None, log=None):
+        if log is None:
+            print("Running XiangShan emu with the following configurations:")
+            self.show()
         emu_args = " ".join(map(lambda arg: f"--{arg[1]} {arg[0]}", self.args.get_emu_args()))
-        print("workload:", workload)
+        print("workload:", workload, file=log)
         numa_args = ""
-        if self.args.numa:
-            numa_info = get_free_cores(self.args.threads)
-            numa_args = f"numactl -m {numa_info[0]} -C {numa_info[1]}-{numa_info[2]}"
+        own_lease = self.args.numa and lease is None
+        if own_lease:
+            lease = get_allocator().acquire(self.args.threads, owner=workload)
+        if lease is not None:
+            numa_args = lease.numactl_prefix()
         fork_args = "--enable-fork" if self.args.fork else ""
         diff_args = "--no-diff" if self.args.disable_diff else ""
         chiseldb_args = "--dump-db" if not self.args.disable_db else ""
         gcpt_restore_args = f"-r {self.args.gcpt_restore_bin}" if len(self.args.gcpt_restore_bin) != 0 else ""
-        return_code = self.__exec_cmd(f'ulimit -s {32 * 1024}; {numa_args} $NOOP_HOME/build/emu -i {workload} {emu_args} {fork_args} {diff_args} {chiseldb_args} {gcpt_restore_args}')
+        try:
+            return_code = self.__exec_cmd(f'ulimit -s {32 * 1024}; {numa_args} $NOOP_HOME/build/emu -i {workload} {emu_args} {fork_args} {diff_args} {chiseldb_args} {gcpt_restore_args}', log)
+        finally:
+            if own_lease:
+                lease.release()
         return return_code
 
     def run_simv(self, workload):
@@ -288,6 +303,8 @@ class XiangShan(object):
 
     def run(self, args):
         if args.ci is not None:
+            if args.ci_jobs > 1 or args.ci_report is not None:
+                return self.run_ci_parallel(args.ci, args.ci_jobs, args.ci_report, args.ci_run_all)
             return self.run_ci(args.ci)
         if args.ci_vcs is not None:
             return self.run_ci_vcs(args.ci_vcs)
@@ -307,21 +324,46 @@ class XiangShan(object):
                 return ret
         return 0
 
-    def __exec_cmd(self, cmd):
+    def __exec_cmd(self, cmd, log=None):
+        # log: file object receiving the command output instead of the console
         env = dict(os.environ)
         env.update(self.args.get_env_variables())
-        print("subprocess call cmd:", cmd)
+        print("subprocess call cmd:", cmd, file=log, flush=True)
         start = time.time()
-        proc = subprocess.Popen(cmd, shell=True, env=env, preexec_fn=os.setsid)
+        proc = subprocess.Popen(cmd, shell=True, env=env, preexec_fn=os.setsid, stdout=log, stderr=log)
+        with self.ci_lock:
+            self.running_procs.add(proc)
         try:
             return_code = proc.wait(self.timeout)
             end = time.time()
-            print(f"Elapsed time: {end - start} seconds")
+            print(f"Elapsed time: {end - start} seconds", file=log)
             return return_code
-        except (KeyboardInterrupt, subprocess.TimeoutExpired):
+        except subprocess.TimeoutExpired:
             os.killpg(os.getpgid(proc.pid), signal.SIGINT)
-            print(f"KeyboardInterrupt or TimeoutExpired.")
+            print(f"TimeoutExpired after {self.timeout} seconds.", file=log)
+            return TIMEOUT_RETURN_CODE
+        except KeyboardInterrupt:
+            os.killpg(os.getpgid(proc.pid), signal.SIGINT)
+            print("KeyboardInterrupt.", file=log)
             return 0
+        finally:
+            with self.ci_lock:
+                self.running_procs.discard(proc)
+
+    def __kill_running(self):
+        with self.ci_lock:
+            procs = list(self.running_procs)
+        for proc in procs:
+            try:
+                os.killpg(os.getpgid(proc.pid), signal.SIGINT)
+            except ProcessLookupError:
+                pass
+
+    def __copy_wave(self, files):
+        if self.args.default_wave_home != self.args.wave_home:
+            print("copy wave file to " + self.args.wave_home)
+            for f in files:
+                self.__exec_cmd(f"cp $NOOP_HOME/build/{f} $WAVE_HOME")
 
     def __get_ci_cputest(self, name=None):
         # base_dir = os.path.join(self.args.am_home, "tests/cputest/build")
@@ -566,7 +608,7 @@ class XiangShan(object):
         all_gcpt = load_all_gcpt(all_cpt_dir)
         return [random.choice(all_gcpt)]
 
-    def run_ci(self, test):
+    def __get_ci_targets(self, test):
         all_tests = {
             "cputest": self.__get_ci_cputest,
             "riscv-tests": self.__get_ci_rvtest,
@@ -582,73 +624,108 @@ class XiangShan(object):
             "f16_test": self.__get_ci_F16test,
             "zcb-test": self.__get_ci_zcbtest
         }
-        for target in all_tests.get(test, self.__get_ci_workloads)(test):
+        return all_tests.get(test, self.__get_ci_workloads)(test)
+
+    def run_ci(self, test):
+        for target in self.__get_ci_targets(test):
             print(target)
             ret = self.run_emu(target)
             if ret:
-                if self.args.default_wave_home != self.args.wave_home:
-                    print("copy wave file to " + self.args.wave_home)
-                    self.__exec_cmd(f"cp $NOOP_HOME/build/*.vcd $WAVE_HOME")
-                    self.__exec_cmd(f"cp $NOOP_HOME/build/*.fst $WAVE_HOME")
-                    self.__exec_cmd(f"cp $NOOP_HOME/build/emu $WAVE_HOME")
-                    self.__exec_cmd(f"cp $NOOP_HOME/build/rtl/SimTop.v $WAVE_HOME")
-                    self.__exec_cmd(f"cp $NOOP_HOME/build/*.db $WAVE_HOME")
+                self.__copy_wave(["*.vcd", "*.fst", "emu", "rtl/SimTop.v", "*.db"])
                 return ret
         return 0
 
+    def run_ci_parallel(self, test, jobs, report=None, run_all=False):
+        # Run the CI workloads of test on up to jobs concurrent emus. With --numa,
+        # each emu runs on its own leased window of --threads cores, so that
+        # concurrent workloads never share cores. Each workload writes its
+        # output to its own log file and its result is added to the JSON report
+        # as soon as it finishes. Unless run_all, the first failure cancels the
+        # workloads that have not started and stops the running ones.
+        print("Running XiangShan emu with the following configurations:")
+        self.show()
+        targets = list(self.__get_ci_targets(test))
+        log_dir = os.path.join(self.args.noop_home, "build", "ci-logs", test)
+        os.makedirs(log_dir, exist_ok=True)
+        results = [{"workload": target, "status": "pending"} for target in targets]
+        stop = threading.Event()
+        report_lock = threading.Lock()
+        start = time.time()
+
+        def write_report():
+            if report is None:
+                return
+            summary = {status: sum(1 for r in results if r["status"] == status)
+                       for status in ("pass", "fail", "timeout", "cancelled", "skipped", "pending", "running")}
+            content = {"test": test, "jobs": jobs, "run_all": run_all,
+                       "elapsed": time.time() - start, "summary": summary, "workloads": results}
+            tmp_report = f"{report}.tmp"
+            with open(tmp_report, "w") as f:
+                json.dump(content, f, indent=2)
+            os.replace(tmp_report, report)
+
+        def run_one(index, target):
+            result = results[index]
+            if stop.is_set():
+                with report_lock:
+                    result["status"] = "skipped"
+                    write_report()
+                return None
+            lease = None
+            if self.args.numa:
+                lease = get_allocator().acquire(self.args.threads, owner=target)
+                result["cores"] = f"{lease.start}-{lease.end}"
+            log_path = os.path.join(log_dir, f"{index:04d}-{os.path.basename(target)}.log")
+            result.update(status="running", log=log_path)
+            workload_start = time.time()
+            try:
+                with open(log_path, "w") as log:
+                    ret = self.run_emu(target, lease, log) if not stop.is_set() else None
+            finally:
+                if lease is not None:
+                    lease.release()
+            with report_lock:
+                if stop.is_set():
+                    # stopped because another workload failed first
+                    status, ret = "cancelled", None
+                elif ret:
+                    # a timed-out workload counts as a failure
+                    status = "timeout" if ret == TIMEOUT_RETURN_CODE else "fail"
+                    if not run_all:
+                        stop.set()
+                        self.__kill_running()
+                else:
+                    status = "pass"
+                result.update(status=status, return_code=ret, elapsed=time.time() - workload_start)
+                print(f"[{result['status'].upper()}] {target} ({result['elapsed']:.1f}s)")
+                write_report()
+            return ret
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(run_one, i, target) for i, target in enumerate(targets)]
+            try:
+                return_codes = [future.result() for future in futures]
+            except KeyboardInterrupt:
+                stop.set()
+                self.__kill_running()
+                raise
+        failed = [ret for ret in return_codes if ret]
+        passed = sum(1 for result in results if result["status"] == "pass")
+        print(f"{passed}/{len(targets)} workloads passed in {time.time() - start:.1f}s")
+        if failed:
+            self.__copy_wave(["*.vcd", "*.fst", "emu", "rtl/SimTop.v", "*.db"])
+            return failed[0]
+        return 0
+
     def run_ci_vcs(self, test):
-        all_tests = {
-            "cputest": self.__get_ci_cputest,
-            "riscv-tests": self.__get_ci_rvtest,
-            "misc-tests": self.__get_ci_misc,
-            "mc-tests": self.__get_ci_mc,
-            "nodiff-tests": self.__get_ci_nodiff,
-            "rvh-tests": self.__get_ci_rvhtest,
-            "microbench": self.__am_apps_path,
-            "coremark": self.__am_apps_path,
-            "coremark-1-iteration": self.__am_apps_path,
-            "rvv-bench": self.__get_ci_rvvbench,
-            "rvv-test": self.__get_ci_rvvtest,
-            "f16_test": self.__get_ci_F16test,
-            "zcb-test": self.__get_ci_zcbtest
-        }
-        for target in all_tests.get(test, self.__get_ci_workloads)(test):
+        for target in self.__get_ci_targets(test):
             print(target)
             ret = self.run_simv(target)
             if ret:
-                if self.args.default_wave_home != self.args.wave_home:
-                    print("copy wave file to " + self.args.wave_home)
-                    self.__exec_cmd(f"cp $NOOP_HOME/build/*.fsdb $WAVE_HOME")
-                    self.__exec_cmd(f"cp $NOOP_HOME/build/simv $WAVE_HOME")
-                    self.__exec_cmd(f"cp $NOOP_HOME/build/rtl/SimTop.v $WAVE_HOME")
-                    self.__exec_cmd(f"cp $NOOP_HOME/build/*.db $WAVE_HOME")
+                self.__copy_wave(["*.fsdb", "simv", "rtl/SimTop.v", "*.db"])
                 return ret
         return 0
 
-def get_free_cores(n):
-    numa_re = re.compile(r'.*numactl +.*-C +([0-9]+)-([0-9]+).*')
-    while True:
-        disable_cores = []
-        for proc in psutil.process_iter():
-            try:
-                joint = ' '.join(proc.cmdline())
-                numa_match = numa_re.match(joint)
-                if numa_match and 'ssh' not in proc.name():
-                    disable_cores.extend(range(int(numa_match.group(1)), int(numa_match.group(2)) + 1))
-            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                pass
-        num_logical_core = psutil.cpu_count(logical=False)
-        core_usage = psutil.cpu_percent(interval=1, percpu=True)
-        num_window = num_logical_core // n
-        for i in range(num_window):
-            if set(disable_cores) & set(range(i * n, i * n + n)):
-                continue
-            window_usage = core_usage[i * n : i * n + n]
-            if sum(window_usage) < 30 * n and True not in map(lambda x: x > 90, window_usage):
-                return (((i * n) % num_logical_core) // (num_logical_core // 2), i * n, i * n + n - 1)
-        print(f"No free {n} cores found. CPU usage: {core_usage}\n")
-        time.sleep(random.uniform(1, 60))
-
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Python wrapper for XiangShan')
     parser.add_argument('workload', nargs='?', type=str, default="",
@@ -660,6 +737,9 @@ if __name__ == "__main__":
     parser.add_argument('--vcs-build', action='store_true', help='build XS simv')
     parser.add_argument('--ci', nargs='?', type=str, const="", help='run CI tests')
     parser.add_argument('--ci-vcs', nargs='?', type=str, const="", help='run CI tests on simv')
+    parser.add_argument('--ci-jobs', type=int, default=1, help='number of CI workloads running concurrently')
+    parser.add_argument('--ci-report', type=str, help='write per-workload CI results to this JSON file')
+    parser.add_argument('--ci-run-all', action='store_true', help='keep running CI workloads after a failure')
     parser.add_argument('--clean', action='store_true', help='clean up XiangShan CI workspace')
     parser.add_argument('--timeout', nargs='?', type=int, default=None, help='timeout (in seconds)')
     # environment variables
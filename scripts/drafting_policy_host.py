@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Serve AHASD drafting-control decisions from Python
+
+Attaches to the shared-memory ring created by ONNXim's ExternalPolicy
+(ahasd.drafting_policy.type = "external") and answers continue/stop and
+pre-verification decisions with a Python policy, so new policies can be
+evaluated without recompiling the simulator.
+
+A policy is any object with
+    decide(entropies, pending, kv_lengths, max_lengths) -> (continue_flags, preverify_lengths)
+and optionally feedback(fully_accepted, accepted_length) and reset().
+Inputs and outputs are equal-length sequences; a preverify length is the
+number of drafts to pre-verify, 0 for none, or -1 to let TVC decide.
+decide() receives every decision queued in the ring at once, read and
+written with strided memoryviews. The simulator's per-draft path
+(should_continue_drafting) waits for each answer before going on, so there
+it sees one decision per call and pays a full ring round trip (about 3 us
+per decision measured with host and simulator on one machine); only
+decide_drafting_batch submits several decisions together.
+
+Usage:
+    python3 drafting_policy_host.py --policy threshold --entropy-threshold 2.0
+    python3 drafting_policy_host.py --policy my_policies.py:EntropySlope
+"""
+
+import argparse
+import array
+import importlib
+import importlib.util
+import os
+import struct
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+# Ring layout, must match ONNXim/src/async_queue/DraftingPolicy.h
+MAGIC = 0x50444841
+VERSION = 1
+HEADER = struct.Struct('<IIII')         # magic, version, capacity, slot_size
+HEAD = struct.Struct('<Q')
+REQUEST_HEAD_OFFSET = 16
+RESPONSE_HEAD_OFFSET = 24
+HOST_READY_OFFSET = 32
+SHUTDOWN_OFFSET = 36
+HEADER_SIZE = 64
+SLOT_SIZE = 32
+# Slot words: kind, entropy, pending, kv_length, max_length/accepted,
+# fully_accepted, response continue, response preverify_length
+
+DECIDE, FEEDBACK, RESET = 0, 1, 2
+
+# Empty polls before yielding the CPU when --idle-sleep-us is 0
+IDLE_SPINS = 256
+
+
+class ThresholdPolicy:
+    """Stop once entropy reaches the threshold or the draft queue is full."""
+
+    def __init__(self, entropy_threshold=2.5):
+        self.entropy_threshold = entropy_threshold
+
+    def decide(self, entropies, pending, kv_lengths, max_lengths):
+        threshold = self.entropy_threshold
+        continue_flags = [int(e < threshold and p < m)
+                          for e, p, m in zip(entropies, pending, max_lengths)]
+        return continue_flags, [-1] * len(continue_flags)
+
+
+def load_policy(spec, entropy_threshold):
+    """Build the policy named by spec: 'threshold', 'module:attr' or 'file.py:attr'."""
+    if spec == 'threshold':
+        return ThresholdPolicy(entropy_threshold)
+
+    if ':' not in spec:
+        raise ValueError(f"Policy must be 'threshold' or 'module:attr', got '{spec}'")
+    target, attr = spec.rsplit(':', 1)
+    if target.endswith('.py'):
+        module_spec = importlib.util.spec_from_file_location('ahasd_user_policy', target)
+        module = importlib.util.module_from_spec(module_spec)
+        module_spec.loader.exec_module(module)
+    else:
+        module = importlib.import_module(target)
+
+    policy = getattr(module, attr)
+    # Classes and factories are instantiated, instances are used as-is
+    return policy() if callable(policy) and not hasattr(policy, 'decide') else policy
+
+
+def attach(shm_name, timeout_s):
+    """Attach to the simulator's ring, waiting for it to be created."""
+    name = shm_name.lstrip('/')
+    deadline = time.monotonic() + timeout_s
+    while True:
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            shm = None
+        if shm is not None:
+            # The simulator owns the segment; keep the tracker from unlinking it
+            resource_tracker.unregister(shm._name, 'shared_memory')
+            if shm.size >= HEADER_SIZE:
+                magic, version, capacity, slot_size = HEADER.unpack_from(shm.buf, 0)
+                if magic == MAGIC:
+                    if version != VERSION or slot_size != SLOT_SIZE:
+                        raise RuntimeError(f"Incompatible policy ring version {version}")
+                    return shm, capacity
+            shm.close()
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Policy ring {shm_name} not created within {timeout_s}s")
+        time.sleep(0.01)
+
+
+def serve(shm, capacity, policy, idle_sleep_s=0.0):
+    """Answer requests in order until the simulator sets the shutdown flag."""
+    buf = shm.buf
+    # Strided views over the slot array: field f of slot i is at [i * 8 + f]
+    words = SLOT_SIZE // 4
+    slots_u = buf[HEADER_SIZE:HEADER_SIZE + capacity * SLOT_SIZE].cast('I')
+    slots_i = slots_u.cast('B').cast('i')
+    slots_f = slots_u.cast('B').cast('f')
+    response_head = HEAD.unpack_from(buf, RESPONSE_HEAD_OFFSET)[0]
+    struct.pack_into('<I', buf, HOST_READY_OFFSET, 1)
+    served = 0
+    idle_polls = 0
+
+    try:
+        while True:
+            request_head = HEAD.unpack_from(buf, REQUEST_HEAD_OFFSET)[0]
+            if request_head == response_head:
+                if struct.unpack_from('<I', buf, SHUTDOWN_OFFSET)[0]:
+                    return served
+                idle_polls += 1
+                if idle_sleep_s:
+                    time.sleep(idle_sleep_s)
+                elif idle_polls >= IDLE_SPINS:
+                    os.sched_yield()  # Let a simulator sharing this core run
+                continue
+            idle_polls = 0
+
+            seq = response_head
+            while seq < request_head:
+                # Contiguous run of slots (the ring wraps at most once per pass)
+                first = seq % capacity
+                last = min(first + (request_head - seq), capacity)
+                kinds = slots_u[first * words:last * words:words].tolist()
+                if max(kinds) == DECIDE:
+                    served += _answer(policy, slots_u, slots_i, slots_f, first, last)
+                else:
+                    # Feedback/reset split the run so the policy sees events in order
+                    run_start = first
+                    for index, kind in enumerate(kinds, first):
+                        if kind == DECIDE:
+                            continue
+                        served += _answer(policy, slots_u, slots_i, slots_f, run_start, index)
+                        run_start = index + 1
+                        if kind == FEEDBACK and hasattr(policy, 'feedback'):
+                            policy.feedback(bool(slots_u[index * words + 5]),
+                                            slots_u[index * words + 4])
+                        elif kind == RESET and hasattr(policy, 'reset'):
+                            policy.reset()
+                    served += _answer(policy, slots_u, slots_i, slots_f, run_start, last)
+                seq += last - first
+
+            response_head = request_head
+            HEAD.pack_into(buf, RESPONSE_HEAD_OFFSET, response_head)
+    finally:
+        slots_f.release()
+        slots_i.release()
+        slots_u.release()
+
+
+def _answer(policy, slots_u, slots_i, slots_f, first, last):
+    """Run the policy on decision slots [first, last) and write the responses."""
+    if first >= last:
+        return 0
+    words = SLOT_SIZE // 4
+    lo, hi = first * words, last * words
+    continue_flags, preverify_lengths = policy.decide(
+        slots_f[lo + 1:hi:words].tolist(), slots_u[lo + 2:hi:words].tolist(),
+        slots_u[lo + 3:hi:words].tolist(), slots_u[lo + 4:hi:words].tolist())
+    slots_i[lo + 6:hi:words] = array.array('i', (int(c) for c in continue_flags))
+    slots_i[lo + 7:hi:words] = array.array('i', (int(p) for p in preverify_lengths))
+    return last - first
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Serve AHASD drafting-control decisions from a Python policy')
+    parser.add_argument('--shm-name', type=str, default='/ahasd_policy',
+                       help='Shared-memory ring name (default: /ahasd_policy)')
+    parser.add_argument('--policy', type=str, default='threshold',
+                       help="'threshold', 'module:attr' or 'file.py:attr' (default: threshold)")
+    parser.add_argument('--entropy-threshold', type=float, default=2.5,
+                       help='Entropy threshold of the built-in policy (default: 2.5)')
+    parser.add_argument('--connect-timeout', type=float, default=60.0,
+                       help='Seconds to wait for the simulator to create the ring (default: 60)')
+    parser.add_argument('--idle-sleep-us', type=float, default=0.0,
+                       help='Sleep between polls when idle; 0 spins for lowest latency (default: 0)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    policy = load_policy(args.policy, args.entropy_threshold)
+    shm, capacity = attach(args.shm_name, args.connect_timeout)
+    print(f"Serving drafting policy '{args.policy}' on {args.shm_name} ({capacity} slots)")
+    try:
+        served = serve(shm, capacity, policy, args.idle_sleep_us / 1e6)
+    finally:
+        shm.close()
+    print(f"Served {served} decisions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
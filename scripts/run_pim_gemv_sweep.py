@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+PIM GEMV shape-sweep benchmark with roofline reporting
+
+Drives PIMSimulator over the GEMV shapes of every DLM layer (QKV, O, FFN up/down)
+for different numbers of PIM ranks and compares the achieved bandwidth/throughput
+against the on-chip and off-chip rooflines of the PIM hardware section in
+run_ahasd_simulation.sh.
+"""
+
+import argparse
+import csv
+import json
+import os
+import re
+import subprocess
+import sys
+
+PROJECT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Mirrors dlm_gemv_shapes in PIMSimulator/src/tests/PIMBenchTestCases.cpp
+# (model, layer, out_vec, in_vec)
+DLM_GEMV_SHAPES = [
+    ('opt-1.3b', 'qkv', 3 * 2048, 2048),
+    ('opt-1.3b', 'o', 2048, 2048),
+    ('opt-1.3b', 'ffn_up', 8192, 2048),
+    ('opt-1.3b', 'ffn_down', 2048, 8192),
+    ('llama2-7b', 'qkv', 3 * 4096, 4096),
+    ('llama2-7b', 'o', 4096, 4096),
+    ('llama2-7b', 'ffn_up', 11008, 4096),
+    ('llama2-7b', 'ffn_down', 4096, 11008),
+    ('palm-8b', 'qkv', 3 * 4096, 4096),
+    ('palm-8b', 'o', 4096, 4096),
+    ('palm-8b', 'ffn_up', 16384, 4096),
+    ('palm-8b', 'ffn_down', 4096, 16384),
+]
+
+# Mirrors sweep_pim_ranks in PIMSimulator/src/tests/PIMBenchTestCases.cpp
+SWEEP_PIM_RANKS = [1, 2, 4, 8, 16]
+
+# Used when a key is missing from the hardware section of the runner script.
+# Peak throughput and on-chip bandwidth are totals over num_units ranks and are
+# scaled to the swept rank count; the off-chip (host) link is shared by all ranks.
+DEFAULT_PIM_HARDWARE = {
+    'num_units': 16,
+    'performance_int8_gops': 102.4,
+    'on_chip_bandwidth_gbs': 256.0,
+    'off_chip_bandwidth_gbs': 51.2,
+}
+
+# Name of the element precision reported for each --bytes-per-element
+PRECISION_NAMES = {1: 'INT8', 2: 'FP16', 4: 'FP32'}
+
+RECORD_RE = re.compile(r'\[GEMV-SWEEP\]\s+(\S+)')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Sweep PIMSimulator GEMV over DLM layer shapes and PIM rank counts')
+
+    parser.add_argument('--models', type=str, nargs='+',
+                       default=sorted({shape[0] for shape in DLM_GEMV_SHAPES}),
+                       help='DLM models to sweep (default: all)')
+    parser.add_argument('--ranks', type=int, nargs='+', default=SWEEP_PIM_RANKS,
+                       help=f'Numbers of PIM ranks to sweep (subset of {SWEEP_PIM_RANKS})')
+    parser.add_argument('--pim-home', type=str,
+                       default=os.path.join(PROJECT_ROOT, 'PIMSimulator'),
+                       help='PIMSimulator directory containing the built `sim` binary')
+    parser.add_argument('--hardware-script', type=str,
+                       default=os.path.join(PROJECT_ROOT, 'scripts', 'run_ahasd_simulation.sh'),
+                       help='Script whose hardware section provides the PIM rooflines')
+    parser.add_argument('--bytes-per-element', type=int, default=2,
+                       help='Weight/activation element size in bytes (default: 2, FP16)')
+    parser.add_argument('--peak-gops', type=float, default=None,
+                       help='Peak throughput of all PIM units at this element size '
+                            '(default: the INT8 peak divided by --bytes-per-element)')
+
+    parser.add_argument('--output', type=str, required=True,
+                       help='Output directory for results')
+    parser.add_argument('--from-log', type=str, default=None,
+                       help='Re-analyze an existing sweep log instead of running PIMSimulator')
+    parser.add_argument('--dry-run', action='store_true',
+                       help='Dry run mode for CI testing (roofline-only results without running simulator)')
+
+    return parser.parse_args()
+
+
+def load_pim_hardware(script_path):
+    """Read PIM roofline parameters from the hardware section of the runner script."""
+    hardware = dict(DEFAULT_PIM_HARDWARE)
+
+    try:
+        with open(script_path, 'r') as f:
+            content = f.read()
+    except OSError:
+        print(f"    Warning: {script_path} not found, using default PIM hardware")
+        return hardware
+
+    if match := re.search(r'"pim"\s*:\s*\{([^}]*)\}', content):
+        section = match.group(1)
+        if match := re.search(r'"num_units"\s*:\s*(\d+)', section):
+            hardware['num_units'] = int(match.group(1))
+        if match := re.search(r'"performance_int8"\s*:\s*"([\d.]+)\s*GOPS"', section):
+            hardware['performance_int8_gops'] = float(match.group(1))
+        if match := re.search(r'"on_chip_bandwidth"\s*:\s*"([\d.]+)\s*GB/s"', section):
+            hardware['on_chip_bandwidth_gbs'] = float(match.group(1))
+        if match := re.search(r'"off_chip_bandwidth"\s*:\s*"([\d.]+)\s*GB/s"', section):
+            hardware['off_chip_bandwidth_gbs'] = float(match.group(1))
+
+    return hardware
+
+
+def set_precision(hardware, bytes_per_element, peak_gops=None):
+    """Pick the compute ceiling matching the element size the traffic is counted with."""
+    hardware['precision'] = PRECISION_NAMES.get(bytes_per_element, f'{8 * bytes_per_element}-bit')
+    hardware['bytes_per_element'] = bytes_per_element
+    if peak_gops is None:
+        # the INT8 peak comes from a fixed-width datapath that holds fewer wide elements
+        peak_gops = hardware['performance_int8_gops'] / bytes_per_element
+    hardware['peak_gops'] = peak_gops
+    return hardware
+
+
+def rank_ceilings(hardware, ranks):
+    """Peak throughput (GOPS) and on-chip bandwidth (GB/s) of `ranks` PIM ranks."""
+    scale = ranks / hardware['num_units']
+    return (hardware['peak_gops'] * scale,
+            hardware['on_chip_bandwidth_gbs'] * scale)
+
+
+def shape_test_name(model, layer, ranks):
+    """gtest parameter name of one sweep point (see PIMGemvSweepFixture)."""
+    return f"{re.sub(r'[^0-9A-Za-z]', '_', model)}_{layer}_r{ranks}"
+
+
+def build_gtest_filter(models, ranks):
+    names = [shape_test_name(model, layer, r)
+             for model, layer, _, _ in DLM_GEMV_SHAPES if model in models
+             for r in ranks]
+    return ':'.join(f"*PIMGemvSweepFixture.gemv/{name}" for name in names)
+
+
+def run_sweep(args, log_file):
+    """Run the selected sweep points in PIMSimulator, logging to log_file."""
+    sim_binary = os.path.join(args.pim_home, 'sim')
+    if not os.path.exists(sim_binary):
+        print(f"    ERROR: PIMSimulator not found at {sim_binary}")
+        print("    Please build PIMSimulator first: cd PIMSimulator && scons")
+        sys.exit(1)
+
+    cmd = [os.path.abspath(sim_binary),
+           f"--gtest_filter={build_gtest_filter(args.models, args.ranks)}"]
+
+    print(f"    Executing {len(args.models)} model(s) x {len(args.ranks)} rank count(s)...")
+    try:
+        # PIMSimulator resolves its ini files relative to the working directory
+        with open(log_file, 'w') as log:
+            subprocess.run(cmd, cwd=args.pim_home, stdout=log,
+                           stderr=subprocess.STDOUT, check=True)
+    except subprocess.CalledProcessError as e:
+        print(f"    ERROR: PIMSimulator failed with return code {e.returncode}")
+        print(f"    Check log file: {log_file}")
+        sys.exit(1)
+
+
+def parse_sweep_log(log_file):
+    """Parse [GEMV-SWEEP] records from a PIMSimulator log."""
+    records = []
+    with open(log_file, 'r') as f:
+        for line in f:
+            if match := RECORD_RE.search(line):
+                fields = dict(item.split('=', 1) for item in match.group(1).split(','))
+                records.append({
+                    'model': fields['model'],
+                    'layer': fields['layer'],
+                    'out': int(fields['out']),
+                    'in': int(fields['in']),
+                    'ranks': int(fields['ranks']),
+                    'cycles': int(fields['cycles']),
+                    'tck_ns': float(fields['tck_ns']),
+                })
+    return records
+
+
+def generate_mock_records(args, hardware):
+    """Roofline-only records for dry-run/CI testing (runs at the on-chip roofline)."""
+    records = []
+    for model, layer, out_dim, in_dim in DLM_GEMV_SHAPES:
+        if model not in args.models:
+            continue
+        traffic = (out_dim * in_dim + in_dim + out_dim) * args.bytes_per_element
+        for ranks in args.ranks:
+            peak_gops, on_chip_gbs = rank_ceilings(hardware, ranks)
+            time_ns = max(traffic / on_chip_gbs, 2 * out_dim * in_dim / peak_gops)
+            records.append({
+                'model': model, 'layer': layer, 'out': out_dim, 'in': in_dim,
+                'ranks': ranks, 'cycles': int(time_ns), 'tck_ns': 1.0,
+            })
+    return records
+
+
+def analyze_record(record, hardware, bytes_per_element):
+    """Achieved bandwidth/throughput of one GEMV vs. the on-chip and off-chip rooflines."""
+    out_dim, in_dim = record['out'], record['in']
+    ops = 2 * out_dim * in_dim
+    traffic = (out_dim * in_dim + in_dim + out_dim) * bytes_per_element
+    intensity = ops / traffic
+
+    peak_gops, on_chip_gbs = rank_ceilings(hardware, record['ranks'])
+    on_chip_gops = min(peak_gops, intensity * on_chip_gbs)
+    off_chip_gops = min(peak_gops, intensity * hardware['off_chip_bandwidth_gbs'])
+
+    time_ns = record['cycles'] * record['tck_ns']
+    achieved_gops = ops / time_ns if time_ns > 0 else 0.0
+    achieved_bw = traffic / time_ns if time_ns > 0 else 0.0
+
+    result = dict(record)
+    result.update({
+        'time_us': time_ns / 1000.0,
+        'ops': ops,
+        'traffic_bytes': traffic,
+        'arithmetic_intensity': intensity,
+        'achieved_bandwidth_gbs': achieved_bw,
+        'achieved_gops': achieved_gops,
+        'on_chip_roofline_gops': on_chip_gops,
+        'off_chip_roofline_gops': off_chip_gops,
+        'on_chip_efficiency': achieved_gops / on_chip_gops if on_chip_gops > 0 else 0.0,
+        'speedup_vs_off_chip': achieved_gops / off_chip_gops if off_chip_gops > 0 else 0.0,
+        'bound': 'bandwidth' if on_chip_gops < peak_gops else 'compute',
+    })
+    return result
+
+
+def write_results(results, hardware, output_dir, simulation_type):
+    os.makedirs(output_dir, exist_ok=True)
+
+    csv_file = os.path.join(output_dir, 'gemv_sweep.csv')
+    with open(csv_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0].keys()))
+        writer.writeheader()
+        writer.writerows(results)
+
+    json_file = os.path.join(output_dir, 'gemv_sweep.json')
+    with open(json_file, 'w') as f:
+        json.dump({
+            'simulation_type': simulation_type,
+            'hardware': hardware,
+            'results': results,
+        }, f, indent=2)
+
+    summary_file = os.path.join(output_dir, 'summary.txt')
+    with open(summary_file, 'w') as f:
+        f.write("=== PIM GEMV Shape Sweep ===\n")
+        f.write(f"Simulation Type: {simulation_type}\n")
+        f.write("Simulated device: PIMSimulator HBM2-PIM (system_hbm_64ch.ini)\n")
+        f.write(f"Precision: {hardware['precision']} ({hardware['bytes_per_element']} bytes/element)\n")
+        f.write(f"Peak: {hardware['peak_gops']} GOPS, "
+                f"On-chip: {hardware['on_chip_bandwidth_gbs']} GB/s "
+                f"(totals for {hardware['num_units']} ranks, scaled per rank count), "
+                f"Off-chip: {hardware['off_chip_bandwidth_gbs']} GB/s\n\n")
+        f.write(f"{'Model':<10} {'Layer':<9} {'Shape':>12} {'Ranks':>5} {'Time(us)':>10} "
+                f"{'BW(GB/s)':>9} {'GOPS':>7} {'On-chip%':>8} {'Bound':>9}\n")
+        for r in results:
+            f.write(f"{r['model']:<10} {r['layer']:<9} {r['out']:>6}x{r['in']:<5} "
+                    f"{r['ranks']:>5} {r['time_us']:>10.2f} "
+                    f"{r['achieved_bandwidth_gbs']:>9.2f} {r['achieved_gops']:>7.2f} "
+                    f"{r['on_chip_efficiency'] * 100.0:>7.1f}% {r['bound']:>9}\n")
+
+    print(f"  Results saved to: {output_dir}")
+
+
+def main():
+    args = parse_args()
+
+    print("=" * 70)
+    print("AHASD PIM GEMV Shape Sweep")
+    if args.dry_run:
+        print("(DRY-RUN MODE)")
+    print("=" * 70 + "\n")
+
+    unknown = set(args.models) - {shape[0] for shape in DLM_GEMV_SHAPES}
+    if unknown:
+        print(f"Error: Unknown model(s): {', '.join(sorted(unknown))}")
+        return 1
+    unknown = set(args.ranks) - set(SWEEP_PIM_RANKS)
+    if unknown:
+        print(f"Error: Rank count(s) {sorted(unknown)} not in {SWEEP_PIM_RANKS}")
+        return 1
+
+    hardware = set_precision(load_pim_hardware(args.hardware_script),
+                             args.bytes_per_element, args.peak_gops)
+    print(f"  PIM hardware: {hardware}")
+
+    if args.dry_run:
+        records = generate_mock_records(args, hardware)
+        simulation_type = 'roofline_only'
+    else:
+        log_file = args.from_log
+        if log_file is None:
+            os.makedirs(args.output, exist_ok=True)
+            log_file = os.path.join(args.output, 'sweep.log')
+            run_sweep(args, log_file)
+        records = parse_sweep_log(log_file)
+        simulation_type = 'cycle_accurate'
+
+    if not records:
+        print("    ERROR: No [GEMV-SWEEP] records found")
+        return 1
+
+    results = [analyze_record(r, hardware, args.bytes_per_element) for r in records]
+    write_results(results, hardware, args.output, simulation_type)
+
+    print("\n" + "=" * 70)
+    print("Sweep Complete")
+    print("=" * 70)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,6 +9,10 @@ import os
 import sys
 from pathlib import Path
 
+# Algorithms that draft token trees (top-k candidates per position) instead of a
+# single sequence; the NPU verifies the whole tree in one pass
+TREE_ALGORITHMS = ['specinfer']
+
 def parse_args():
     parser = argparse.ArgumentParser(
         description='Run AHASD simulation with specific configuration')
@@ -17,8 +21,10 @@ def parse_args():
     parser.add_argument('--model', type=str, required=True,
                        help='Model configuration (e.g., llama2-7b-13b)')
     parser.add_argument('--algorithm', type=str, required=True,
-                       choices=['specdec', 'svip', 'adaedl', 'banditspec'],
-                       help='Adaptive drafting algorithm')
+                       choices=['specdec', 'svip', 'adaedl', 'banditspec'] + TREE_ALGORITHMS,
+                       help='Adaptive drafting algorithm (specinfer: token-tree drafting)')
+    parser.add_argument('--tree-top-k', type=int, default=2,
+                       help='Candidates per draft position for tree algorithms (default: 2)')
     
     # AHASD features
     parser.add_argument('--enable-edc', action='store_true',
@@ -27,6 +33,16 @@ def parse_args():
                        help='Enable Time-Aware Pre-Verification Control')
     parser.add_argument('--enable-aau', action='store_true',
                        help='Enable Attention Algorithm Unit')
+    parser.add_argument('--drafting-policy', type=str, default='edc',
+                       choices=['edc', 'threshold', 'learned', 'external'],
+                       help='Drafting-control policy (default: edc, requires --enable-edc)')
+    parser.add_argument('--policy-threshold', type=float, default=2.5,
+                       help='Entropy threshold of the threshold policy (default: 2.5)')
+    parser.add_argument('--policy-model', type=str, default=None,
+                       help='Weights file for the learned policy')
+    parser.add_argument('--policy-host', type=str, default='threshold',
+                       help="Python policy served to the external policy "
+                            "('threshold', 'module:attr' or 'file.py:attr')")
     
     # Hardware parameters
     parser.add_argument('--npu-freq', type=float, default=1000.0,
@@ -35,6 +51,9 @@ def parse_args():
                        help='PIM frequency in MHz (default: 800)')
     parser.add_argument('--num-pim-ranks', type=int, default=16,
                        help='Number of PIM ranks (default: 16)')
+    parser.add_argument('--num-drafting-groups', type=int, default=1,
+                       help='Independent drafting rank groups (default: 1; '
+                            'written to the config, not yet read by the simulator)')
     
     # Simulation parameters
     parser.add_argument('--gen-length', type=int, default=1024,
@@ -84,7 +103,20 @@ def create_config(args):
             "pim_freq_mhz": args.pim_freq,
             "npu_freq_mhz": args.npu_freq,
             "max_draft_length": args.max_draft_length,
-            "num_pim_ranks": args.num_pim_ranks
+            "num_pim_ranks": args.num_pim_ranks,
+            "num_drafting_groups": args.num_drafting_groups,
+            "draft_tree": {
+                "enabled": args.algorithm in TREE_ALGORITHMS,
+                "top_k": args.tree_top_k
+            },
+            "drafting_policy": {
+                "type": args.drafting_policy,
+                "entropy_threshold": args.policy_threshold,
+                "model_path": args.policy_model,
+                "shm_name": f"/ahasd_policy_{os.getpid()}",
+                "timeout_us": 1000000,
+                "host": args.policy_host
+            }
         },
         "simulation": {
             "generation_length": args.gen_length,
@@ -111,10 +143,22 @@ def generate_mock_results(config):
             "drafts_accepted": 75,
             "acceptance_rate": 0.75,
             "average_draft_length": 8.5,
-            "average_entropy": 2.3
+            "average_entropy": 2.3,
+            "accepted_tokens_per_npu_pass": 6.4
         }
     }
     
+    # Add token-tree stats for tree drafting algorithms
+    if config['ahasd']['draft_tree']['enabled']:
+        top_k = config['ahasd']['draft_tree']['top_k']
+        results['metrics']['accepted_tokens_per_npu_pass'] = 7.2
+        results['tree_stats'] = {
+            "top_k": top_k,
+            "tree_drafts": 100,
+            "tree_nodes": 100 * 8 * top_k,
+            "average_nodes_per_tree": 8.0 * top_k
+        }
+    
     # Add EDC stats if enabled
     if config['ahasd']['enable_edc']:
         results['edc_stats'] = {
@@ -130,6 +174,25 @@ def generate_mock_results(config):
             "success_rate": 0.72
         }
     
+    # Add drafting-policy stats if drafting control is active
+    policy = config['ahasd']['drafting_policy']['type']
+    if policy != 'edc' or config['ahasd']['enable_edc']:
+        results['policy_stats'] = {
+            "policy": policy,
+            "decisions": 850,
+            "stop_rate": 0.12
+        }
+    
+    # Add AAU pipeline stats if enabled
+    if config['ahasd']['enable_aau']:
+        results['aau_stats'] = {
+            "operations": 1200,
+            "fused_attention_softmax": 400,
+            "busy_cycles": 52000,
+            "sequential_cycles": 81000,
+            "pipeline_occupancy": 0.82
+        }
+    
     return results
 
 def run_simulation(config, output_dir, verbose=False, dry_run=False):
@@ -138,6 +201,7 @@ def run_simulation(config, output_dir, verbose=False, dry_run=False):
     print(f"Starting simulation...")
     print(f"  Model: {config['model']['draft']} -> {config['model']['target']}")
     print(f"  Algorithm: {config['algorithm']}")
+    print(f"  Drafting Policy: {config['ahasd']['drafting_policy']['type']}")
     print(f"  EDC: {config['ahasd']['enable_edc']}, "
           f"TVC: {config['ahasd']['enable_tvc']}, "
           f"AAU: {config['ahasd']['enable_aau']}")
@@ -183,6 +247,10 @@ def run_simulation(config, output_dir, verbose=False, dry_run=False):
             for key, value in results.get('metrics', {}).items():
                 f.write(f"- {key.replace('_', ' ').title()}: {value}\n")
         
+        if 'aau_stats' in results:
+            print(f"    AAU pipeline occupancy: "
+                  f"{results['aau_stats']['pipeline_occupancy'] * 100:.1f}% [MOCK]")
+        
         print(f"\n  ✓ Dry-run completed successfully")
         print(f"  Mock results saved to: {output_dir}")
         return 0
@@ -236,6 +304,21 @@ def run_simulation(config, output_dir, verbose=False, dry_run=False):
         '--log_level', 'info'
     ]
     
+    # Start the Python policy host for the external drafting policy
+    policy_host = None
+    policy_host_log = None
+    policy_config = config['ahasd']['drafting_policy']
+    if policy_config['type'] == 'external':
+        host_script = os.path.join(os.path.dirname(__file__), 'drafting_policy_host.py')
+        policy_host_log = open(os.path.join(output_dir, 'policy_host.log'), 'w')
+        policy_host = subprocess.Popen(
+            [sys.executable, host_script, '--shm-name', policy_config['shm_name'],
+             '--policy', policy_config['host'],
+             '--entropy-threshold', str(policy_config['entropy_threshold'])],
+            stdout=policy_host_log,
+            stderr=subprocess.STDOUT)
+        print(f"    Drafting policy host started ({policy_config['host']})")
+    
     sim_log = os.path.join(output_dir, 'simulation.log')
     try:
         with open(sim_log, 'w') as log_file:
@@ -254,6 +337,14 @@ def run_simulation(config, output_dir, verbose=False, dry_run=False):
         print(f"    ERROR: Simulation failed with return code {e.returncode}")
         print(f"    Check log file: {sim_log}")
         sys.exit(1)
+    finally:
+        if policy_host is not None:
+            try:
+                policy_host.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                policy_host.terminate()
+                policy_host.wait()
+            policy_host_log.close()
     
     # Save results
     results_file = os.path.join(output_dir, 'results.json')
@@ -279,6 +370,32 @@ def run_simulation(config, output_dir, verbose=False, dry_run=False):
             f.write("\nTVC Statistics:\n")
             for key, value in results['tvc_stats'].items():
                 f.write(f"- {key.replace('_', ' ').title()}: {value}\n")
+        
+        if 'policy_stats' in results:
+            f.write("\nDrafting Policy Statistics:\n")
+            for key, value in results['policy_stats'].items():
+                f.write(f"- {key.replace('_', ' ').title()}: {value}\n")
+        
+        if 'aau_stats' in results:
+            f.write("\nAAU Statistics:\n")
+            for key, value in results['aau_stats'].items():
+                f.write(f"- {key.replace('_', ' ').title()}: {value}\n")
+        
+        if 'tree_stats' in results:
+            f.write("\nToken Tree Statistics:\n")
+            for key, value in results['tree_stats'].items():
+                f.write(f"- {key.replace('_', ' ').title()}: {value}\n")
+        
+        if results.get('drafting_groups'):
+            f.write("\nDrafting Groups:\n")
+            for group in results['drafting_groups']:
+                f.write(f"- Group {group['group_id']} (ranks {group['first_rank']}-"
+                        f"{group['last_rank']}): {group['tasks']} tasks, "
+                        f"utilization {group['utilization']:.3f}\n")
+    
+    if 'aau_stats' in results and 'pipeline_occupancy' in results['aau_stats']:
+        print(f"    AAU pipeline occupancy: "
+              f"{results['aau_stats']['pipeline_occupancy'] * 100:.1f}%")
     
     print(f"\n  ✓ Simulation completed successfully")
     print(f"  Results saved to: {output_dir}")
@@ -329,6 +446,20 @@ def parse_simulation_log(log_file, config):
             if match := re.search(r'Average Draft Entropy:\s*([\d.]+)', content):
                 results['metrics']['average_entropy'] = float(match.group(1))
             
+            if match := re.search(r'Accepted Tokens per NPU Pass:\s*([\d.]+)', content):
+                results['metrics']['accepted_tokens_per_npu_pass'] = float(match.group(1))
+            
+            # Parse token-tree statistics if tree drafting is enabled
+            if config['ahasd']['draft_tree']['enabled']:
+                if match := re.search(r'Tree Drafts:\s*(\d+) \(top-k (\d+)\), Tree Nodes:\s*(\d+), '
+                                      r'Average Nodes per Tree:\s*([\d.]+)', content):
+                    results['tree_stats'] = {
+                        "top_k": int(match.group(2)),
+                        "tree_drafts": int(match.group(1)),
+                        "tree_nodes": int(match.group(3)),
+                        "average_nodes_per_tree": float(match.group(4))
+                    }
+            
             # Parse EDC statistics if enabled
             if config['ahasd']['enable_edc'] and 'EDC Statistics' in content:
                 results['edc_stats'] = {}
@@ -346,6 +477,50 @@ def parse_simulation_log(log_file, config):
                     results['tvc_stats']['prevented_npu_idles'] = int(match.group(1))
                 if match := re.search(r'TVC.*Success.*:\s*(\d+).*\(([\d.]+)%\)', content):
                     results['tvc_stats']['success_rate'] = float(match.group(2)) / 100.0
+            
+            # Parse drafting-policy statistics
+            if 'Drafting Policy Statistics' in content:
+                results['policy_stats'] = {}
+                if match := re.search(r'Policy:\s*(\w+)', content):
+                    results['policy_stats']['policy'] = match.group(1)
+                if match := re.search(r'Decisions:\s*(\d+), Stop:\s*\d+ \(([\d.]+)%\)', content):
+                    results['policy_stats']['decisions'] = int(match.group(1))
+                    results['policy_stats']['stop_rate'] = float(match.group(2)) / 100.0
+                if match := re.search(r'Average Decision Latency:\s*([\d.]+) ns', content):
+                    results['policy_stats']['average_decision_ns'] = float(match.group(1))
+            
+            # Parse AAU pipeline statistics if enabled
+            if config['ahasd']['enable_aau'] and 'AAU Statistics' in content:
+                results['aau_stats'] = {}
+                aau_section = content[content.index('=== AAU Statistics ==='):]
+                if match := re.search(r'Total Operations:\s*(\d+)', aau_section):
+                    results['aau_stats']['operations'] = int(match.group(1))
+                if match := re.search(r'Fused Attention\+Softmax:\s*(\d+)', aau_section):
+                    results['aau_stats']['fused_attention_softmax'] = int(match.group(1))
+                if match := re.search(r'Total Cycles:\s*(\d+)', aau_section):
+                    results['aau_stats']['busy_cycles'] = int(match.group(1))
+                if match := re.search(r'Sequential Cycles:\s*(\d+)', aau_section):
+                    results['aau_stats']['sequential_cycles'] = int(match.group(1))
+                if match := re.search(r'Pipeline Occupancy:\s*([\d.]+)%', aau_section):
+                    results['aau_stats']['pipeline_occupancy'] = float(match.group(1)) / 100.0
+            
+            # Parse per-group drafting statistics of the gated task scheduler
+            group_pattern = (r'Drafting Group (\d+): ranks (\d+)-(\d+), Tasks: (\d+), '
+                             r'Tokens: (\d+), Busy Cycles: (\d+), Idle Cycles: (\d+), '
+                             r'Utilization: ([\d.]+)%')
+            # Every PIM rank reports its scheduler; keep one entry per group
+            groups = {int(m.group(1)): {
+                "group_id": int(m.group(1)),
+                "first_rank": int(m.group(2)),
+                "last_rank": int(m.group(3)),
+                "tasks": int(m.group(4)),
+                "tokens": int(m.group(5)),
+                "busy_cycles": int(m.group(6)),
+                "idle_cycles": int(m.group(7)),
+                "utilization": float(m.group(8)) / 100.0
+            } for m in re.finditer(group_pattern, content)}
+            if groups:
+                results['drafting_groups'] = list(groups.values())
     
     except Exception as e:
         print(f"    Warning: Error parsing simulation log: {e}")